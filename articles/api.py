@@ -0,0 +1,49 @@
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
+from store.api import ApiError, Resource, batch_response, page_response, parse_ids, parse_limit
+from store.pagination import InvalidCursor, decode_cursor
+from .models import Article
+
+ARTICLE_FIELDS = ('id', 'title', 'content', 'image', 'published_date', 'updated_date', 'url')
+ARTICLE_DEFAULT_FIELDS = ('id', 'title', 'image', 'published_date', 'url')
+
+articles = Resource(Article, ARTICLE_FIELDS, ARTICLE_DEFAULT_FIELDS, 'article_detail')
+
+
+@require_GET
+def article_list_api(request):
+    try:
+        fields = articles.parse_fields(request.GET)
+        ids = parse_ids(request.GET)
+        limit = parse_limit(request.GET)
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Same search as the article_list page
+    query = request.GET.get('q', '')
+    queryset = Article.objects.all()
+    if query:
+        queryset = queryset.filter(title__icontains=query)
+    if ids is not None:
+        return batch_response(articles, queryset, ids, fields)
+
+    cursor = request.GET.get('cursor')
+    try:
+        if cursor:
+            decode_cursor(cursor, Article._meta.get_field('published_date'))
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return page_response(articles, queryset, '-published_date', cursor, limit, fields)
+
+
+@require_GET
+def article_detail_api(request, pk):
+    try:
+        fields = articles.parse_fields(request.GET)
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    row = Article.objects.filter(pk=pk).values(*articles.columns(fields)).first()
+    if row is None:
+        raise Http404('No article matches the given query.')
+    return JsonResponse(articles.serialize(row, fields), encoder=DjangoJSONEncoder)
@@ -1,7 +1,14 @@
 from django import forms
 from .models import Article
+from core.forms import DerivativeImageFormMixin
+from store.cache import bump_version
+from .signals import ARTICLES
 
-class ArticleForm(forms.ModelForm):
+class ArticleForm(DerivativeImageFormMixin, forms.ModelForm):
     class Meta:
         model = Article
         fields = ['title', 'content', 'image', 'published_date']
+
+    def derivatives_ready(self):
+        # The article list was rendered before the srcset widths existed
+        bump_version(ARTICLES)
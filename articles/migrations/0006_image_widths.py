@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('articles', '0005_alter_article_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='image_widths',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+    ]
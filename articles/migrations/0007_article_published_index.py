@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('articles', '0006_image_widths'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['published_date', 'id'], name='articles_published_idx'),
+        ),
+    ]
@@ -6,8 +6,14 @@ class Article(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
     image = models.ImageField(upload_to='static/images/articles')
+    image_widths = models.JSONField(default=list, blank=True, editable=False)  # Resized copies, see core.images
     published_date = models.DateTimeField(default=timezone.now)
     updated_date = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['published_date', 'id'], name='articles_published_idx'),
+        ]
+
     def __str__(self):
         return self.title
\ No newline at end of file
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from store.cache import bump_version
+from store.typeahead import TYPEAHEAD
+from .models import Article
+
+# Version namespace of the article pages, see the ETags in articles.views
+ARTICLES = 'articles'
+
+
+@receiver(post_save, sender=Article)
+@receiver(post_delete, sender=Article)
+def invalidate_article_pages(sender, **kwargs):
+    bump_version(ARTICLES)
+    bump_version(TYPEAHEAD)
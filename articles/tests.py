@@ -244,3 +244,85 @@ class DeleteArticleViewTestCase(TestCase):
         # Check for success message
         messages = list(get_messages(response.wsgi_request))
         self.assertTrue(any(message.message == 'Article deleted successfully!' for message in messages))
+
+
+############## PASS ###############
+import shutil
+import tempfile
+from io import BytesIO
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils.http import http_date
+from core.images import process_image
+
+
+class ArticleConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.article = Article.objects.create(
+            title="Composting Basics",
+            content="Start with browns and greens.",
+            image="static/images/articles/test.jpg",
+        )
+        self.url = reverse('article_detail', kwargs={'pk': self.article.pk})
+
+    def test_detail_honours_if_modified_since(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Last-Modified'], http_date(self.article.updated_date.timestamp()))
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_detail_etag_changes_when_the_article_is_edited(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.article.content = "Updated content."
+        self.article.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Updated content.")
+
+    def test_validators_change_when_resized_images_appear(self):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), (80, 160, 40)).save(buffer, 'JPEG')
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            article = Article.objects.create(title="Sowing", content="...",
+                                             image=SimpleUploadedFile('sowing.jpg', buffer.getvalue()))
+            url = reverse('article_detail', kwargs={'pk': article.pk})
+            detail_etag = self.client.get(url)['ETag']
+            list_etag = self.client.get(reverse('article_list'))['ETag']
+            process_image(Article, article.pk, 'image', ArticleForm(instance=article).derivatives_ready)
+            article.refresh_from_db()
+            self.assertEqual(article.image_widths, [160, 320])
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=detail_etag).status_code, 200)
+            self.assertEqual(self.client.get(reverse('article_list'), HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_list_etag_changes_when_an_article_is_added(self):
+        etag = self.client.get(reverse('article_list'))['ETag']
+        self.assertEqual(self.client.get(reverse('article_list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Article.objects.create(title="Mulching", content="...", image="static/images/articles/test.jpg")
+        self.assertEqual(self.client.get(reverse('article_list'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+############## PASS ###############
+import json
+from store.pagination import encode_cursor
+
+
+class ArticleApiTestCase(TestCase):
+    def test_list_pages_newest_first(self):
+        for day in range(1, 4):
+            Article.objects.create(title=f"Article {day}", content="...", image="static/images/articles/test.jpg",
+                                   published_date=timezone.now() - timezone.timedelta(days=day))
+        response = self.client.get(reverse('article_list_api'), {'fields': 'title', 'limit': 2})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['results'], [{'title': 'Article 1'}, {'title': 'Article 2'}])
+        response = self.client.get(reverse('article_list_api'), {'fields': 'title', 'cursor': data['next']})
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['results'], [{'title': 'Article 3'}])
+        self.assertIsNone(data['next'])
+
+    def test_tampered_cursor_is_rejected(self):
+        response = self.client.get(reverse('article_list_api'), {'cursor': encode_cursor('notadate', 1)})
+        self.assertEqual(response.status_code, 400)
@@ -1,10 +1,13 @@
 from django.urls import path
 from . import views
 from .views import add_article, edit_article, delete_article
+from .api import article_list_api, article_detail_api
 
 urlpatterns = [
     path('', views.article_list, name='article_list'),
     path('<int:pk>/', views.article_detail, name='article_detail'),
+    path('api/', article_list_api, name='article_list_api'),
+    path('api/<int:pk>/', article_detail_api, name='article_detail_api'),
     #SUPERUSER
     path('add/', add_article, name='add_article'), 
     path('edit/<int:pk>/', edit_article, name='edit_article'), 
@@ -1,6 +1,29 @@
 from django.shortcuts import render, get_object_or_404
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from core.conditional import page_etag
+from store.cache import get_version
 from .models import Article
+from .signals import ARTICLES
 
+
+def article_list_etag(request):
+    return page_etag(request, get_version(ARTICLES), request.get_full_path())
+
+
+def article_updated(request, pk):
+    return Article.objects.filter(pk=pk).values_list('updated_date', flat=True).first()
+
+
+def article_detail_etag(request, pk):
+    updated = article_updated(request, pk)
+    if updated is None:
+        return None
+    return page_etag(request, pk, updated.isoformat())
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=article_list_etag)
 def article_list(request):
     query = request.GET.get('q', '')
     if query:
@@ -16,6 +39,8 @@ def article_list(request):
 
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=article_detail_etag, last_modified_func=article_updated)
 def article_detail(request, pk):
     article = get_object_or_404(Article, pk=pk)
     return render(request, 'articles/article_detail.html', {'article': article})
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Profile
+from .models import Campaign, OutboxEmail, Profile
 
 # Register your models here.
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+admin.site.register(OutboxEmail)
+admin.site.register(Campaign)
@@ -0,0 +1,28 @@
+import hashlib
+
+from django.contrib.messages import get_messages
+from store.cart import get_cart
+
+
+def page_etag(request, *parts):
+    """
+    Build an ETag for a rendered page from the content it depends on
+    (parts) and the per-user bits of base.html: who is logged in, their
+    cart badge and newsletter button. Returns None while messages are
+    waiting to be shown, so the page is always rendered in that case.
+    """
+    if len(get_messages(request)):
+        return None
+    user = request.user
+    cart_count = get_cart(request).count()
+    if user.is_authenticated:
+        profile = getattr(user, 'profile', None)
+        user_state = (
+            user.pk,
+            user.is_superuser,
+            cart_count,
+            profile.is_subscribed if profile else None,
+        )
+    else:
+        user_state = ('anonymous', cart_count)
+    return hashlib.md5(repr((parts, user_state)).encode()).hexdigest()
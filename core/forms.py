@@ -0,0 +1,24 @@
+from .images import schedule_derivatives
+
+
+class DerivativeImageFormMixin:
+    """
+    Model form mixin that resizes newly uploaded images off the request
+    thread. Each field listed in derivative_image_fields needs a
+    <field>_widths JSONField on the model to record the generated sizes.
+    """
+    derivative_image_fields = ('image',)
+
+    def derivatives_ready(self):
+        pass
+
+    def save(self, commit=True):
+        changed = [name for name in self.derivative_image_fields if name in self.changed_data]
+        for name in changed:
+            # The old derivatives do not match the new file name
+            setattr(self.instance, f'{name}_widths', [])
+        instance = super().save(commit=commit)
+        if commit:
+            for name in changed:
+                schedule_derivatives(instance, name, self.derivatives_ready)
+        return instance
@@ -0,0 +1,87 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Widths (in pixels) of the resized copies stored next to each uploaded image
+DERIVATIVE_WIDTHS = getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (160, 320, 640, 1280))
+DERIVATIVE_FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}_{width}w.{extension}'
+
+
+def generate_derivatives(field_file):
+    """
+    Write resized WebP and JPEG copies of an image next to the original
+    and return the widths that were generated. Widths larger than the
+    original are skipped.
+    """
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as f:
+        original = Image.open(f)
+        original.load()
+    original = ImageOps.exif_transpose(original)
+
+    widths = []
+    for width in DERIVATIVE_WIDTHS:
+        if width >= original.width:
+            break
+        height = max(round(original.height * width / original.width), 1)
+        resized = original.resize((width, height), Image.LANCZOS)
+        for extension, image_format, options in DERIVATIVE_FORMATS:
+            image = resized
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, image_format, **options)
+            name = derivative_name(field_file.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+        widths.append(width)
+    return widths
+
+
+def process_image(model, pk, field_name, on_done=None):
+    """ Generate the derivatives of a saved instance's image and record their widths """
+    try:
+        instance = model.objects.get(pk=pk)
+        field_file = getattr(instance, field_name)
+        if not field_file:
+            return
+        widths = generate_derivatives(field_file)
+        # Skip the update if the image was replaced while we were working. The
+        # update skips auto_now, so touch those fields for the pages' validators
+        now = timezone.now()
+        touched = {field.name: now for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)}
+        model.objects.filter(pk=pk, **{field_name: field_file.name}).update(
+            **{f'{field_name}_widths': widths}, **touched
+        )
+        if on_done is not None:
+            on_done()
+    except Exception:
+        logger.exception('Could not generate image derivatives for %s %s', model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(instance, field_name='image', on_done=None):
+    """ Process an uploaded image on a background thread once the upload is committed """
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: _executor.submit(process_image, model, pk, field_name, on_done))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from core.newsletter import BENCHMARK_BACKENDS, CONNECTIONS, PAGE_SIZE, benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure campaign throughput against a local email backend with throwaway subscribers; '
+            'locmem keeps every message in memory, so prefer console for large runs')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=10000)
+        parser.add_argument('--backend', choices=sorted(BENCHMARK_BACKENDS), default='console')
+        parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+        parser.add_argument('--connections', type=int, default=CONNECTIONS)
+
+    def handle(self, *args, **options):
+        sent, elapsed, growth = benchmark(options['subscribers'], options['backend'],
+                                            options['page_size'], options['connections'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {sent} messages over {options["backend"]} in {elapsed:.1f}s '
+            f'({sent / elapsed if elapsed else 0:.0f}/s); memory grew by {growth / 1024:.1f} MB while sending.'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from core.models import Campaign
+from core.newsletter import CONNECTIONS, PAGE_SIZE, send_campaign
+
+
+class Command(BaseCommand):
+    help = 'Send a newsletter campaign to every subscriber; an interrupted run resumes from its checkpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign', type=int, help='Campaign id')
+        parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Subscribers per page and checkpoint')
+        parser.add_argument('--connections', type=int, default=CONNECTIONS, help='Mail server connections to send over')
+        parser.add_argument('--rate', type=float, default=None, help='Most messages per second, across connections')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.get(pk=options['campaign'])
+        except Campaign.DoesNotExist:
+            raise CommandError(f"No campaign with id {options['campaign']}")
+        try:
+            sent = send_campaign(campaign, page_size=options['page_size'], connections=options['connections'],
+                                 rate=options['rate'])
+        except OSError as e:  # SMTP errors included; the checkpoint is saved
+            raise CommandError(f'Lost the mail server ({e}) after {campaign.sent_count} messages; '
+                               f'run again to resume.')
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} messages; {campaign.sent_count} in total for this campaign, '
+                                             f'{campaign.failed_count} refused.'))
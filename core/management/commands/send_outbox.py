@@ -0,0 +1,38 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from core.outbox import BATCH_SIZE, drain
+
+
+class Command(BaseCommand):
+    help = 'Send the queued emails of the outbox; with --loop it keeps running as the mail worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new mail instead of exiting')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        # One connection serves every poll while mail keeps coming, and is
+        # closed when a poll finds nothing, so an idle worker holds none
+        connection = get_connection()
+        while True:
+            started = time.monotonic()
+            try:
+                sent, failed = drain(batch_size=options['batch_size'], connection=connection)
+            except OSError as e:  # The SMTP server is unreachable, try again on the next poll
+                connection.close()
+                if not options['loop']:
+                    raise
+                self.stderr.write(f'Could not connect to the mail server: {e}')
+            else:
+                if not (sent or failed):
+                    connection.close()
+                if sent or failed or not options['loop']:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Sent {sent} emails, {failed} failed, in {time.monotonic() - started:.1f}s.'))
+            if not options['loop']:
+                connection.close()
+                return
+            time.sleep(options['interval'])
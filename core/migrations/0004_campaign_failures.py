@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_campaigns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='failed_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='campaign',
+            name='sent_ahead',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -11,3 +11,57 @@ class Profile(models.Model):
         return f'{self.user.username} Profile'
 
 
+class OutboxEmail(models.Model):
+    # Mail waiting to be sent by core.outbox. Rows are written in the
+    # transaction of whatever caused them, so a rollback sends nothing
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (DEAD, 'Gave up'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f'{self.subject} to {", ".join(self.to)} ({self.status})'
+
+
+class Campaign(models.Model):
+    # A newsletter mailing, sent by core.newsletter.send_campaign
+    DRAFT = 'draft'
+    SENDING = 'sending'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (DRAFT, 'Draft'),
+        (SENDING, 'Sending'),
+        (DONE, 'Sent'),
+    ]
+    subject = models.CharField(max_length=255)
+    body = models.TextField(help_text='Template source; {{ username }} and {{ email }} are available')
+    from_email = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=DRAFT)
+    last_user_id = models.BigIntegerField(default=0)  # Checkpoint: every subscriber up to this id has been sent to
+    sent_count = models.PositiveIntegerField(default=0)
+    failed_count = models.PositiveIntegerField(default=0)  # Recipients the mail server refused; they are skipped
+    # Subscribers past the checkpoint that a page cut short by a lost connection already reached
+    sent_ahead = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.subject} ({self.status})'
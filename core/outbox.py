@@ -0,0 +1,114 @@
+"""
+Transactional mail goes through an outbox instead of SMTP. Views call
+enqueue(), which only inserts a row, and the send_outbox worker drains
+the rows in batches over one persistent SMTP connection. Failed messages
+are retried with exponential backoff and given up on after MAX_ATTEMPTS.
+"""
+import logging
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+BACKOFF = timedelta(minutes=1)  # Doubles with every failed attempt
+MAX_BACKOFF = timedelta(hours=6)
+# A claimed batch is invisible to other workers for this long; a worker
+# that dies mid-batch leaves its messages to be picked up again after it
+LEASE = timedelta(minutes=5)
+
+
+def enqueue(subject, body, to, from_email=None):
+    """ Queue a message in the caller's transaction; it is sent by the worker once that commits """
+    return OutboxEmail.objects.create(subject=subject, body=body, to=list(to),
+                                      from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+                                      next_attempt_at=timezone.now())
+
+
+def backoff(attempts):
+    return min(BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+
+
+def claim(batch_size=BATCH_SIZE, now=None):
+    """ Lease the next due messages to this worker; SKIP LOCKED keeps concurrent workers apart """
+    now = now or timezone.now()
+    with transaction.atomic():
+        emails = list(OutboxEmail.objects.select_for_update(skip_locked=True)
+                      .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+                      .order_by('next_attempt_at', 'pk')[:batch_size])
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=now + LEASE)
+    return emails
+
+
+def send_batch(emails, connection):
+    """ Send claimed messages over an open connection and record each outcome; returns how many went out """
+    sent = []
+    failed = []
+    for email in emails:
+        message = EmailMessage(email.subject, email.body, email.from_email, email.to, connection=connection)
+        try:
+            message.send()
+        except (smtplib.SMTPException, OSError) as e:
+            if isinstance(e, smtplib.SMTPServerDisconnected):
+                connection.close()
+                try:
+                    connection.open()
+                except (smtplib.SMTPException, OSError):
+                    pass  # The next send opens one itself
+            email.attempts += 1
+            email.last_error = f'{type(e).__name__}: {e}'
+            if email.attempts >= MAX_ATTEMPTS:
+                email.status = OutboxEmail.DEAD
+                logger.error('Giving up on outbox email %s after %d attempts: %s',
+                             email.pk, email.attempts, email.last_error)
+            else:
+                email.next_attempt_at = timezone.now() + backoff(email.attempts)
+            failed.append(email)
+        else:
+            email.status = OutboxEmail.SENT
+            email.sent_at = timezone.now()
+            sent.append(email)
+    OutboxEmail.objects.bulk_update(sent, ['status', 'sent_at'])
+    OutboxEmail.objects.bulk_update(failed, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+    return len(sent)
+
+
+def drain(batch_size=BATCH_SIZE, connection=None):
+    """
+    Send everything that is due, batch after batch, over one connection.
+    It is only opened once there is mail to send; a connection passed in
+    is left open for the caller to reuse. Returns (sent, failed)
+    """
+    sent = failed = 0
+    emails = claim(batch_size)
+    if not emails:
+        return sent, failed
+    owned = connection is None
+    connection = connection or get_connection()
+    try:
+        connection.open()
+    except (smtplib.SMTPException, OSError):
+        # Nothing was attempted, so give the batch straight back instead of waiting out the lease
+        OutboxEmail.objects.filter(pk__in=[email.pk for email in emails]).update(next_attempt_at=timezone.now())
+        raise
+    try:
+        while emails:
+            started = time.monotonic()
+            batch_sent = send_batch(emails, connection)
+            sent += batch_sent
+            failed += len(emails) - batch_sent
+            logger.info('Outbox: sent %d of %d emails in %.3fs', batch_sent, len(emails), time.monotonic() - started)
+            emails = claim(batch_size)
+    finally:
+        if owned:
+            connection.close()
+    return sent, failed
@@ -0,0 +1,34 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from core.images import derivative_name
+
+register = template.Library()
+
+
+def _srcset(image, widths, extension):
+    return ', '.join(
+        f'{image.storage.url(derivative_name(image.name, width, extension))} {width}w'
+        for width in widths
+    )
+
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', **attrs):
+    """
+    Render an image with srcset/sizes over its resized copies, e.g.
+    {% responsive_image product.image sizes="80px" alt=product.name class="img-fluid" %}
+    Falls back to a plain <img> until the copies have been generated.
+    """
+    if not image:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    widths = getattr(image.instance, f'{image.field.name}_widths', None) or []
+    if not widths:
+        return format_html('<img src="{}"{}>', image.url, flatatt(attrs))
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        _srcset(image, widths, 'webp'), sizes,
+        image.url, _srcset(image, widths, 'jpg'), sizes, flatatt(attrs),
+    )
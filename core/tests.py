@@ -113,3 +113,269 @@ class Handler404ViewTestCase(TestCase):
         self.assertEqual(response.status_code, 404)
         self.assertTemplateUsed(response, 'errors/404.html')
 
+
+
+############## PASS ################
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+from PIL import Image
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template import Context, Template
+from django.test import override_settings
+from store.forms import ProductForm
+from store.models import Product
+from .images import derivative_name, process_image
+
+
+def make_image(width, height):
+    buffer = BytesIO()
+    Image.new('RGBA', (width, height), (80, 160, 40, 255)).save(buffer, 'PNG')
+    return SimpleUploadedFile('garden.png', buffer.getvalue(), content_type='image/png')
+
+
+class ImageDerivativesTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_process_image_writes_resized_copies(self):
+        product = Product.objects.create(name='Rake', description='Rake', price=5, category='supply', image=make_image(700, 350))
+        process_image(Product, product.pk, 'image')
+        product.refresh_from_db()
+        self.assertEqual(product.image_widths, [160, 320, 640])
+        for width in product.image_widths:
+            for extension in ('webp', 'jpg'):
+                path = os.path.join(self.media_root, derivative_name(product.image.name, width, extension))
+                with Image.open(path) as resized:
+                    self.assertEqual(resized.size, (width, width // 2))
+
+    def test_product_form_schedules_processing_for_new_uploads_only(self):
+        data = {'name': 'Rake', 'description': 'Rake', 'price': 5, 'category': 'supply', 'stock': 1}
+        with patch('core.forms.schedule_derivatives') as schedule:
+            product = ProductForm(data, {'image': make_image(200, 200)}).save()
+            schedule.assert_called_once()
+            schedule.reset_mock()
+            ProductForm(dict(data, stock=2), instance=product).save()
+            schedule.assert_not_called()
+
+    def test_responsive_image_tag(self):
+        template = Template('{% load image_tags %}{% responsive_image product.image sizes="80px" alt=product.name %}')
+        product = Product.objects.create(name='Rake', description='Rake', price=5, category='supply', image=make_image(400, 400))
+        html = template.render(Context({'product': product}))
+        self.assertNotIn('srcset', html)
+        self.assertIn('alt="Rake"', html)
+
+        process_image(Product, product.pk, 'image')
+        product.refresh_from_db()
+        html = template.render(Context({'product': product}))
+        self.assertIn('<source type="image/webp"', html)
+        self.assertIn('_160w.webp 160w, ', html)
+        self.assertIn('_320w.jpg 320w"', html)
+        self.assertIn('sizes="80px"', html)
+
+
+############## PASS ################
+import io
+import smtplib
+import threading
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.locmem import EmailBackend
+from django.db import transaction
+from django.utils import timezone
+from . import outbox
+from .models import OutboxEmail
+
+
+class FlakyBackend(EmailBackend):
+    """ locmem, but counts connections and refuses mail to bad@example.com """
+    opened = 0
+    connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        FlakyBackend.opened += 1
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        if any('bad@example.com' in message.to for message in messages):
+            raise smtplib.SMTPRecipientsRefused({'bad@example.com': (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+class DroppingBackend(EmailBackend):
+    """ locmem, but the mail server goes away for good after budget messages """
+    budget = 0
+    lock = threading.Lock()
+
+    def open(self):
+        if DroppingBackend.budget <= 0:
+            raise ConnectionRefusedError('Connection refused')
+        return True
+
+    def send_messages(self, messages):
+        with DroppingBackend.lock:
+            if DroppingBackend.budget < len(messages):
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            DroppingBackend.budget -= len(messages)
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='core.tests.FlakyBackend')
+class OutboxTestCase(TestCase):
+    def setUp(self):
+        FlakyBackend.opened = 0
+        self.user = User.objects.create_user(username='gardener', password='testpassword', email='g@example.com')
+        self.client.login(username='gardener', password='testpassword')
+
+    def test_subscribe_queues_the_confirmation_instead_of_sending_it(self):
+        self.client.post(reverse('subscribe'))
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.to, email.status), (['g@example.com'], OutboxEmail.PENDING))
+
+        call_command('send_outbox', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+
+    def test_drain_reuses_one_connection(self):
+        for i in range(25):
+            outbox.enqueue(f'Note {i}', 'Hello', [f'user{i}@example.com'])
+        self.assertEqual(outbox.drain(batch_size=10), (25, 0))
+        self.assertEqual(len(mail.outbox), 25)
+        self.assertEqual(FlakyBackend.opened, 1)
+        self.assertEqual(outbox.drain(), (0, 0))
+        self.assertEqual(FlakyBackend.opened, 1)  # Nothing to send, so no connection
+
+    def test_worker_keeps_its_connection_while_busy_and_drops_it_when_idle(self):
+        outbox.enqueue('First', 'Hello', ['a@example.com'])
+        polls = [
+            lambda: outbox.enqueue('Second', 'Hello', ['b@example.com']),  # Sent over the same connection
+            lambda: None,  # The next poll finds nothing and closes it
+            lambda: outbox.enqueue('Third', 'Hello', ['c@example.com']),  # Reconnects
+        ]
+
+        def sleep(seconds):
+            if not polls:
+                raise KeyboardInterrupt
+            polls.pop(0)()
+
+        with patch('core.management.commands.send_outbox.time.sleep', sleep), self.assertRaises(KeyboardInterrupt):
+            call_command('send_outbox', loop=True, stdout=io.StringIO())
+        self.assertEqual([m.subject for m in mail.outbox], ['First', 'Second', 'Third'])
+        self.assertEqual(FlakyBackend.opened, 2)
+
+    def test_failures_back_off_then_dead_letter(self):
+        outbox.enqueue('Hello', 'Hello', ['bad@example.com'])
+        outbox.enqueue('Hello', 'Hello', ['good@example.com'])
+        self.assertEqual(outbox.drain(), (1, 1))
+        bad = OutboxEmail.objects.get(to=['bad@example.com'])
+        self.assertEqual((bad.status, bad.attempts), (OutboxEmail.PENDING, 1))
+        self.assertIn('SMTPRecipientsRefused', bad.last_error)
+        self.assertGreater(bad.next_attempt_at, timezone.now() + outbox.BACKOFF / 2)
+        self.assertEqual(outbox.drain(), (0, 0))  # Not due yet
+
+        for attempt in range(2, outbox.MAX_ATTEMPTS + 1):
+            OutboxEmail.objects.filter(pk=bad.pk).update(next_attempt_at=timezone.now())
+            outbox.drain()
+        bad.refresh_from_db()
+        self.assertEqual((bad.status, bad.attempts), (OutboxEmail.DEAD, outbox.MAX_ATTEMPTS))
+        self.assertEqual(outbox.claim(), [])
+
+    def test_rolled_back_work_sends_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            outbox.enqueue('Hello', 'Hello', ['good@example.com'])
+            raise RuntimeError
+        self.assertFalse(OutboxEmail.objects.exists())
+
+
+############## PASS ################
+import time
+from .models import Campaign
+from .newsletter import RateLimiter, send_campaign
+
+
+class NewsletterTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'reader{i}', email=f'reader{i}@example.com')
+                      for i in range(12)]
+        Profile.objects.filter(user__in=self.users[::4]).update(is_subscribed=False)
+        self.campaign = Campaign.objects.create(subject='Spring sowing', body='Hi {{ username }} & welcome!')
+
+    def test_sends_to_subscribers_over_pooled_connections(self):
+        FlakyBackend.opened = 0
+        sent = send_campaign(self.campaign, page_size=5, connections=2, backend='core.tests.FlakyBackend')
+        self.assertEqual(sent, 9)
+        self.assertEqual(FlakyBackend.opened, 2)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox),
+                         sorted(u.email for i, u in enumerate(self.users) if i % 4))
+        self.assertIn('Hi reader1 & welcome!', [m.body for m in mail.outbox])
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count, self.campaign.last_user_id),
+                         (Campaign.DONE, 9, self.users[-1].pk))
+        self.assertEqual(send_campaign(self.campaign), 0)
+
+    def test_resumes_from_the_checkpoint(self):
+        self.campaign.status = Campaign.SENDING
+        self.campaign.last_user_id = self.users[5].pk
+        self.campaign.sent_count = 4
+        self.campaign.save()
+        out = io.StringIO()
+        call_command('send_newsletter', self.campaign.pk, page_size=2, stdout=out)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), [f'reader{i}@example.com' for i in (10, 11, 6, 7, 9)])
+        self.assertIn('Sent 5 messages; 9 in total', out.getvalue())
+
+    def test_refused_recipients_are_skipped_and_counted(self):
+        User.objects.filter(pk=self.users[5].pk).update(email='bad@example.com')
+        sent = send_campaign(self.campaign, page_size=5, connections=2, backend='core.tests.FlakyBackend')
+        self.assertEqual(sent, 8)
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count, self.campaign.failed_count),
+                         (Campaign.DONE, 8, 1))
+
+    def test_lost_connection_checkpoints_what_was_sent(self):
+        DroppingBackend.budget = 5
+        with self.assertRaises(OSError):
+            send_campaign(self.campaign, page_size=100, connections=3, backend='core.tests.DroppingBackend')
+        first_run = [m.to[0] for m in mail.outbox]
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.status, self.campaign.sent_count), (Campaign.SENDING, 5))
+
+        DroppingBackend.budget = 100
+        self.assertEqual(send_campaign(self.campaign, backend='core.tests.DroppingBackend'), 4)
+        everyone = [m.to[0] for m in mail.outbox]
+        self.assertEqual(len(everyone), len(set(everyone)))  # Nobody got it twice
+        self.assertEqual(sorted(everyone), sorted(u.email for i, u in enumerate(self.users) if i % 4))
+        self.assertTrue(set(first_run) < set(everyone))
+
+    def test_streams_in_constant_queries_per_page(self):
+        with self.assertNumQueries(2 + 3 * 2 + 1):  # Start, three pages with their checkpoints, one empty page, done
+            send_campaign(self.campaign, page_size=4, connections=1, backend='django.core.mail.backends.locmem.EmailBackend')
+
+    def test_rate_limit(self):
+        limiter = RateLimiter(200)
+        started = time.monotonic()
+        for _ in range(5):
+            limiter.wait(10)
+        self.assertGreaterEqual(time.monotonic() - started, 0.19)
+
+    def test_benchmark_command(self):
+        out = io.StringIO()
+        call_command('benchmark_newsletter', subscribers=300, backend='console', page_size=100, stdout=out)
+        self.assertIn('Sent 300 messages over console', out.getvalue())
+        self.assertEqual(User.objects.count(), 12)
+        self.assertFalse(Campaign.objects.exclude(pk=self.campaign.pk).exists())
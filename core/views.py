@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.mail import send_mail
+from . import outbox
 from .models import Profile
 from reviews.models import Review
 
@@ -46,17 +46,8 @@ def subscribe(request):
             f"The Kitchen Garden Team"
         )
 
-    try:
-        send_mail(
-            email_subject,
-            email_body,
-            'kitchengardenci@gmail.com',
-            [request.user.email],
-            fail_silently=False,
-        )
-        messages.info(request, "A confirmation email has been sent to your email address.")
-    except Exception as e:
-        messages.error(request, f"There was an error sending the confirmation email: {e}")
+    outbox.enqueue(email_subject, email_body, [request.user.email], 'kitchengardenci@gmail.com')
+    messages.info(request, "A confirmation email is on its way to your email address.")
 
     return redirect('home')
 
@@ -30,23 +30,109 @@ document.addEventListener('DOMContentLoaded', function() {
     document.getElementById('currentYear').textContent = currentYear;
 });
 
-// Function to handle adding products to the cart
-function addToCart(productId) {
+// CSRF token for fetch() POST requests, rendered into base.html
+function getCsrfToken() {
+    var meta = document.querySelector('meta[name="csrf-token"]');
+    return meta ? meta.content : '';
+}
+
+// Show a message like the ones rendered by base.html, hiding it after 3 seconds
+function showMessage(text, isError) {
+    var container = document.getElementById('message-container');
+    if (!container) {
+        container = document.createElement('div');
+        container.id = 'message-container';
+        container.setAttribute('role', 'alert');
+        document.querySelector('main').prepend(container);
+    }
+    container.className = 'alert ' + (isError ? 'alert-danger' : 'alert-success');
+    container.textContent = text;
+    container.style.display = '';
+    clearTimeout(container.hideTimer);
+    container.hideTimer = setTimeout(function() { container.style.display = 'none'; }, 3000);
+}
 
-    fetch(`/add_to_cart/${productId}/`, {
+// Add to cart without leaving the page; the link's href stays the fallback without JavaScript
+function addToCart(url) {
+    return fetch(url, {
         method: 'POST',
         headers: {
-            'Content-Type': 'application/json',
-            'X-CSRFToken': getCookie('csrftoken'),
+            'Accept': 'application/json',
+            'X-CSRFToken': getCsrfToken(),
         },
-        body: JSON.stringify({ productId: productId }) 
     })
-    .then(response => response.json())  
+    .then(response => response.json())
     .then(data => {
-        if (data.success) {
-            showMessage('Item added to cart successfully!');  
-        } else {
-            alert('Something went wrong. Please try again.');  
-        }
+        document.querySelectorAll('.cart-count').forEach(function(badge) {
+            badge.textContent = data.cart.count;
+        });
+        showMessage(data.message, !data.ok);
+        return data;
+    })
+    .catch(function() {
+        // The item may already have been added, so following the link could add it twice
+        showMessage('Your cart could not be updated. Please reload the page to see what it holds.', true);
     });
 }
+
+document.addEventListener('click', function(event) {
+    var link = event.target.closest('a[data-add-to-cart]');
+    if (link && !link.classList.contains('disabled')) {
+        event.preventDefault();
+        addToCart(link.href);
+    }
+});
+
+// Typeahead suggestions for search boxes with a data-autocomplete-url attribute
+document.addEventListener('DOMContentLoaded', function() {
+    document.querySelectorAll('input[data-autocomplete-url]').forEach(function(input) {
+        var list = document.createElement('div');
+        list.className = 'list-group position-absolute w-100 shadow-sm';
+        list.style.zIndex = 1000;
+        input.form.appendChild(list);
+        var timer = null;
+        var lastQuery = '';
+
+        input.addEventListener('input', function() {
+            clearTimeout(timer);
+            // Wait for a short pause in typing before asking the server
+            timer = setTimeout(function() {
+                var query = input.value.trim();
+                if (query === lastQuery) {
+                    return;
+                }
+                lastQuery = query;
+                if (!query) {
+                    list.innerHTML = '';
+                    return;
+                }
+                fetch(input.dataset.autocompleteUrl + '?q=' + encodeURIComponent(query))
+                    .then(response => response.json())
+                    .then(data => {
+                        if (query !== lastQuery) {
+                            return;
+                        }
+                        list.innerHTML = '';
+                        data.results.forEach(function(result) {
+                            var link = document.createElement('a');
+                            link.className = 'list-group-item list-group-item-action';
+                            link.href = result.url;
+                            link.textContent = result.title;
+                            if (result.type === 'article') {
+                                var badge = document.createElement('span');
+                                badge.className = 'badge badge-secondary ml-2';
+                                badge.textContent = 'Article';
+                                link.appendChild(badge);
+                            }
+                            list.appendChild(link);
+                        });
+                    });
+            }, 150);
+        });
+
+        // Hide the suggestions when the search box loses focus
+        input.addEventListener('blur', function() {
+            setTimeout(function() { list.innerHTML = ''; lastQuery = ''; }, 200);
+        });
+    });
+});
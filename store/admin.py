@@ -1,7 +1,44 @@
+from django import forms
 from django.contrib import admin
-from .models import Product, CartItem , Order
+from .models import Product, CartItem , Order, StockMovement
+from . import inventory
+
+
+class ProductAdminForm(forms.ModelForm):
+    adjust_stock = forms.IntegerField(
+        required=False,
+        help_text='Units to add, or remove with a negative number. Recorded in the stock ledger.',
+    )
+
+    class Meta:
+        model = Product
+        fields = '__all__'
+
+
+@admin.register(Product)
+class ProductAdmin(admin.ModelAdmin):
+    form = ProductAdminForm
+
+    def get_readonly_fields(self, request, obj=None):
+        # Stock of an existing product only changes through store.inventory, so the ledger sees it
+        return ('stock',) if obj is not None else ()
+
+    def get_fields(self, request, obj=None):
+        fields = super().get_fields(request, obj)
+        return fields if obj is not None else [name for name in fields if name != 'adjust_stock']
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            return super().save_model(request, obj, form, change)  # The opening stock is recorded on create
+        # Leave stock out of the save so sales made while the form was open are kept, and the
+        # image widths too unless a new image replaces them, as core.images records them later
+        skipped = {'stock'} if 'image' in form.changed_data else {'stock', 'image_widths'}
+        obj.save(update_fields=[field.name for field in Product._meta.concrete_fields
+                                if not field.primary_key and field.name not in skipped])
+        delta = form.cleaned_data.get('adjust_stock')
+        if delta:
+            obj.stock = inventory.adjust(obj.pk, delta, StockMovement.ADJUSTMENT)
+
 
-# Register the Product model
-admin.site.register(Product)
 admin.site.register(CartItem)
-admin.site.register(Order)
\ No newline at end of file
+admin.site.register(Order)
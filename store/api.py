@@ -0,0 +1,171 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
+
+from .facets import apply_filters, parse_filters
+from .models import Product
+from .pagination import InvalidCursor, page_cursors, seek, sort_options
+from .search import search_products
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 1000
+MAX_IDS = 100
+STREAM_CHUNK_SIZE = 200
+
+PRODUCT_FIELDS = ('id', 'name', 'description', 'price', 'category', 'stock', 'image', 'created_at', 'updated_at', 'url')
+PRODUCT_DEFAULT_FIELDS = ('id', 'name', 'price', 'category', 'stock', 'image', 'url')
+
+
+class ApiError(ValueError):
+    pass
+
+
+class Resource:
+    """ How a model is exposed: its public fields and how to serialize a values() row """
+
+    def __init__(self, model, fields, default_fields, url_name):
+        self.model = model
+        self.fields = fields
+        self.default_fields = default_fields
+        self.url_name = url_name
+        self.image_storage = model._meta.get_field('image').storage
+
+    def parse_fields(self, params):
+        raw = params.get('fields')
+        if not raw:
+            return list(self.default_fields)
+        fields = [field.strip() for field in raw.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in self.fields]
+        if unknown:
+            raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def columns(self, fields):
+        """ The database columns needed to serialize fields """
+        return {field for field in fields if field != 'url'} | {'pk'}
+
+    def serialize(self, row, fields):
+        data = {}
+        for field in fields:
+            if field == 'url':
+                data['url'] = reverse(self.url_name, args=[row['pk']])
+            elif field == 'image':
+                data['image'] = self.image_storage.url(row['image']) if row['image'] else None
+            else:
+                data[field] = row[field]
+        return data
+
+
+products = Resource(Product, PRODUCT_FIELDS, PRODUCT_DEFAULT_FIELDS, 'product_detail')
+
+
+def parse_ids(params):
+    raw = params.get('ids')
+    if not raw:
+        return None
+    try:
+        ids = [int(pk) for pk in raw.split(',') if pk.strip()]
+    except ValueError:
+        raise ApiError('ids must be a comma separated list of integers')
+    if len(ids) > MAX_IDS:
+        raise ApiError(f'At most {MAX_IDS} ids can be fetched at once')
+    return ids
+
+
+def parse_limit(params):
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise ApiError('limit must be an integer')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def _dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder)
+
+
+def batch_response(resource, queryset, ids, fields):
+    """ Fetch every requested id with one query, in the order they were asked for """
+    rows = {row['pk']: row for row in queryset.filter(pk__in=ids).values(*resource.columns(fields))}
+    results = [resource.serialize(rows[pk], fields) for pk in dict.fromkeys(ids) if pk in rows]
+    return JsonResponse({'results': results}, encoder=DjangoJSONEncoder)
+
+
+def page_response(resource, queryset, ordering, cursor, limit, fields):
+    """
+    Stream one cursor page as {"results": [...], "next": ..., "previous": ...}.
+    Forward pages are serialized row by row from a database iterator, so
+    a large page is never held in memory as a whole.
+    """
+    queryset, name, backwards = seek(queryset, ordering, cursor)
+    rows = queryset.values(*resource.columns(fields) | {name})[:limit + 1]
+
+    def generate():
+        yield '{"results":['
+        first = last = None
+        has_more = False
+        if backwards:
+            page = list(rows)
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+        else:
+            page = rows.iterator(chunk_size=STREAM_CHUNK_SIZE)
+        count = 0
+        for row in page:
+            if count == limit:
+                has_more = True
+                break
+            yield (',' if count else '') + _dumps(resource.serialize(row, fields))
+            first = first or row
+            last = row
+            count += 1
+        next_cursor = previous_cursor = None
+        if first is not None:
+            next_cursor, previous_cursor = page_cursors(first, last, name, cursor, backwards, has_more)
+        yield '],"next":' + _dumps(next_cursor) + ',"previous":' + _dumps(previous_cursor) + '}'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+
+@require_GET
+def product_list_api(request):
+    try:
+        fields = products.parse_fields(request.GET)
+        ids = parse_ids(request.GET)
+        limit = parse_limit(request.GET)
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    # Same search and filters as the product_list page
+    query = request.GET.get('q', '')
+    queryset = search_products(query) if query else Product.objects.all()
+    queryset = apply_filters(queryset, parse_filters(request.GET))
+    if ids is not None:
+        return batch_response(products, queryset, ids, fields)
+
+    sorts = sort_options(query)
+    sort = request.GET.get('sort', '')
+    if sort not in sorts:
+        sort = next(iter(sorts))
+    cursor = request.GET.get('cursor')
+    try:
+        if cursor:
+            seek(queryset, sorts[sort][0], cursor)  # Validate the cursor before streaming starts
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return page_response(products, queryset, sorts[sort][0], cursor, limit, fields)
+
+
+@require_GET
+def product_detail_api(request, pk):
+    try:
+        fields = products.parse_fields(request.GET)
+    except ApiError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    row = Product.objects.filter(pk=pk).values(*products.columns(fields)).first()
+    if row is None:
+        raise Http404('No product matches the given query.')
+    return JsonResponse(products.serialize(row, fields), encoder=DjangoJSONEncoder)
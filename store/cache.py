@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG = 'catalog'
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 15)
+
+# Stampede protection: only the worker holding the rebuild lock queries the
+# database, the others poll the cache for its result for up to REBUILD_WAIT
+REBUILD_LOCK_TIMEOUT = 10
+REBUILD_WAIT = 2.0
+REBUILD_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def get_version(namespace=CATALOG):
+    """ The current version counter of a namespace of cached entries """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so a counter lost from the cache never reuses an old version
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace=CATALOG):
+    """ Invalidate every entry of a namespace in O(1) """
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        return get_version(namespace)
+
+
+def product_namespace(pk):
+    """ The version of one product's stock level, which only its product page shows """
+    return f'{CATALOG}:product:{pk}'
+
+
+def make_key(namespace, version, *parts):
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f'{namespace}:{version}:{digest}'
+
+
+def get_or_build(builder, *parts, namespace=CATALOG, timeout=CATALOG_CACHE_TIMEOUT):
+    """
+    Return the cached value for parts under the current namespace version,
+    calling builder() to compute it on a miss.
+    """
+    key = make_key(namespace, get_version(namespace), *parts)
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        return value
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, REBUILD_LOCK_TIMEOUT):
+        try:
+            value = builder()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + REBUILD_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(REBUILD_POLL_INTERVAL)
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if cache.get(lock_key) is None:
+            break  # The rebuild failed or timed out, compute it ourselves
+    return builder()
@@ -0,0 +1,377 @@
+import json
+import logging
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Max, Sum, Window
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from . import inventory
+from .models import CartItem, Product, StockMovement
+
+logger = logging.getLogger(__name__)
+
+CART_COOKIE = 'cart'
+CART_COOKIE_SALT = 'store.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+MAX_LINES = 50  # Keeps the signed cookie well under the 4 KB browser limit
+SUMMARY_TIMEOUT = 60 * 60 * 24
+ABANDONED_AFTER = timedelta(days=getattr(settings, 'ABANDONED_CART_DAYS', 30))
+SWEEP_USERS_PER_BATCH = 200
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _summary_key(user_id):
+    return f'cart:summary:{user_id}'
+
+
+def forget_summaries(user_ids):
+    """ Drop cached summaries whose cart changed behind the cart backend's back """
+    cache.delete_many([_summary_key(user_id) for user_id in user_ids])
+
+
+class NotEnoughStock(Exception):
+    def __init__(self, available):
+        super().__init__(f'Only {available} items available in stock.')
+        self.available = available
+
+
+class CartFull(Exception):
+    def __init__(self):
+        super().__init__(f'Your cart is full, it holds at most {MAX_LINES} different products.')
+
+
+class StockShortage(Exception):
+    """ Raised by update_many with every line that asked for more than is available """
+
+    def __init__(self, shortages):
+        self.messages = [f'Only {available} {name} available in stock.' for name, available in shortages]
+        super().__init__(' '.join(self.messages))
+
+
+class CartContents:
+    """ The lines of a cart, each with a line_total, and the grand total """
+
+    def __init__(self, items, total):
+        self.items = items
+        self.total = total
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class CartLine:
+    """ An anonymous cart entry shaped like CartItem, so templates render both the same way """
+
+    def __init__(self, product, quantity):
+        self.id = product.pk
+        self.product = product
+        self.product_id = product.pk
+        self.quantity = quantity
+        self.line_total = product.price * quantity
+
+    @property
+    def max_quantity(self):
+        return self.product.stock
+
+
+class CookieCart:
+    """
+    Cart of an anonymous shopper, kept in a signed cookie so browsing and
+    filling a cart never write to the database. Stock is only checked
+    here; it is reserved once the cart is merged into a CartItem cart.
+    """
+
+    def __init__(self, request):
+        self.lines = {}
+        self.modified = False
+        raw = request.get_signed_cookie(CART_COOKIE, default=None, salt=CART_COOKIE_SALT)
+        if raw:
+            try:
+                self.lines = {int(pk): int(quantity) for pk, quantity in json.loads(raw).items()}
+            except (ValueError, AttributeError):
+                self.modified = True  # Drop a malformed cookie on the way out
+
+    def items(self):
+        products = Product.objects.in_bulk(self.lines)
+        return [CartLine(products[pk], quantity) for pk, quantity in self.lines.items() if pk in products]
+
+    def count(self):
+        return len(self.lines)
+
+    def contents(self):
+        items = self.items()
+        return CartContents(items, sum((item.line_total for item in items), Decimal('0.00')))
+
+    def summary(self):
+        """
+        Line count and total for the badge on every page. Totals are cached
+        per cart contents under the catalog version, which moves with every
+        price edit and deletion, so repeat page views cost no queries.
+        """
+        if not self.lines:
+            return {'count': 0, 'total': Decimal('0.00')}
+
+        def build():
+            total = Decimal('0.00')
+            for pk, price in Product.objects.filter(pk__in=self.lines).values_list('pk', 'price'):
+                total += price * self.lines[pk]
+            return total
+
+        total = catalog_cache.get_or_build(build, 'cart_summary', sorted(self.lines.items()))
+        return {'count': len(self.lines), 'total': total}
+
+    def add(self, product):
+        quantity = self.lines.get(product.pk, 0) + 1
+        if quantity > product.stock:
+            raise NotEnoughStock(product.stock)
+        if product.pk not in self.lines and len(self.lines) >= MAX_LINES:
+            raise CartFull()
+        self.lines[product.pk] = quantity
+        self.modified = True
+
+    def update(self, item_id, quantity):
+        if item_id not in self.lines:
+            raise Http404('No cart item matches the given query.')
+        stock = Product.objects.filter(pk=item_id).values_list('stock', flat=True).first() or 0
+        if quantity > stock:
+            raise NotEnoughStock(stock)
+        self.lines[item_id] = quantity
+        self.modified = True
+
+    def update_many(self, quantities):
+        """ Apply {item id: quantity} with one stock query; quantities below 1 remove the item """
+        products = Product.objects.filter(pk__in=[pk for pk in quantities if pk in self.lines])
+        shortages = []
+        for pk, name, stock in products.values_list('pk', 'name', 'stock'):
+            if quantities[pk] > stock:
+                shortages.append((name, stock))
+        if shortages:
+            raise StockShortage(shortages)
+        for pk, quantity in quantities.items():
+            if pk in self.lines:
+                if quantity > 0:
+                    self.lines[pk] = quantity
+                else:
+                    del self.lines[pk]
+                self.modified = True
+
+    def remove(self, item_id):
+        if self.lines.pop(item_id, None) is None:
+            raise Http404('No cart item matches the given query.')
+        self.modified = True
+
+    def clear(self):
+        self.modified = self.modified or bool(self.lines)
+        self.lines = {}
+
+    def save(self, response):
+        if self.lines:
+            response.set_signed_cookie(CART_COOKIE, json.dumps(self.lines, separators=(',', ':')),
+                                       salt=CART_COOKIE_SALT, max_age=CART_COOKIE_MAX_AGE,
+                                       httponly=True, samesite='Lax')
+        else:
+            response.delete_cookie(CART_COOKIE, samesite='Lax')
+
+
+class DatabaseCart:
+    """ Cart of a logged-in user: CartItem rows with stock held through store.inventory """
+
+    def __init__(self, user):
+        self.user = user
+
+    def items(self):
+        return CartItem.objects.filter(user=self.user).select_related('product', 'hold')
+
+    def count(self):
+        return self.summary()['count']
+
+    def contents(self):
+        """
+        Load the cart with one joined query. Line totals and the grand total
+        (a window over the same rows) are computed by the database in
+        decimal arithmetic. The cached summary is refreshed on the way.
+        """
+        line_total = ExpressionWrapper(F('quantity') * F('product__price'), output_field=MONEY)
+        items = list(self.items().annotate(
+            line_total=line_total,
+            cart_total=Window(Sum(line_total), output_field=MONEY),
+        ).order_by('pk'))
+        # SQLite hands back the arithmetic without its scale, so round to cents as the summary does
+        for item in items:
+            item.line_total = item.line_total.quantize(Decimal('0.01'))
+        total = (items[0].cart_total if items else Decimal(0)).quantize(Decimal('0.01'))
+        cache.set(_summary_key(self.user.pk), {'count': len(items), 'total': total}, SUMMARY_TIMEOUT)
+        return CartContents(items, total)
+
+    def summary(self):
+        """ Line count and total, read from the cache and written through on every change """
+        summary = cache.get(_summary_key(self.user.pk))
+        if summary is None:
+            summary = self.refresh_summary()
+        return summary
+
+    def refresh_summary(self):
+        summary = CartItem.objects.filter(user=self.user).aggregate(
+            count=Count('id'),
+            total=Sum(F('quantity') * F('product__price'), output_field=MONEY),
+        )
+        summary['total'] = (summary['total'] or Decimal(0)).quantize(Decimal('0.01'))
+        cache.set(_summary_key(self.user.pk), summary, SUMMARY_TIMEOUT)
+        return summary
+
+    def add(self, product):
+        with transaction.atomic():
+            cart_item, created = CartItem.objects.get_or_create(user=self.user, product=product)
+            if not created:
+                cart_item.quantity += 1
+            if not inventory.reserve(cart_item, cart_item.quantity):
+                raise NotEnoughStock(0)  # Rolls back a newly created cart item
+            cart_item.save()
+        self.refresh_summary()
+
+    def update(self, item_id, quantity):
+        cart_item = get_object_or_404(CartItem, id=item_id, user=self.user)
+        if not inventory.reserve(cart_item, quantity):
+            cart_item.product.refresh_from_db(fields=['stock'])
+            raise NotEnoughStock(cart_item.max_quantity)
+        cart_item.quantity = quantity
+        cart_item.save()
+        self.refresh_summary()
+
+    def update_many(self, quantities):
+        """
+        Apply {item id: quantity} in one transaction; quantities below 1
+        remove the item. Everything is checked against the stock loaded
+        with the cart in one query before anything is written.
+        """
+        items = {item.pk: item for item in self.items().filter(pk__in=quantities)}
+        shortages = [(item.product.name, item.max_quantity)
+                     for pk, item in items.items() if quantities[pk] > item.max_quantity]
+        if shortages:
+            raise StockShortage(shortages)
+        changes = [(item, max(quantities[pk], 0)) for pk, item in items.items() if quantities[pk] != item.quantity]
+        try:
+            with transaction.atomic():
+                inventory.reserve_many(changes)
+                now = timezone.now()
+                for item, quantity in changes:
+                    item.quantity = quantity
+                    item.updated_at = now
+                CartItem.objects.bulk_update([item for item, quantity in changes if quantity], ['quantity', 'updated_at'])
+                CartItem.objects.filter(pk__in=[item.pk for item, quantity in changes if not quantity]).delete()
+        except inventory.OutOfStock as e:
+            # Someone else took the stock between the check and the update
+            item = e.cart_item
+            item.product.refresh_from_db(fields=['stock'])
+            raise StockShortage([(item.product.name, item.max_quantity)])
+        self.refresh_summary()
+
+    def remove(self, item_id):
+        cart_item = get_object_or_404(CartItem, id=item_id, user=self.user)
+        inventory.release(cart_item)
+        cart_item.delete()
+        self.refresh_summary()
+
+    def clear(self):
+        """ Empty the cart after its holds were settled by a paid order """
+        CartItem.objects.filter(user=self.user).delete()
+        self.refresh_summary()
+
+
+def cookie_cart(request):
+    if not hasattr(request, '_cookie_cart'):
+        request._cookie_cart = CookieCart(request)
+    return request._cookie_cart
+
+
+def get_cart(request):
+    if request.user.is_authenticated:
+        return DatabaseCart(request.user)
+    return cookie_cart(request)
+
+
+@transaction.atomic
+def merge(cart, user):
+    """
+    Fold an anonymous cart into the user's CartItem cart with one bulk
+    insert and one bulk update. The merged quantities are not held yet;
+    checkout reserves them like any lapsed hold.
+    """
+    if not cart.lines:
+        return
+    product_ids = set(Product.objects.filter(pk__in=cart.lines).values_list('pk', flat=True))
+    existing = {item.product_id: item
+                for item in CartItem.objects.filter(user=user, product_id__in=product_ids)}
+    to_create, to_update = [], []
+    for product_id, quantity in cart.lines.items():
+        if product_id not in product_ids:
+            continue
+        if product_id in existing:
+            item = existing[product_id]
+            item.quantity += quantity
+            item.updated_at = timezone.now()
+            to_update.append(item)
+        else:
+            to_create.append(CartItem(user=user, product_id=product_id, quantity=quantity))
+    CartItem.objects.bulk_create(to_create)
+    CartItem.objects.bulk_update(to_update, ['quantity', 'updated_at'])
+    cart.clear()
+    transaction.on_commit(lambda: forget_summaries([user.pk]))
+
+
+def sweep_abandoned(cutoff=None, batch_size=SWEEP_USERS_PER_BATCH):
+    """
+    Delete the carts of users with no cart activity since cutoff and give
+    their held stock back. Users are walked in id order, batch_size per
+    short transaction. Rows a live request has locked are skipped, and a
+    user who came back after the scan is re-checked under the lock and
+    kept. Returns (carts, items, units) removed.
+    """
+    cutoff = cutoff or timezone.now() - ABANDONED_AFTER
+    carts = items_removed = units = 0
+    last_user_id = 0
+    while True:
+        started = time.monotonic()
+        user_ids = list(
+            CartItem.objects.filter(user_id__gt=last_user_id).values('user_id')
+            .annotate(last_activity=Max('updated_at')).filter(last_activity__lt=cutoff)
+            .order_by('user_id').values_list('user_id', flat=True)[:batch_size]
+        )
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+        with transaction.atomic():
+            items = list(CartItem.objects.select_for_update(skip_locked=True, of=('self',))
+                         .filter(user_id__in=user_ids).select_related('hold'))
+            returning = set(CartItem.objects.filter(user_id__in=user_ids, updated_at__gte=cutoff)
+                            .values_list('user_id', flat=True))
+            items = [item for item in items if item.user_id not in returning]
+            returned = Counter()
+            for item in items:
+                hold = getattr(item, 'hold', None)
+                if hold is not None:
+                    returned[item.product_id] += hold.quantity
+            with inventory.batched_movements():
+                for product_id, quantity in returned.items():
+                    inventory.return_stock(product_id, quantity, StockMovement.EXPIRE)
+            CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+        swept = {item.user_id for item in items}
+        forget_summaries(swept)
+        carts += len(swept)
+        items_removed += len(items)
+        units += sum(returned.values())
+        logger.info('Swept %d abandoned carts (%d items, %d units returned) in %.3fs',
+                    len(swept), len(items), sum(returned.values()), time.monotonic() - started)
+    return carts, items_removed, units
@@ -0,0 +1,274 @@
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+from django.core.files import File
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from .cache import bump_version
+from .cart import forget_summaries
+from .inventory import adjust, batched_movements, record
+from .models import CartItem, Product, StockMovement
+from .related import refresh_all
+from .search import index_products, rebuild_index
+from .typeahead import TYPEAHEAD
+
+EXPORT_FIELDS = ['id', 'name', 'description', 'price', 'category', 'stock', 'image']
+UPDATE_FIELDS = ['name', 'description', 'price', 'category', 'image', 'updated_at']  # Stock goes through adjust()
+CATEGORIES = {value for value, label in Product.CATEGORY_CHOICES}
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path, format=None):
+    if format:
+        return format
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(stream, format):
+    """ Yield (line number, row dict) one at a time from a CSV or JSON Lines stream """
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, RowError(f'Invalid JSON: {e}')
+                continue
+            yield line_number, row if isinstance(row, dict) else RowError('Expected a JSON object')
+
+
+def clean_row(row):
+    """ Validate one import row and return the product field values """
+    name = (row.get('name') or '').strip()
+    if not name:
+        raise RowError('name is required')
+    if len(name) > 255:
+        raise RowError('name is longer than 255 characters')
+    try:
+        price = Decimal(str(row.get('price', ''))).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise RowError(f"invalid price {row.get('price')!r}")
+    if price < 0 or price >= Decimal('100000000'):
+        raise RowError(f'price {price} is out of range')
+    category = (row.get('category') or '').strip().lower()
+    if category not in CATEGORIES:
+        raise RowError(f"unknown category {row.get('category')!r}")
+    try:
+        stock = int(row.get('stock') or 0)
+    except (TypeError, ValueError):
+        raise RowError(f"invalid stock {row.get('stock')!r}")
+    if stock < 0:
+        raise RowError('stock cannot be negative')
+    pk = row.get('id')
+    try:
+        pk = int(pk) if pk not in (None, '') else None
+    except (TypeError, ValueError):
+        raise RowError(f'invalid id {pk!r}')
+    return {
+        'id': pk,
+        'name': name,
+        'description': (row.get('description') or '').strip(),
+        'price': price,
+        'category': category,
+        'stock': stock,
+        'image': (row.get('image') or '').strip(),
+    }
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self):
+        return self.rows / self.elapsed if self.elapsed else 0
+
+
+class ProductImporter:
+    """
+    Import products in batches: rows are validated one at a time, images
+    are copied into storage in parallel, then each batch is written with
+    one bulk_create and one bulk_update. Only one batch is held in memory.
+    A batch the database refuses is retried row by row, so one bad row is
+    reported on its own instead of aborting the import.
+    """
+
+    def __init__(self, images_dir=None, batch_size=1000, image_workers=8, on_error=None):
+        self.images_dir = images_dir
+        self.batch_size = batch_size
+        self.image_workers = image_workers
+        self.on_error = on_error
+        self.stats = ImportStats()
+        self.reindex_all = False
+        self.explicit_ids = False
+
+    def error(self, line_number, message):
+        self.stats.errors.append((line_number, message))
+        if self.on_error:
+            self.on_error(line_number, message)
+
+    def run(self, stream, format):
+        batch = []
+        with ThreadPoolExecutor(max_workers=self.image_workers) as executor:
+            self.executor = executor
+            for line_number, row in read_rows(stream, format):
+                self.stats.rows += 1
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    batch.append((line_number, clean_row(row)))
+                except RowError as e:
+                    self.error(line_number, str(e))
+                if len(batch) >= self.batch_size:
+                    self.write_batch(batch)
+                    batch = []
+            self.write_batch(batch)
+        self.finish()
+        return self.stats
+
+    def store_image(self, filename):
+        path = os.path.join(self.images_dir, filename)
+        with open(path, 'rb') as f:
+            name = Product._meta.get_field('image').generate_filename(None, os.path.basename(filename))
+            return Product._meta.get_field('image').storage.save(name, File(f))
+
+    def store_images(self, batch):
+        """ Copy the batch's images into storage in parallel, dropping rows whose image is unusable """
+        if not self.images_dir:
+            return batch
+        futures = {
+            index: self.executor.submit(self.store_image, values['image'])
+            for index, (line_number, values) in enumerate(batch) if values['image']
+        }
+        kept = []
+        for index, (line_number, values) in enumerate(batch):
+            if index in futures:
+                try:
+                    values['image'] = futures[index].result()
+                except OSError as e:
+                    self.error(line_number, f"could not read image {values['image']!r}: {e.strerror or e}")
+                    continue
+            kept.append((line_number, values))
+        return kept
+
+    def write_batch(self, batch):
+        if not batch:
+            return
+        batch = self.store_images(batch)
+        ids = [values['id'] for line_number, values in batch if values['id'] is not None]
+        existing = Product.objects.in_bulk(ids)
+        now = timezone.now()
+        rows, new_ids = [], set()
+        for line_number, values in batch:
+            product = existing.get(values['id'])
+            if product is None:
+                if values['id'] is not None:
+                    if values['id'] in new_ids:
+                        self.error(line_number, f"duplicate id {values['id']}")
+                        continue
+                    new_ids.add(values['id'])
+                rows.append((line_number, Product(**values, created_at=now, updated_at=now), None))
+            else:
+                delta = values['stock'] - product.stock
+                for field, value in values.items():
+                    if field not in ('id', 'stock') and (field != 'image' or value):
+                        setattr(product, field, value)
+                product.updated_at = now
+                rows.append((line_number, product, delta))
+        try:
+            created, updated = self.save_rows(rows)
+        except (DatabaseError, Product.DoesNotExist):
+            created, updated = [], []
+            for row in rows:
+                try:
+                    row_created, row_updated = self.save_rows([row])
+                except (DatabaseError, Product.DoesNotExist) as e:
+                    self.error(row[0], f'could not be saved: {e}')
+                    continue
+                created += row_created
+                updated += row_updated
+        self.stats.created += len(created)
+        self.stats.updated += len(updated)
+        self.explicit_ids = self.explicit_ids or any(product.pk in new_ids for product in created)
+
+        # Index search terms per batch while the ids are at hand. Backends that
+        # don't return ids from bulk_create fall back to one rebuild at the end.
+        touched = [p.pk for p in created + updated]
+        if None in touched:
+            self.reindex_all = True
+        elif not self.reindex_all:
+            index_products(touched)
+
+    def save_rows(self, rows):
+        """ Write (line number, product, stock delta) rows in one transaction; the delta is None for new products """
+        to_create = [product for line_number, product, delta in rows if delta is None]
+        to_update = [(product, delta) for line_number, product, delta in rows if delta is not None]
+        with transaction.atomic(), batched_movements():
+            Product.objects.bulk_create(to_create)
+            Product.objects.bulk_update([product for product, delta in to_update], UPDATE_FIELDS)
+            # The ledger gets the same movements the Product signals and forms would record
+            for product in to_create:
+                if product.pk is not None and product.stock:
+                    record(product.pk, product.stock, StockMovement.OPENING)
+            # The file's stock is applied as a change from what was read, so
+            # sales made since then are kept and match the IMPORT movement
+            for product, delta in to_update:
+                if delta:
+                    product.stock = adjust(product.pk, delta, StockMovement.IMPORT)
+        return to_create, [product for product, delta in to_update]
+
+    def finish(self):
+        # bulk_create and bulk_update skip the Product signals, so do their work here
+        if self.explicit_ids:
+            # Rows created with ids from the file leave the id sequence behind
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Product]):
+                    cursor.execute(sql)
+        if self.reindex_all:
+            rebuild_index()
+        if self.stats.updated:
+            forget_summaries(CartItem.objects.values_list('user_id', flat=True).distinct())
+        if self.stats.created or self.stats.updated:
+            refresh_all()
+            bump_version()
+            bump_version(TYPEAHEAD)
+
+
+def export_products(stream, format, batch_size=2000):
+    """ Write every product to stream, reading them in chunks """
+    rows = Product.objects.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=batch_size)
+    count = 0
+    if format == 'csv':
+        writer = csv.writer(stream)
+        writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            stream.write(json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + '\n')
+            count += 1
+    return count
@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import get_cart
+
+
+def cart(request):
+    """ Line count and total of the current cart for the navigation badge, loaded only if a template uses it """
+    if not hasattr(request, 'user'):
+        return {}
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart(request).summary())}
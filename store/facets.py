@@ -0,0 +1,97 @@
+from decimal import Decimal
+
+from django.db.models import Count, Q
+
+from .models import Product
+
+# (key, label, minimum price, maximum price) - the maximum is exclusive
+PRICE_BANDS = [
+    ('under-5', 'Under $5', None, Decimal('5')),
+    ('5-20', '$5 to $20', Decimal('5'), Decimal('20')),
+    ('20-50', '$20 to $50', Decimal('20'), Decimal('50')),
+    ('over-50', '$50 and over', Decimal('50'), None),
+]
+PRICE_BAND_KEYS = [key for key, label, low, high in PRICE_BANDS]
+CATEGORY_LABELS = {'seed': 'Seeds', 'supply': 'Supplies'}
+
+
+def parse_filters(params):
+    """ Read the facet filters from a QueryDict, ignoring unknown values """
+    price = params.get('price', '')
+    return {
+        'category': params.get('category', 'all') or 'all',
+        'price': price if price in PRICE_BAND_KEYS else '',
+        'in_stock': params.get('in_stock') == '1',
+    }
+
+
+def price_band_q(key):
+    for band_key, label, low, high in PRICE_BANDS:
+        if band_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return Q()
+
+
+def filter_conditions(filters):
+    """ One Q per active facet """
+    conditions = {}
+    if filters['category'] != 'all':
+        conditions['category'] = Q(category__iexact=filters['category'])
+    if filters['price']:
+        conditions['price'] = price_band_q(filters['price'])
+    if filters['in_stock']:
+        conditions['in_stock'] = Q(stock__gt=0)
+    return conditions
+
+
+def apply_filters(queryset, filters):
+    for condition in filter_conditions(filters).values():
+        queryset = queryset.filter(condition)
+    return queryset
+
+
+def _combine(conditions, exclude, extra=None):
+    q = Q()
+    for name, condition in conditions.items():
+        if name != exclude:
+            q &= condition
+    if extra is not None:
+        q &= extra
+    return q or None
+
+
+def facet_counts(queryset, filters):
+    """
+    Count the products behind every facet value with a single aggregate
+    query. Each facet is counted with the other facets applied but not
+    itself, so its counts show what selecting another value would return.
+    """
+    conditions = filter_conditions(filters)
+    aggregates = {'category__all': Count('pk', filter=_combine(conditions, 'category'))}
+    for value, label in Product.CATEGORY_CHOICES:
+        aggregates[f'category__{value}'] = Count(
+            'pk', filter=_combine(conditions, 'category', Q(category__iexact=value))
+        )
+    for key in PRICE_BAND_KEYS:
+        aggregates[f'price__{key}'] = Count('pk', filter=_combine(conditions, 'price', price_band_q(key)))
+    aggregates['in_stock'] = Count('pk', filter=_combine(conditions, 'in_stock', Q(stock__gt=0)))
+    return queryset.order_by().aggregate(**aggregates)
+
+
+def build_facets(counts):
+    """ Shape the counts for the product list sidebar """
+    categories = [('all', 'All', counts['category__all'])] + [
+        (value, CATEGORY_LABELS.get(value, label), counts[f'category__{value}'])
+        for value, label in Product.CATEGORY_CHOICES
+    ]
+    prices = [(key, label, counts[f'price__{key}']) for key, label, low, high in PRICE_BANDS]
+    return {
+        'categories': categories,
+        'prices': prices,
+        'in_stock': counts['in_stock'],
+    }
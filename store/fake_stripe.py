@@ -0,0 +1,159 @@
+"""
+A local stand-in for the parts of the Stripe API the store uses: creating
+products, prices and checkout sessions, retrieving sessions, and signing
+webhook events. It serves real HTTP on 127.0.0.1, so the stripe library
+is exercised end to end without network access.
+
+    with FakeStripe() as fake:
+        ...  # checkout creates sessions on the fake server
+        payload, signature = fake.pay(session_id)
+"""
+import hashlib
+import hmac
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+import stripe
+
+WEBHOOK_SECRET = 'whsec_fake'
+SESSIONS_PATH = '/v1/checkout/sessions'
+PRODUCTS_PATH = '/v1/products'
+PRICES_PATH = '/v1/prices'
+
+
+class FakeStripe:
+    def __init__(self, webhook_secret=WEBHOOK_SECRET):
+        self.webhook_secret = webhook_secret
+        self.sessions = {}
+        self.products = {}
+        self.prices = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        self.saved = stripe.api_base, stripe.api_key
+        stripe.api_base, stripe.api_key = self.url, 'sk_test_fake'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        stripe.api_base, stripe.api_key = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def create_session(self, params):
+        """ Build a checkout.session object from the form-encoded params of a create call """
+        line_items = {}
+        for key, value in params.items():
+            match = re.fullmatch(r'line_items\[(\d+)\]\[(.+)\]', key)
+            if match:
+                line_items.setdefault(int(match[1]), {})[match[2]] = value
+        amount_total = sum(
+            self.unit_amount(item) * int(item.get('quantity', 1)) for item in line_items.values()
+        )
+        session_id = f'cs_test_{uuid.uuid4().hex}'
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'url': f'{self.url}/pay/{session_id}',
+            'mode': params.get('mode'),
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'amount_total': amount_total,
+            'currency': 'usd',
+            'client_reference_id': params.get('client_reference_id'),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'line_items': [line_items[index] for index in sorted(line_items)],
+        }
+        with self.lock:
+            self.sessions[session_id] = session
+        return session
+
+    def unit_amount(self, line_item):
+        if 'price' in line_item:
+            return self.prices[line_item['price']]['unit_amount']
+        return int(line_item.get('price_data][unit_amount', 0))
+
+    def create_product(self, params):
+        product = {'id': f'prod_{uuid.uuid4().hex[:14]}', 'object': 'product', 'name': params.get('name'),
+                   'metadata': {key[9:-1]: value for key, value in params.items() if key.startswith('metadata[')}}
+        with self.lock:
+            self.products[product['id']] = product
+        return product
+
+    def create_price(self, params):
+        price = {'id': f'price_{uuid.uuid4().hex[:14]}', 'object': 'price', 'product': params.get('product'),
+                 'unit_amount': int(params.get('unit_amount', 0)), 'currency': params.get('currency')}
+        with self.lock:
+            self.prices[price['id']] = price
+        return price
+
+    def event(self, event_type, session):
+        """ A webhook event about session, as (payload, Stripe-Signature header) """
+        payload = json.dumps({
+            'id': f'evt_{uuid.uuid4().hex}',
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': session},
+        })
+        timestamp = int(time.time())
+        digest = hmac.new(self.webhook_secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return payload, f't={timestamp},v1={digest}'
+
+    def pay(self, session_id):
+        """ The customer completes payment; returns the checkout.session.completed event """
+        with self.lock:
+            session = self.sessions[session_id]
+            session.update(status='complete', payment_status='paid')
+        return self.event('checkout.session.completed', session)
+
+    def expire(self, session_id):
+        with self.lock:
+            session = self.sessions[session_id]
+            session.update(status='expired')
+        return self.event('checkout.session.expired', session)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests.append(('GET', self.path))
+                session_id = self.path.removeprefix(SESSIONS_PATH + '/')
+                if self.path.startswith(SESSIONS_PATH + '/') and session_id in fake.sessions:
+                    self.reply(200, fake.sessions[session_id])
+                else:
+                    self.reply(404, {'error': {'type': 'invalid_request_error',
+                                               'message': f'No such checkout.session: {session_id}'}})
+
+            def do_POST(self):
+                fake.requests.append(('POST', self.path))
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                create = {SESSIONS_PATH: fake.create_session, PRODUCTS_PATH: fake.create_product,
+                          PRICES_PATH: fake.create_price}.get(self.path)
+                if create is not None:
+                    self.reply(200, create(dict(parse_qsl(body))))
+                else:
+                    self.reply(404, {'error': {'type': 'invalid_request_error',
+                                               'message': f'Unrecognized request URL (POST: {self.path})'}})
+
+            def reply(self, status, data):
+                body = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
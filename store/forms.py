@@ -2,6 +2,10 @@ from django import forms
 from .models import Product
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, Row, Column
+from core.forms import DerivativeImageFormMixin
+from django.db import transaction
+from .cache import bump_version
+from . import inventory
 
 
 class ShippingForm(forms.Form):
@@ -14,13 +18,32 @@ class ShippingForm(forms.Form):
     zip_code = forms.CharField(max_length=10, initial="")
 
 
-class ProductForm(forms.ModelForm):
+class ProductForm(DerivativeImageFormMixin, forms.ModelForm):
+    # The stock level the editor saw, so their change is applied as a difference
+    stock_seen = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Product
         fields = ['name', 'description', 'price', 'image', 'category', 'stock']
 
+    def save(self, commit=True):
+        if self.instance.pk is None or not commit or self.errors:
+            return super().save(commit)
+        seen = self.cleaned_data.get('stock_seen')
+        if seen is None:
+            seen = self.initial['stock']
+        with transaction.atomic():
+            # Sales made while the form was open are kept, not overwritten
+            self.instance.stock = inventory.adjust(self.instance.pk, self.cleaned_data['stock'] - seen)
+            return super().save(commit)
+
+    def derivatives_ready(self):
+        # Cached product pages were built before the resized images existed
+        bump_version()
+
     def __init__(self, *args, **kwargs):
         super(ProductForm, self).__init__(*args, **kwargs)
+        self.fields['stock_seen'].initial = self.instance.stock
         self.helper = FormHelper()
         self.helper.form_method = 'post'
         self.helper.layout = Layout(
@@ -0,0 +1,281 @@
+import logging
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import bump_version, product_namespace
+from .models import Product, StockHold, StockMovement, StockRollup
+
+logger = logging.getLogger(__name__)
+
+HOLD_DURATION = timedelta(minutes=getattr(settings, 'STOCK_HOLD_MINUTES', 30))
+SWEEP_BATCH_SIZE = 500
+# Only movements at least this old are rolled up, so rows of transactions
+# still in flight (which commit out of id order) are never skipped
+ROLLUP_LAG = timedelta(minutes=5)
+
+
+class OutOfStock(Exception):
+    def __init__(self, cart_item):
+        super().__init__(f'Not enough stock left for {cart_item}')
+        self.cart_item = cart_item
+
+
+def _stock_changed(product_id, availability_changed):
+    # Queryset updates skip the Product signals, so invalidate here. Only
+    # the product page shows the level, so a sale invalidates that page
+    # alone; the rest of the catalog only shows whether a product is in
+    # stock and is invalidated when it sells out or comes back
+    transaction.on_commit(lambda: bump_version(product_namespace(product_id)))
+    if availability_changed:
+        transaction.on_commit(bump_version)
+
+
+_pending = threading.local()
+
+
+def record(product_id, delta, reason):
+    """ Append a movement to the ledger, or to the open batch if there is one """
+    movement = StockMovement(product_id=product_id, delta=delta, reason=reason)
+    movements = getattr(_pending, 'movements', None)
+    if movements is None:
+        movement.save()
+    else:
+        movements.append(movement)
+
+
+@contextmanager
+def batched_movements():
+    """ Collect the movements recorded inside the block and insert them with one query at the end """
+    if getattr(_pending, 'movements', None) is not None:
+        yield  # Already batching
+        return
+    _pending.movements = []
+    try:
+        yield
+        StockMovement.objects.bulk_create(_pending.movements)
+    finally:
+        _pending.movements = None
+
+
+@transaction.atomic
+def take_stock(product_id, quantity, reason=StockMovement.RESERVE):
+    """
+    Take quantity units of stock if that many are left. The check and the
+    decrement are one conditional UPDATE, so concurrent requests can
+    neither oversell nor lose each other's writes, and no lock is held.
+    Taking the last units is its own UPDATE, matching the exact level, so
+    a sell-out is noticed without reading the row back.
+    """
+    products = Product.objects.filter(pk=product_id)
+    now = timezone.now()
+    while True:
+        if products.filter(stock__gt=quantity).update(stock=F('stock') - quantity, updated_at=now):
+            sold_out = False
+        elif products.filter(stock=quantity).update(stock=0, updated_at=now):
+            sold_out = bool(quantity)
+        elif products.filter(stock__gte=quantity).exists():
+            continue  # Restocked between the two updates
+        else:
+            return False
+        record(product_id, -quantity, reason)
+        _stock_changed(product_id, sold_out)
+        return True
+
+
+@transaction.atomic
+def return_stock(product_id, quantity, reason=StockMovement.RELEASE):
+    products = Product.objects.filter(pk=product_id)
+    now = timezone.now()
+    while True:
+        if products.filter(stock__gt=0).update(stock=F('stock') + quantity, updated_at=now):
+            back_in_stock = False
+        elif products.filter(stock=0).update(stock=quantity, updated_at=now):
+            back_in_stock = bool(quantity)
+        elif products.exists():
+            continue  # Sold out between the two updates
+        else:
+            return  # The product was deleted, there is no shelf to return to
+        record(product_id, quantity, reason)
+        _stock_changed(product_id, back_in_stock)
+        return
+
+
+@transaction.atomic
+def adjust(product_id, delta, reason=StockMovement.ADJUSTMENT):
+    """
+    Apply a relative change, e.g. from an edit in the product form, so it
+    combines with concurrent sales instead of overwriting them. Stock
+    never goes below zero; the movement records what was really applied.
+    The row stays locked until the caller's transaction ends, which is
+    fine off the shopping hot path. Returns the new stock level.
+    """
+    stock = Product.objects.select_for_update().filter(pk=product_id).values_list('stock', flat=True).get()
+    applied = max(delta, -stock)
+    if applied:
+        Product.objects.filter(pk=product_id).update(stock=stock + applied, updated_at=timezone.now())
+        record(product_id, applied, reason)
+        _stock_changed(product_id, (stock > 0) != (stock + applied > 0))
+    return stock + applied
+
+
+@transaction.atomic
+def reserve(cart_item, quantity):
+    """
+    Make cart_item hold exactly quantity units, taking or returning the
+    difference, and restart its expiry clock. Returns False when there is
+    not enough stock left, in which case nothing changes.
+    """
+    hold = StockHold.objects.select_for_update().filter(cart_item=cart_item).first()
+    held = hold.quantity if hold else 0
+    if quantity > held and not take_stock(cart_item.product_id, quantity - held):
+        return False
+    if quantity < held:
+        return_stock(cart_item.product_id, held - quantity)
+    expires_at = timezone.now() + HOLD_DURATION
+    if hold is None:
+        StockHold.objects.create(cart_item=cart_item, product_id=cart_item.product_id,
+                                 quantity=quantity, expires_at=expires_at)
+    else:
+        hold.quantity = quantity
+        hold.expires_at = expires_at
+        hold.save(update_fields=['quantity', 'expires_at'])
+    return True
+
+
+@transaction.atomic
+def release(cart_item):
+    """ Give back everything cart_item holds, e.g. before it is removed from the cart """
+    hold = StockHold.objects.select_for_update().filter(cart_item=cart_item).first()
+    if hold is not None:
+        return_stock(hold.product_id, hold.quantity)
+        hold.delete()
+
+
+@transaction.atomic
+def reserve_many(changes):
+    """
+    Set the held quantity of several cart items at once, from
+    (cart_item, quantity) pairs whose holds are already loaded. Stock is
+    still taken with one conditional UPDATE per line. If any line runs
+    short, OutOfStock is raised and the whole transaction rolls back.
+    """
+    expires_at = timezone.now() + HOLD_DURATION
+    to_create, to_update = [], []
+    with batched_movements():
+        for cart_item, quantity in changes:
+            hold = getattr(cart_item, 'hold', None)
+            held = hold.quantity if hold else 0
+            if quantity > held and not take_stock(cart_item.product_id, quantity - held):
+                raise OutOfStock(cart_item)
+            if quantity < held:
+                return_stock(cart_item.product_id, held - quantity)
+            if hold is None:
+                to_create.append(StockHold(cart_item=cart_item, product_id=cart_item.product_id,
+                                           quantity=quantity, expires_at=expires_at))
+            else:
+                hold.quantity = quantity
+                hold.expires_at = expires_at
+                to_update.append(hold)
+    StockHold.objects.bulk_create(to_create)
+    StockHold.objects.bulk_update(to_update, ['quantity', 'expires_at'])
+
+
+def reserve_cart(cart_items):
+    """ Renew the holds of a whole cart before payment, returning the items that could not be reserved """
+    return [item for item in cart_items if not reserve(item, item.quantity)]
+
+
+@transaction.atomic
+def settle(cart_items):
+    """
+    Turn the holds of a paid cart into sales. Items whose hold lapsed
+    during payment take their stock now, as far as any is left; holds
+    larger than what was paid for give the surplus back.
+    """
+    items = list(cart_items)
+    holds = {hold.cart_item_id: hold.quantity
+             for hold in StockHold.objects.select_for_update().filter(cart_item__in=items)}
+    with batched_movements():
+        for item in items:
+            missing = item.quantity - holds.get(item.pk, 0)
+            if missing > 0 and not take_stock(item.product_id, missing, StockMovement.SALE):
+                adjust(item.product_id, -missing, StockMovement.SALE)
+            if missing < 0:
+                return_stock(item.product_id, -missing)
+    StockHold.objects.filter(cart_item__in=items).delete()
+
+
+def release_expired(now=None, batch_size=SWEEP_BATCH_SIZE):
+    """
+    Return the stock of every expired hold. Each batch is locked with
+    SKIP LOCKED where the database supports it, so several sweepers or a
+    customer renewing a hold never wait on each other. The cart items stay
+    in the cart; checkout reserves them again.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockHold.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now).values_list('pk', 'product_id', 'quantity')[:batch_size]
+            )
+            if not holds:
+                return released
+            returned = Counter()
+            for pk, product_id, quantity in holds:
+                returned[product_id] += quantity
+            with batched_movements():
+                for product_id, quantity in returned.items():
+                    return_stock(product_id, quantity, StockMovement.EXPIRE)
+            StockHold.objects.filter(pk__in=[pk for pk, product_id, quantity in holds]).delete()
+        released += len(holds)
+
+
+def reconcile(now=None):
+    """
+    Advance every StockRollup by the movements recorded since the last run,
+    with one grouped query over the new rows only, then compare the ledger
+    with Product.stock. Returns (product id, stock, ledger) for each drift.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        since = StockRollup.objects.aggregate(last=Max('movement_id'))['last'] or 0
+        until = StockMovement.objects.filter(pk__gt=since, created_at__lte=now - ROLLUP_LAG).aggregate(
+            last=Max('pk'))['last'] or since
+        totals = dict(
+            StockMovement.objects.filter(pk__gt=since, pk__lte=until, product_id__in=Product.objects.values('pk'))
+            .values_list('product_id').annotate(total=Sum('delta')).order_by()
+        )
+        rollups = StockRollup.objects.select_for_update().in_bulk(totals)
+        to_create, to_update = [], []
+        for product_id, total in totals.items():
+            rollup = rollups.get(product_id)
+            if rollup is None:
+                to_create.append(StockRollup(product_id=product_id, quantity=total, movement_id=until))
+            else:
+                rollup.quantity += total
+                rollup.movement_id = until
+                to_update.append(rollup)
+        StockRollup.objects.bulk_create(to_create)
+        StockRollup.objects.bulk_update(to_update, ['quantity', 'movement_id'])
+
+    # Movements recorded while this ran are added in the same statement,
+    # so a sale in flight is never mistaken for drift
+    later = (StockMovement.objects.filter(pk__gt=until, product_id=OuterRef('pk'))
+             .values('product_id').annotate(total=Sum('delta')).values('total'))
+    ledger = (Coalesce(F('stock_rollup__quantity'), Value(0))
+              + Coalesce(Subquery(later, output_field=IntegerField()), Value(0)))
+    drift = list(Product.objects.annotate(ledger=ledger).exclude(stock=F('ledger'))
+                 .values_list('pk', 'stock', 'ledger'))
+    for product_id, stock, expected in drift:
+        logger.warning('Stock drift on product %s: stock is %s, movements add up to %s', product_id, stock, expected)
+    return drift
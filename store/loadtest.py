@@ -0,0 +1,202 @@
+"""
+Load test for the cart and checkout hot paths.
+
+Virtual shoppers drive the real views through the WSGI handler with the
+test client, one thread each, against the configured database. Stripe is
+replaced by the local server of store.fake_stripe and mail goes to the
+in-memory backend, so a run never leaves the machine. Run it with
+`manage.py load_test`. It refuses to write to a database that does not
+look like a development or test one unless told otherwise.
+"""
+import os
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DatabaseError, close_old_connections, connection
+from django.db.models import Sum
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import inventory
+from .fake_stripe import FakeStripe
+from .models import CartItem, Product, StockHold, StockMovement
+
+PREFIX = 'loadtest-'
+VIEWS = ('add_to_cart', 'cart_view', 'update_cart', 'checkout')
+SHIPPING = {'first_name': 'Load', 'last_name': 'Test', 'email': 'loadtest@example.com',
+            'address': '1 Garden Lane', 'city': 'Leeds', 'state': 'Yorkshire', 'zip_code': 'LS1 1AA'}
+
+
+class ProductionDatabase(Exception):
+    pass
+
+
+def check_database(allow_production=False):
+    """ Raise ProductionDatabase unless DEBUG is on or the default database is named like a test one """
+    name = os.path.basename(str(connection.settings_dict['NAME'] or ''))
+    if allow_production or settings.DEBUG or name.startswith('test') or 'memory' in name:
+        return
+    raise ProductionDatabase(f'{name or "The default database"} does not look like a test database and '
+                             f'DEBUG is off; the load test would write {PREFIX} shoppers and orders to it')
+
+
+def seed(products=200, users=100, stock=25, seed=0, allow_production=False):
+    """ Replace any earlier load test data with a fresh catalog and set of shoppers """
+    check_database(allow_production)
+    clear()
+    rng = random.Random(seed)
+    try:
+        Product.objects.bulk_create(
+            Product(name=f'{PREFIX}product-{i}', description='Load test product',
+                    category=rng.choice(['seed', 'supply']), price=Decimal(rng.randint(100, 5000)) / 100,
+                    image='static/images/products/test.jpg', stock=rng.randint(stock // 2, stock))
+            for i in range(products)
+        )
+        stock_levels = dict(Product.objects.filter(name__startswith=PREFIX).values_list('pk', 'stock'))
+        # bulk_create skips the signal that opens each product's ledger
+        StockMovement.objects.bulk_create(StockMovement(product_id=pk, delta=quantity, reason=StockMovement.OPENING)
+                                          for pk, quantity in stock_levels.items())
+        User.objects.bulk_create(User(username=f'{PREFIX}user-{i}') for i in range(users))
+        return stock_levels, list(User.objects.filter(username__startswith=PREFIX))
+    except BaseException:
+        clear()  # Don't leave half a catalog behind
+        raise
+
+
+def clear():
+    User.objects.filter(username__startswith=PREFIX).delete()
+    Product.objects.filter(name__startswith=PREFIX).delete()
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@dataclass
+class Report:
+    users: int
+    elapsed: float = 0.0
+    timings: dict = field(default_factory=lambda: defaultdict(list))
+    queries: dict = field(default_factory=lambda: defaultdict(list))
+    errors: dict = field(default_factory=lambda: defaultdict(int))
+    violations: list = field(default_factory=list)
+
+    def add(self, view, duration, queries, ok):
+        self.timings[view].append(duration)
+        self.queries[view].append(queries)
+        if not ok:
+            self.errors[view] += 1
+
+    @property
+    def requests(self):
+        return sum(len(timings) for timings in self.timings.values())
+
+    def percentiles(self, view):
+        """ p50, p95 and p99 latency of view in milliseconds """
+        timings = self.timings[view]
+        if len(timings) < 2:
+            return (timings[0] * 1000,) * 3 if timings else (0.0,) * 3
+        cuts = statistics.quantiles(timings, n=100, method='inclusive')
+        return cuts[49] * 1000, cuts[94] * 1000, cuts[98] * 1000
+
+    def lines(self):
+        yield (f'{self.requests} requests from {self.users} shoppers in {self.elapsed:.1f}s '
+               f'({self.requests / self.elapsed if self.elapsed else 0:.0f} req/s)')
+        yield f'{"view":<12} {"requests":>8} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8}'
+        for view in VIEWS:
+            if not self.timings[view]:
+                continue
+            p50, p95, p99 = self.percentiles(view)
+            yield (f'{view:<12} {len(self.timings[view]):>8} {self.errors[view]:>6} {p50:>8.1f} {p95:>8.1f} '
+                   f'{p99:>8.1f} {statistics.mean(self.queries[view]):>8.1f}')
+        for violation in self.violations:
+            yield f'INVARIANT VIOLATED: {violation}'
+
+
+def shop(user, client, product_ids, iterations, report, lock, rng):
+    """ One shopper: fill the cart, look at it, change a line, check out; repeated iterations times """
+    counter = QueryCounter()
+
+    def hit(view, method, url, data=None):
+        counter.count = 0
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            response = getattr(client, method)(url, data or {}, HTTP_ACCEPT='application/json')
+        duration = time.perf_counter() - started
+        with lock:
+            report.add(view, duration, counter.count, response.status_code < 500)
+        return response
+
+    try:
+        for _ in range(iterations):
+            for product_id in rng.sample(product_ids, k=min(3, len(product_ids))):
+                hit('add_to_cart', 'post', reverse('add_to_cart', args=[product_id]))
+            hit('cart_view', 'get', reverse('cart_view'))
+            try:
+                item = CartItem.objects.filter(user=user).values_list('pk', flat=True).first()
+            except DatabaseError:  # SQLite lets one writer at a time, skip the update this round
+                item = None
+            if item is not None:
+                hit('update_cart', 'post', reverse('update_cart', args=[item]), {'quantity': rng.randint(0, 3)})
+            hit('checkout', 'post', reverse('checkout'), SHIPPING)
+    finally:
+        close_old_connections()
+
+
+def check_invariants(initial_stock):
+    """
+    Nothing is paid for in a load test, so every unit must be either on
+    the shelf or held by a cart, and the ledger must agree with the shelf
+    """
+    violations = []
+    held = dict(StockHold.objects.filter(product__in=initial_stock).values_list('product')
+                .annotate(total=Sum('quantity')).order_by())
+    for product_id, stock in Product.objects.filter(pk__in=initial_stock).values_list('pk', 'stock'):
+        if stock < 0:
+            violations.append(f'product {product_id} has negative stock {stock}')
+        if stock + held.get(product_id, 0) != initial_stock[product_id]:
+            violations.append(f'product {product_id}: {stock} in stock + {held.get(product_id, 0)} held '
+                              f'!= {initial_stock[product_id]} at start')
+    for product_id, stock, ledger in inventory.reconcile(now=timezone.now() + inventory.ROLLUP_LAG):
+        if product_id in initial_stock:
+            violations.append(f'product {product_id}: stock {stock} but the ledger adds up to {ledger}')
+    return violations
+
+
+def run(products=200, users=100, iterations=5, stock=25, seed_value=0, allow_production=False):
+    """ Seed the data, run every shopper in its own thread and return the Report; the data is removed afterwards """
+    initial_stock, shoppers = seed(products, users, stock, seed_value, allow_production)
+    try:
+        product_ids = list(initial_stock)
+        report = Report(users=len(shoppers))
+        lock = threading.Lock()
+        clients = [Client(raise_request_exception=False) for user in shoppers]
+        for client, user in zip(clients, shoppers):
+            client.force_login(user)
+        rngs = [random.Random(seed_value + i) for i in range(len(shoppers))]
+        with override_settings(ALLOWED_HOSTS=['testserver'],
+                               EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'), FakeStripe():
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=len(shoppers)) as executor:
+                for future in [executor.submit(shop, user, client, product_ids, iterations, report, lock, rng)
+                               for user, client, rng in zip(shoppers, clients, rngs)]:
+                    future.result()
+            report.elapsed = time.perf_counter() - started
+        report.violations = check_invariants(initial_stock)
+    finally:
+        clear()
+    return report
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from store.catalog_io import detect_format, export_products
+
+
+class Command(BaseCommand):
+    help = 'Export every product to a CSV or JSON Lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for standard output')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = detect_format(path, options['format'])
+        if path == '-':
+            export_products(self.stdout, format, options['batch_size'])
+            return
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            count = export_products(f, format, options['batch_size'])
+        self.stderr.write(self.style.SUCCESS(f'Exported {count} products to {path}.'))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.catalog_io import ProductImporter, detect_format
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSON Lines file, creating new rows and updating rows with a known id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--images-dir', help='Directory the image column is relative to')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=8, help='Threads used to copy images')
+
+    def handle(self, *args, **options):
+        def report(line_number, message):
+            self.stderr.write(f'Line {line_number}: {message}')
+
+        importer = ProductImporter(
+            images_dir=options['images_dir'],
+            batch_size=options['batch_size'],
+            image_workers=options['workers'],
+            on_error=report,
+        )
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as f:
+                stats = importer.run(f, detect_format(options['path'], options['format']))
+        except OSError as e:
+            raise CommandError(f"Could not read {options['path']}: {e.strerror or e}")
+
+        style = self.style.WARNING if stats.errors else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Processed {stats.rows} rows in {stats.elapsed:.1f}s ({stats.throughput:.0f} rows/s): '
+            f'{stats.created} created, {stats.updated} updated, {len(stats.errors)} errors.'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from store.loadtest import ProductionDatabase, run
+
+
+class Command(BaseCommand):
+    help = ('Drive the cart and checkout views with concurrent shoppers and report latency, throughput, '
+            'query counts and stock invariant violations; Stripe and SMTP are replaced by local stand-ins')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100, help='Concurrent shoppers, one thread each')
+        parser.add_argument('--iterations', type=int, default=5, help='Shopping rounds per shopper')
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=25, help='Highest starting stock of a product')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible runs')
+        parser.add_argument('--i-know-this-is-production', action='store_true', dest='allow_production',
+                            help='Run even though DEBUG is off and the database is not named like a test one')
+
+    def handle(self, *args, **options):
+        try:
+            report = run(products=options['products'], users=options['users'], iterations=options['iterations'],
+                         stock=options['stock'], seed_value=options['seed'],
+                         allow_production=options['allow_production'])
+        except ProductionDatabase as e:
+            raise CommandError(f'{e}. Pass --i-know-this-is-production to run anyway.')
+        for line in report.lines():
+            self.stdout.write(line)
+        if report.violations:
+            raise CommandError(f'{len(report.violations)} stock invariant violations')
+        self.stdout.write(self.style.SUCCESS('Stock invariants held.'))
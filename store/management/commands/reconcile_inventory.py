@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from store.inventory import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Roll up new stock movements and report products whose stock no longer matches the ledger'
+
+    def handle(self, *args, **options):
+        drift = reconcile()
+        for product_id, stock, ledger in drift:
+            self.stdout.write(self.style.WARNING(
+                f'Product {product_id}: stock is {stock}, movements add up to {ledger} ({stock - ledger:+d}).'))
+        if drift:
+            self.stdout.write(self.style.WARNING(f'{len(drift)} products drifted from the ledger.'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Stock matches the ledger.'))
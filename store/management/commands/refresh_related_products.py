@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from store.related import refresh_all
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related products shown on product detail pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        refreshed = refresh_all(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Refreshed related products for {refreshed} products.'))
@@ -0,0 +1,13 @@
+
+class CartCookieMiddleware:
+    """ Write the anonymous cart back to its cookie when a view changed it """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        cart = getattr(request, '_cookie_cart', None)
+        if cart is not None and cart.modified:
+            cart.save(response)
+        return response
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_search_index(apps, schema_editor):
+    from store.search import product_terms
+
+    Product = apps.get_model('store', 'Product')
+    ProductSearchTerm = apps.get_model('store', 'ProductSearchTerm')
+    rows = []
+    for pk, name, description in Product.objects.values_list('pk', 'name', 'description').iterator():
+        for term, weight in product_terms(name, description).items():
+            rows.append(ProductSearchTerm(product_id=pk, term=term, weight=weight))
+    ProductSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+def create_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from store.search import search_vector
+
+        Product = apps.get_model('store', 'Product')
+        schema_editor.add_index(Product, GinIndex(search_vector(), name='store_product_fulltext'))
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'CREATE FULLTEXT INDEX store_product_fulltext ON store_product (name, description)'
+        )
+
+
+def drop_fulltext_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS store_product_fulltext')
+    elif vendor == 'mysql':
+        schema_editor.execute('DROP INDEX store_product_fulltext ON store_product')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_alter_product_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.PositiveSmallIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'product'], name='store_search_term_idx')],
+                'unique_together': {('product', 'term')},
+            },
+        ),
+        migrations.RunPython(build_search_index, migrations.RunPython.noop),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
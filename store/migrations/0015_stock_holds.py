@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:23
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def hold_existing_cart_items(apps, schema_editor):
+    # Stock for carts filled before holds existed was already taken, so record it as held
+    CartItem = apps.get_model('store', 'CartItem')
+    StockHold = apps.get_model('store', 'StockHold')
+    expires_at = timezone.now() + timedelta(minutes=30)
+    StockHold.objects.bulk_create(
+        StockHold(cart_item_id=pk, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for pk, product_id, quantity in CartItem.objects.values_list('pk', 'product_id', 'quantity').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_image_widths'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('cart_item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='store.cartitem')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='store.product')),
+            ],
+        ),
+        migrations.RunPython(hold_existing_cart_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 13:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def record_opening_stock(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    StockMovement = apps.get_model('store', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        (StockMovement(product_id=pk, delta=stock, reason='opening')
+         for pk, stock in Product.objects.values_list('pk', 'stock').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_stock_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockRollup',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stock_rollup', serialize=False, to='store.product')),
+                ('quantity', models.IntegerField(default=0)),
+                ('movement_id', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('reason', models.CharField(choices=[('opening', 'Opening stock'), ('reserve', 'Reserved in a cart'), ('release', 'Released from a cart'), ('expire', 'Expired cart hold'), ('sale', 'Sold'), ('adjustment', 'Manual adjustment'), ('import', 'Bulk import')], max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('product', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='store.product')),
+            ],
+        ),
+        migrations.RunPython(record_opening_stock, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_order_lines(apps, schema_editor):
+    # The JSON items never recorded what was paid, so the current name and
+    # price are the best snapshot left; products deleted since keep only their id
+    Order = apps.get_model('store', 'Order')
+    OrderLine = apps.get_model('store', 'OrderLine')
+    Product = apps.get_model('store', 'Product')
+    products = {pk: (name, price) for pk, name, price in Product.objects.values_list('pk', 'name', 'price').iterator()}
+    lines = []
+    for order_id, items in Order.objects.values_list('pk', 'items').iterator(chunk_size=2000):
+        for item in items or []:
+            if 'product_id' not in item:
+                continue
+            name, price = products.get(item['product_id'], (f"Product #{item['product_id']}", 0))
+            lines.append(OrderLine(order_id=order_id, product_id=item['product_id'] if item['product_id'] in products else None,
+                                   name=name, unit_price=price, quantity=item.get('quantity', 1)))
+        if len(lines) >= 1000:
+            OrderLine.objects.bulk_create(lines)
+            lines = []
+    OrderLine.objects.bulk_create(lines)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_cart_item_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('quantity', models.PositiveIntegerField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='store.order')),
+                ('product', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='store.product')),
+            ],
+            options={
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.RunPython(backfill_order_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_checkout_sessions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripePrice',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stripe_price', serialize=False, to='store.product')),
+                ('stripe_product_id', models.CharField(max_length=255)),
+                ('price_id', models.CharField(blank=True, max_length=255)),
+                ('unit_amount', models.PositiveIntegerField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_order_history_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stripeprice',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='stripeprice',
+            name='unit_amount',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
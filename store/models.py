@@ -11,23 +11,125 @@ class Product(models.Model):
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to='static/images/products')
+    image_widths = models.JSONField(default=list, blank=True, editable=False)  # Resized copies, see core.images
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     stock = models.PositiveIntegerField(default=0)  
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        # Keyset pagination seeks on (sort key, id) for each catalog sort
+        indexes = [
+            models.Index(fields=['price', 'id'], name='store_product_price_idx'),
+            models.Index(fields=['created_at', 'id'], name='store_product_created_idx'),
+            models.Index(fields=['name', 'id'], name='store_product_name_idx'),
+            models.Index(fields=['category', 'price'], name='store_product_cat_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
 
+class ProductSearchTerm(models.Model):
+    # Inverted index over product names and descriptions, maintained by store.search
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='search_terms')
+    term = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        unique_together = ('product', 'term')
+        indexes = [
+            models.Index(fields=['term', 'product'], name='store_search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.product_id}"
+
+
+class RelatedProduct(models.Model):
+    # Precomputed "You May Also Like" neighbours, maintained by store.related
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+
+    class Meta:
+        ordering = ['product', 'rank']
+        unique_together = ('product', 'rank')
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.related_id} (#{self.rank})"
+
+
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # Last activity, see store.cart.sweep_abandoned
 
     def __str__(self):
         return f"{self.product.name} ({self.quantity})"
 
+    @property
+    def max_quantity(self):
+        """ What this item can grow to: the stock left plus the units it already holds """
+        hold = getattr(self, 'hold', None)
+        return self.product.stock + (hold.quantity if hold else 0)
+
+
+class StockMovement(models.Model):
+    # Append-only ledger of every change to Product.stock, written by store.inventory
+    OPENING = 'opening'
+    RESERVE = 'reserve'
+    RELEASE = 'release'
+    EXPIRE = 'expire'
+    SALE = 'sale'
+    ADJUSTMENT = 'adjustment'
+    IMPORT = 'import'
+    REASON_CHOICES = [
+        (OPENING, 'Opening stock'),
+        (RESERVE, 'Reserved in a cart'),
+        (RELEASE, 'Released from a cart'),
+        (EXPIRE, 'Expired cart hold'),
+        (SALE, 'Sold'),
+        (ADJUSTMENT, 'Manual adjustment'),
+        (IMPORT, 'Bulk import'),
+    ]
+    # No database constraint, so the history outlives deleted products
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Stock movements are append-only')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.product_id} {self.delta:+d} ({self.reason})"
+
+
+class StockRollup(models.Model):
+    # Sum of a product's movements up to movement_id, advanced by store.inventory.reconcile
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stock_rollup')
+    quantity = models.IntegerField(default=0)
+    movement_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} (to movement {self.movement_id})"
+
+
+class StockHold(models.Model):
+    # Units taken out of Product.stock for a cart item, maintained by store.inventory
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='hold')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='holds')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
+
 
 class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -38,15 +140,76 @@ class Order(models.Model):
     city = models.CharField(max_length=100)
     state = models.CharField(max_length=100)
     zip_code = models.CharField(max_length=10)
-    items = models.JSONField(default=list)  # JSON field to store order items
+    items = models.JSONField(default=list)  # Kept for older readers; OrderLine is the record of what was sold
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     delivery_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)  
     shipping_date = models.DateField(null=True, blank=True)  
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Order history is read newest first, one user at a time
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx')]
+
     def __str__(self):
         return f"Order {self.id} by {self.user}"
 
 
+class OrderLine(models.Model):
+    # What was bought, at the name and price of the day; product is kept
+    # for links and reporting but may disappear from the catalog later
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='order_lines')
+    name = models.CharField(max_length=255)
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"{self.quantity} x {self.name}"
+
+    @property
+    def line_total(self):
+        return self.unit_price * self.quantity
+
+
+class StripePrice(models.Model):
+    # The Stripe Product and Price a catalog product is sold under, so
+    # checkout creates Stripe objects only for new or repriced products
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='stripe_price')
+    # Blank until checkout creates them; the row exists first so it can be locked, see store.payments
+    stripe_product_id = models.CharField(max_length=255, blank=True)
+    price_id = models.CharField(max_length=255, blank=True)
+    unit_amount = models.PositiveIntegerField(default=0)  # In cents, what price_id charges
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.price_id or '(none yet)'}"
+
+
+class CheckoutSession(models.Model):
+    # One row per Stripe checkout session. The unique session id makes
+    # finalizing an order idempotent, see store.payments.finalize
+    OPEN = 'open'
+    COMPLETE = 'complete'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (OPEN, 'Awaiting payment'),
+        (COMPLETE, 'Paid'),
+        (EXPIRED, 'Expired'),
+    ]
+    session_id = models.CharField(max_length=255, unique=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='checkout_sessions')
+    shipping = models.JSONField(default=dict)
+    items = models.JSONField(default=list)  # The cart as it was sent to Stripe
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=OPEN)
+    order = models.OneToOneField(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='checkout_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.session_id} ({self.status})"
+
+
 
 
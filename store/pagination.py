@@ -0,0 +1,138 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+SORT_OPTIONS = {
+    'newest': ('-created_at', 'Newest'),
+    'price': ('price', 'Price: low to high'),
+    'price_desc': ('-price', 'Price: high to low'),
+    'name': ('name', 'Name'),
+}
+RELEVANCE_SORT = ('-search_rank', 'Relevance')
+DEFAULT_SORT = 'newest'
+PRODUCTS_PER_PAGE = 24
+ORDERS_PER_PAGE = 20
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+def sort_options(query=''):
+    """ The sorts available for a listing, relevance first when searching """
+    options = dict(SORT_OPTIONS)
+    if query:
+        options = {'relevance': RELEVANCE_SORT, **options}
+    return options
+
+
+def encode_cursor(value, pk, backwards=False):
+    if isinstance(value, Decimal):
+        value = str(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([value, pk, int(backwards)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field):
+    """ Return (value, pk, backwards) from a cursor, converting value for the field """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk, backwards = json.loads(payload)
+        if field is not None:
+            value = field.to_python(value)
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError('The cursor key of an annotation must be a number')  # Such as search_rank
+        if value is None:
+            raise ValueError('The cursor has no key value')
+        return value, int(pk), bool(backwards)
+    except (binascii.Error, TypeError, ValueError, ValidationError) as e:
+        raise InvalidCursor(str(e))
+
+
+def seek(queryset, ordering, cursor=None):
+    """
+    Order queryset by (ordering, pk) and position it just past cursor.
+
+    Instead of an OFFSET, a page seeks past the (sort key, pk) of the last
+    row of the previous page, so reading any page is a single index range
+    scan. Returns (queryset, sort field name, backwards); a backwards walk
+    is ordered in reverse and its rows need reversing once read.
+    """
+    descending = ordering.startswith('-')
+    name = ordering.lstrip('-')
+    try:
+        field = queryset.model._meta.get_field(name)
+    except FieldDoesNotExist:
+        field = None  # An annotation such as search_rank
+
+    backwards = False
+    if cursor:
+        value, pk, backwards = decode_cursor(cursor, field)
+        # Walking forwards in a descending sort means going down the index
+        seek_down = descending != backwards
+        op = 'lt' if seek_down else 'gt'
+        bound = 'lte' if seek_down else 'gte'
+        queryset = queryset.filter(
+            Q(**{f'{name}__{bound}': value}),
+            Q(**{f'{name}__{op}': value}) | Q(**{name: value, f'pk__{op}': pk}),
+        )
+
+    prefix = '-' if descending != backwards else ''
+    return queryset.order_by(f'{prefix}{name}', f'{prefix}pk'), name, backwards
+
+
+def page_cursors(first, last, name, cursor, backwards, has_more):
+    """ The (next, previous) cursors of a page given its first and last rows """
+    def cursor_for(row, backwards):
+        if isinstance(row, dict):
+            return encode_cursor(row[name], row['pk'], backwards)
+        return encode_cursor(getattr(row, name), row.pk, backwards)
+
+    next_cursor = cursor_for(last, False) if (has_more or backwards) else None
+    previous_cursor = cursor_for(first, True) if (cursor and (has_more or not backwards)) else None
+    return next_cursor, previous_cursor
+
+
+def paginate(queryset, ordering, cursor=None, per_page=PRODUCTS_PER_PAGE):
+    """
+    Return one KeysetPage of queryset ordered by (ordering, pk), reading
+    at most per_page + 1 rows from the (sort key, id) index.
+    """
+    queryset, name, backwards = seek(queryset, ordering, cursor)
+    rows = list(queryset[:per_page + 1])
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+    if not rows:
+        return KeysetPage([])
+    next_cursor, previous_cursor = page_cursors(rows[0], rows[-1], name, cursor, backwards, has_more)
+    return KeysetPage(rows, next_cursor, previous_cursor)
@@ -0,0 +1,183 @@
+"""
+Orders are finalized from Stripe webhooks, not from the customer's
+browser. Checkout records a CheckoutSession with the shipping details and
+the cart it charged for; when Stripe reports the session paid, finalize()
+turns it into an Order exactly once, however often the event is delivered.
+"""
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+import stripe
+from django.db import transaction
+from django.utils import timezone
+
+from core import outbox
+
+from . import inventory
+from .cart import forget_summaries
+from .models import CartItem, CheckoutSession, Order, OrderLine, Product, StockMovement, StripePrice
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_COST = Decimal('0.00')  # Free shipping for now
+SHIPPING_DAYS = 5
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+CURRENCY = 'usd'
+
+
+def to_cents(amount):
+    return int(round(Decimal(str(amount)) * 100))
+
+
+def price_ids(products):
+    """
+    The Stripe Price id of each product, as {product id: price id}. They
+    come from StripePrice; Stripe is only called for products sold for
+    the first time or repriced since their Price was created.
+    """
+    products = {product.pk: product for product in products}
+    cached = StripePrice.objects.in_bulk(products)
+    ids = {}
+    for pk, product in products.items():
+        cents = to_cents(product.price)
+        entry = cached.get(pk)
+        if entry and entry.price_id and entry.unit_amount == cents:
+            ids[pk] = entry.price_id
+        else:
+            ids[pk] = create_price(product, cents)
+    return ids
+
+
+@transaction.atomic
+def create_price(product, cents):
+    """
+    Create the Stripe Price (and, the first time, Product) that sells
+    product at cents. The StripePrice row is locked across the Stripe
+    calls, so concurrent first checkouts of a product wait for one set of
+    Stripe objects instead of each creating, and orphaning, their own.
+    """
+    StripePrice.objects.get_or_create(product=product)
+    entry = StripePrice.objects.select_for_update().get(product=product)
+    if entry.price_id and entry.unit_amount == cents:
+        return entry.price_id  # Created by the checkout we waited for
+    if not entry.stripe_product_id:
+        entry.stripe_product_id = stripe.Product.create(name=product.name, metadata={'product_id': product.pk}).id
+    entry.price_id = stripe.Price.create(product=entry.stripe_product_id, unit_amount=cents, currency=CURRENCY).id
+    entry.unit_amount = cents
+    entry.save()
+    return entry.price_id
+
+
+def line_items(contents):
+    """ One Stripe line item per cart line, so the receipt lists what was bought """
+    ids = price_ids(item.product for item in contents.items)
+    return [{'price': ids[item.product_id], 'quantity': item.quantity} for item in contents.items]
+
+
+def start(session_id, user, shipping, contents):
+    """ Remember what a new Stripe session charges for, so the webhook can build the order later """
+    items = [
+        {'product_id': item.product_id, 'name': item.product.name,
+         'unit_price': str(item.product.price), 'quantity': item.quantity}
+        for item in contents.items
+    ]
+    return CheckoutSession.objects.create(session_id=session_id, user=user, shipping=shipping,
+                                          items=items, amount=contents.total)
+
+
+@transaction.atomic
+def finalize(session_id):
+    """
+    Create the order of a paid session, settle its stock and take the
+    bought quantities out of the cart. The session row is locked first, so
+    concurrent deliveries of the same event queue up, and the later ones
+    find the order already there and return it unchanged.
+    """
+    checkout = CheckoutSession.objects.select_for_update().filter(session_id=session_id).first()
+    if checkout is None:
+        logger.warning('Payment for unknown checkout session %s', session_id)
+        return None
+    if checkout.order_id is not None:
+        return checkout.order
+
+    quantities = {item['product_id']: item['quantity'] for item in checkout.items}
+    order = Order.objects.create(
+        user_id=checkout.user_id,
+        **checkout.shipping,
+        items=[{'product_id': pk, 'quantity': quantity} for pk, quantity in quantities.items()],
+        total_amount=checkout.amount + DELIVERY_COST,
+        delivery_cost=DELIVERY_COST,
+        shipping_date=timezone.localdate() + timedelta(days=SHIPPING_DAYS),
+    )
+    existing = set(Product.objects.filter(pk__in=quantities).values_list('pk', flat=True))
+    OrderLine.objects.bulk_create(
+        OrderLine(order=order, product_id=item['product_id'] if item['product_id'] in existing else None,
+                  name=item['name'], unit_price=Decimal(item['unit_price']), quantity=item['quantity'])
+        for item in checkout.items
+    )
+
+    # Settle against the cart as it is now; the customer may have changed it while paying
+    cart_items = list(CartItem.objects.filter(user_id=checkout.user_id, product_id__in=existing))
+    left = {item.pk: item.quantity - quantities[item.product_id] for item in cart_items}
+    for item in cart_items:
+        item.quantity = quantities[item.product_id]
+    with inventory.batched_movements():
+        inventory.settle(cart_items)
+        for product_id in existing - {item.product_id for item in cart_items}:
+            inventory.adjust(product_id, -quantities[product_id], StockMovement.SALE)
+    # Units added while paying stay in the cart, unheld like a lapsed hold; checkout reserves them again
+    kept = [item for item in cart_items if left[item.pk] > 0]
+    for item in kept:
+        item.quantity = left[item.pk]
+    CartItem.objects.bulk_update(kept, ['quantity'])
+    CartItem.objects.filter(pk__in=[item.pk for item in cart_items if left[item.pk] <= 0]).delete()
+
+    checkout.order = order
+    checkout.status = CheckoutSession.COMPLETE
+    checkout.save(update_fields=['order', 'status'])
+    transaction.on_commit(lambda: forget_summaries([checkout.user_id]))
+    send_confirmation(order)
+    return order
+
+
+def expire(session_id):
+    """ The customer never paid; their holds lapse on their own """
+    CheckoutSession.objects.filter(session_id=session_id, status=CheckoutSession.OPEN).update(
+        status=CheckoutSession.EXPIRED)
+
+
+def handle_event(event):
+    """ Act on a verified Stripe event; types the store does not use are ignored """
+    session = event['data']['object']
+    if event['type'] in PAID_EVENTS and session['payment_status'] == 'paid':
+        finalize(session['id'])
+    elif event['type'] == 'checkout.session.expired':
+        expire(session['id'])
+
+
+def send_confirmation(order):
+    """ Queued in the outbox with the order, so the email goes out if and only if the order commits """
+    email_body = f"""
+    Thank you for your order, {order.first_name}!
+
+    Order Number: {order.id}
+    Date: {order.created_at}
+    Total Amount: ${order.total_amount}
+    Delivery Cost: ${order.delivery_cost}
+    Shipping Date: {order.shipping_date}
+
+    Shipping Address:
+    {order.first_name} {order.last_name}
+    {order.address}
+    {order.city}, {order.state} {order.zip_code}
+
+    Items:
+    """
+    for line in order.lines.all():
+        email_body += f"""
+        - {line.name}
+          Price: ${line.unit_price}
+          Quantity: {line.quantity}
+        """
+    outbox.enqueue(f"Order Confirmation - {order.id}", email_body, [order.email])
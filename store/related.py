@@ -0,0 +1,130 @@
+import math
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import OrderLine, Product, RelatedProduct
+
+RELATED_COUNT = 4
+# How many same-category products on each side of a product's price are considered
+PRICE_NEIGHBOURS = 8
+
+CATEGORY_SCORE = 1.0
+CO_PURCHASE_SCORE = 2.0
+
+
+def co_purchase_counts(product_ids=None):
+    """
+    Count how often each pair of products was bought together, with one
+    grouped self-join over OrderLine. Returns
+    {product_id: Counter({other_id: orders})}, limited to product_ids when given.
+    """
+    lines = OrderLine.objects.filter(product__isnull=False)
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+    pairs = (
+        lines.annotate(other_id=F('order__lines__product_id'))
+        .filter(other_id__isnull=False).exclude(other_id=F('product_id'))
+        .values_list('product_id', 'other_id').annotate(orders=Count('order_id', distinct=True)).order_by()
+    )
+    counts = defaultdict(Counter)
+    for product_id, other_id, orders in pairs.iterator(chunk_size=2000):
+        counts[product_id][other_id] = orders
+    return counts
+
+
+def price_proximity(price, other_price):
+    """ 1.0 for the same price, falling towards 0 as prices drift apart """
+    price, other_price = float(price), float(other_price)
+    scale = max(price, other_price, 0.01)
+    return 1.0 - min(abs(price - other_price) / scale, 1.0)
+
+
+def score_candidates(product, neighbours, bought_with, prices):
+    """
+    Rank candidate products for one product. neighbours are same-category
+    (pk, price) pairs, bought_with a Counter of co-purchases and prices a
+    {pk: price} dict covering every candidate.
+    """
+    scores = {}
+    for pk, price in neighbours:
+        if pk != product[0]:
+            scores[pk] = CATEGORY_SCORE + price_proximity(product[1], price)
+    for pk, orders in bought_with.items():
+        if pk in prices:
+            scores[pk] = scores.get(pk, price_proximity(product[1], prices[pk])) \
+                + CO_PURCHASE_SCORE * math.log1p(orders)
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return ranked[:RELATED_COUNT]
+
+
+def _entries(product_id, ranked):
+    return [
+        RelatedProduct(product_id=product_id, related_id=pk, rank=rank, score=score)
+        for rank, (pk, score) in enumerate(ranked)
+    ]
+
+
+def refresh_all(batch_size=1000):
+    """ Recompute the related products of the whole catalog """
+    catalog = list(Product.objects.values_list('pk', 'category', 'price').order_by('category', 'price', 'pk'))
+    prices = {pk: price for pk, category, price in catalog}
+    by_category = defaultdict(list)
+    for pk, category, price in catalog:
+        by_category[category].append((pk, price))
+    bought = co_purchase_counts()
+
+    with transaction.atomic():
+        RelatedProduct.objects.all().delete()
+        entries = []
+        for products in by_category.values():
+            for index, (pk, price) in enumerate(products):
+                window = products[max(index - PRICE_NEIGHBOURS, 0):index + PRICE_NEIGHBOURS + 1]
+                ranked = score_candidates((pk, price), window, bought.get(pk, Counter()), prices)
+                entries.extend(_entries(pk, ranked))
+                if len(entries) >= batch_size:
+                    RelatedProduct.objects.bulk_create(entries)
+                    entries = []
+        RelatedProduct.objects.bulk_create(entries)
+    return len(catalog)
+
+
+def price_neighbours(category, price, exclude=None):
+    """ The same-category products closest in price, using the (category, price) index """
+    products = Product.objects.filter(category=category).exclude(pk=exclude)
+    above = products.filter(price__gte=price).order_by('price', 'pk').values_list('pk', 'price')
+    below = products.filter(price__lt=price).order_by('-price', '-pk').values_list('pk', 'price')
+    return list(below[:PRICE_NEIGHBOURS]) + list(above[:PRICE_NEIGHBOURS])
+
+
+def refresh_products(product_ids):
+    """ Recompute the related products of a few products """
+    product_ids = set(product_ids)
+    products = Product.objects.filter(pk__in=product_ids).values_list('pk', 'category', 'price')
+    bought = co_purchase_counts(product_ids)
+    co_purchased = set().union(*bought.values()) if bought else set()
+    prices = dict(Product.objects.filter(pk__in=co_purchased).values_list('pk', 'price'))
+
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=product_ids).delete()
+        entries = []
+        for pk, category, price in products:
+            neighbours = price_neighbours(category, price, exclude=pk)
+            ranked = score_candidates((pk, price), neighbours, bought.get(pk, Counter()), prices)
+            entries.extend(_entries(pk, ranked))
+        RelatedProduct.objects.bulk_create(entries)
+
+
+def affected_products(product):
+    """ The product itself, its price neighbours and the products currently listing it """
+    affected = {product.pk}
+    affected.update(pk for pk, price in price_neighbours(product.category, product.price, exclude=product.pk))
+    affected.update(RelatedProduct.objects.filter(related_id=product.pk).values_list('product_id', flat=True))
+    return affected
+
+
+def related_products(product):
+    """ The precomputed related products of a product, in rank order """
+    entries = RelatedProduct.objects.filter(product=product).select_related('related')
+    return [entry.related for entry in entries[:RELATED_COUNT]]
@@ -0,0 +1,228 @@
+import re
+
+from django.db import connections
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Length
+
+from .models import Product, ProductSearchTerm
+
+# Weight of a term depending on where it appears in the product
+NAME_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+# Multiplier applied to a term depending on how it matched the query
+EXACT_MATCH = 4
+PREFIX_MATCH = 2
+FUZZY_MATCH = 1
+
+MAX_PREFIX_TERMS = 50
+MAX_FUZZY_TERMS = 5
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'the', 'to', 'with',
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """ Split text into lowercase search terms, dropping stop words """
+    terms = []
+    for token in TOKEN_RE.findall((text or '').lower()):
+        token = token.replace('_', '')
+        if len(token) < MIN_TERM_LENGTH or token in STOP_WORDS:
+            continue
+        terms.append(token[:MAX_TERM_LENGTH])
+    return terms
+
+
+def product_terms(name, description):
+    """ Return a {term: weight} dict for a product's name and description """
+    weights = {}
+    for term in set(tokenize(name)):
+        weights[term] = weights.get(term, 0) + NAME_WEIGHT
+    for term in set(tokenize(description)):
+        weights[term] = weights.get(term, 0) + DESCRIPTION_WEIGHT
+    return weights
+
+
+def index_product(product):
+    """ Replace the search terms stored for a single product """
+    ProductSearchTerm.objects.filter(product_id=product.pk).delete()
+    ProductSearchTerm.objects.bulk_create([
+        ProductSearchTerm(product_id=product.pk, term=term, weight=weight)
+        for term, weight in product_terms(product.name, product.description).items()
+    ])
+
+
+def index_products(product_ids, batch_size=1000):
+    """ Replace the search terms of many products, e.g. after a bulk import """
+    ProductSearchTerm.objects.filter(product_id__in=product_ids).delete()
+    rows = []
+    for pk, name, description in Product.objects.filter(pk__in=product_ids).values_list('pk', 'name', 'description'):
+        for term, weight in product_terms(name, description).items():
+            rows.append(ProductSearchTerm(product_id=pk, term=term, weight=weight))
+    ProductSearchTerm.objects.bulk_create(rows, batch_size=batch_size)
+
+
+def rebuild_index(batch_size=1000):
+    """ Rebuild the whole search index, streaming products in batches """
+    ProductSearchTerm.objects.all().delete()
+    rows = []
+    indexed = 0
+    products = Product.objects.values_list('pk', 'name', 'description').order_by('pk')
+    for pk, name, description in products.iterator(chunk_size=batch_size):
+        for term, weight in product_terms(name, description).items():
+            rows.append(ProductSearchTerm(product_id=pk, term=term, weight=weight))
+        indexed += 1
+        if len(rows) >= batch_size:
+            ProductSearchTerm.objects.bulk_create(rows)
+            rows = []
+    ProductSearchTerm.objects.bulk_create(rows)
+    return indexed
+
+
+def edit_distance(a, b, limit):
+    """ Damerau-Levenshtein distance, giving up once it exceeds limit """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def resolve_token(token):
+    """
+    Map a query token to the indexed terms it should match, with the
+    quality of each match: exact, prefix or (as a fallback) fuzzy.
+    """
+    terms = ProductSearchTerm.objects.values_list('term', flat=True).distinct()
+    matches = {}
+    # Range scan on the term index: every term starting with the token
+    prefixed = terms.filter(term__gte=token, term__lt=token + '\uffff').order_by('term')
+    for term in prefixed[:MAX_PREFIX_TERMS]:
+        matches[term] = EXACT_MATCH if term == token else PREFIX_MATCH
+    if matches or len(token) < 4:
+        return matches
+
+    # Typo tolerance: compare against terms of a similar length sharing the first letter
+    limit = 1 if len(token) < 8 else 2
+    candidates = terms.filter(
+        term__gte=token[0], term__lt=token[0] + '\uffff'
+    ).annotate(
+        term_length=Length('term')
+    ).filter(
+        term_length__gte=len(token) - limit, term_length__lte=len(token) + limit
+    )
+    scored = []
+    for term in candidates:
+        distance = edit_distance(token, term, limit)
+        if distance <= limit:
+            scored.append((distance, term))
+    for distance, term in sorted(scored)[:MAX_FUZZY_TERMS]:
+        matches[term] = FUZZY_MATCH
+    return matches
+
+
+def search_products(query, queryset=None):
+    """
+    Return products matching every word of the query, annotated with
+    search_rank and ordered by relevance.
+    """
+    if queryset is None:
+        queryset = Product.objects.all()
+    tokens = tokenize(query)
+    resolved = [resolve_token(token) for token in tokens]
+    if not resolved or not all(resolved):
+        return queryset.none()
+
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        queryset = _postgres_search(queryset, tokens, resolved)
+    elif vendor == 'mysql':
+        queryset = _mysql_search(queryset, tokens, resolved)
+    else:
+        queryset = _index_search(queryset, resolved)
+    return queryset.order_by('-search_rank', 'pk')
+
+
+def _index_search(queryset, resolved):
+    for matches in resolved:
+        queryset = queryset.filter(
+            pk__in=ProductSearchTerm.objects.filter(term__in=list(matches)).values('product_id')
+        )
+    qualities = {}
+    for matches in resolved:
+        for term, quality in matches.items():
+            qualities[term] = max(quality, qualities.get(term, 0))
+    quality = Case(
+        *[When(term=term, then=Value(value)) for term, value in qualities.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+    rank = ProductSearchTerm.objects.filter(
+        product=OuterRef('pk'), term__in=list(qualities)
+    ).values('product').annotate(
+        rank=Sum(F('weight') * quality)
+    ).values('rank')
+    return queryset.annotate(search_rank=Subquery(rank, output_field=IntegerField()))
+
+
+def _native_terms(token, matches):
+    # A token with exact or prefix hits is sent as a prefix query, a
+    # misspelled one is replaced by the indexed terms it resolved to
+    if FUZZY_MATCH in matches.values():
+        return sorted(matches)
+    return [token]
+
+
+def _postgres_search(queryset, tokens, resolved):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    raw = ' & '.join(
+        '(' + ' | '.join(f'{term}:*' for term in _native_terms(token, matches)) + ')'
+        for token, matches in zip(tokens, resolved)
+    )
+    search_query = SearchQuery(raw, search_type='raw', config='english')
+    vector = search_vector()
+    return queryset.annotate(
+        search_document=vector,
+        search_rank=SearchRank(vector, search_query),
+    ).filter(search_document=search_query)
+
+
+def _mysql_search(queryset, tokens, resolved):
+    boolean_query = ' '.join(
+        '+(' + ' '.join(f'{term}*' for term in _native_terms(token, matches)) + ')'
+        for token, matches in zip(tokens, resolved)
+    )
+    table = Product._meta.db_table
+    match = RawSQL(
+        f'MATCH (`{table}`.`name`, `{table}`.`description`) AGAINST (%s IN BOOLEAN MODE)',
+        [boolean_query],
+    )
+    return queryset.annotate(search_rank=match).filter(search_rank__gt=0)
+
+
+def search_vector():
+    """ The weighted document used by the PostgreSQL full-text index """
+    from django.contrib.postgres.search import SearchVector
+
+    return (
+        SearchVector('name', weight='A', config='english')
+        + SearchVector('description', weight='B', config='english')
+    )
@@ -0,0 +1,88 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.db import transaction
+from django.dispatch import receiver
+from .models import CartItem, Product, StockMovement
+from .search import index_product
+from .related import affected_products, refresh_products
+from .cache import bump_version, product_namespace
+from .typeahead import TYPEAHEAD
+from .cart import cookie_cart, forget_summaries, merge
+from .inventory import record
+
+SEARCH_FIELDS = {'name', 'description'}
+RELATED_FIELDS = {'category', 'price'}
+# Everything catalog pages show but the stock level, see store.inventory
+CATALOG_FIELDS = {'name', 'description', 'price', 'image', 'image_widths', 'category'}
+
+
+def _changed(update_fields, fields):
+    return update_fields is None or bool(fields & set(update_fields))
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    # Search terms are removed with the product through the foreign key cascade
+    if _changed(update_fields, SEARCH_FIELDS):
+        index_product(instance)
+        bump_version(TYPEAHEAD)
+
+
+@receiver(post_save, sender=Product)
+def update_related_products(sender, instance, update_fields=None, raw=False, **kwargs):
+    if not raw and _changed(update_fields, RELATED_FIELDS):
+        refresh_products(affected_products(instance))
+
+
+@receiver(pre_delete, sender=Product)
+def collect_related_products(sender, instance, **kwargs):
+    instance._related_affected = affected_products(instance) - {instance.pk}
+
+
+@receiver(post_delete, sender=Product)
+def refresh_related_products(sender, instance, **kwargs):
+    affected = getattr(instance, '_related_affected', None)
+    if affected:
+        refresh_products(affected)
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_typeahead(sender, **kwargs):
+    bump_version(TYPEAHEAD)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_cache(sender, instance, update_fields=None, **kwargs):
+    if not _changed(update_fields, CATALOG_FIELDS):
+        # A stock-only save, which only the product page shows
+        transaction.on_commit(lambda: bump_version(product_namespace(instance.pk)))
+        return
+    # Bump again once committed so nothing rebuilt from the pre-commit data survives
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+@receiver(post_save, sender=Product)
+def record_opening_stock(sender, instance, created=False, raw=False, **kwargs):
+    # Later changes go through store.inventory, which records its own movements
+    if created and not raw and instance.stock:
+        record(instance.pk, instance.stock, StockMovement.OPENING)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_cart_summaries(sender, instance, update_fields=None, created=False, **kwargs):
+    # Cached cart totals of everyone with this product in their cart used the old price
+    if not created and _changed(update_fields, {'price'}):
+        forget_summaries(CartItem.objects.filter(product=instance).values_list('user_id', flat=True))
+
+
+@receiver(pre_delete, sender=Product)
+def forget_deleted_product_summaries(sender, instance, **kwargs):
+    forget_summaries(CartItem.objects.filter(product=instance).values_list('user_id', flat=True))
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is not None:
+        merge(cookie_cart(request), user)
@@ -1,7 +1,7 @@
 from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Product, CartItem
+from .models import Product, CartItem, CheckoutSession
 from django.core.files.uploadedfile import SimpleUploadedFile
 from .forms import ShippingForm, ProductForm
 from django.conf import settings
@@ -432,8 +432,10 @@ class CheckoutViewTestCase(TestCase):
             quantity=2
         )
 
+    @patch('stripe.Price.create', return_value=Mock(id='price_test'))
+    @patch('stripe.Product.create', return_value=Mock(id='prod_test'))
     @patch('stripe.checkout.Session.create')
-    def test_checkout_success(self, mock_stripe_session_create):
+    def test_checkout_success(self, mock_stripe_session_create, mock_product_create, mock_price_create):
         mock_session = Mock()
         mock_session.id = 'test_session_id'
         mock_session.url = 'https://example.com/checkout-session'
@@ -464,8 +466,9 @@ class CheckoutViewTestCase(TestCase):
 
         self.assertEqual(response.status_code, 302)  # Expecting a redirect to the checkout session
 
-        # Verify that the session data is stored correctly
-        session_data = self.client.session['checkout_data']
+        # Verify that the checkout session is stored correctly
+        checkout = CheckoutSession.objects.get(session_id='test_session_id')
+        session_data = checkout.shipping
         self.assertEqual(session_data['first_name'], 'John')
         self.assertEqual(session_data['last_name'], 'Doe')
         self.assertEqual(session_data['email'], 'johndoe@example.com')
@@ -473,7 +476,7 @@ class CheckoutViewTestCase(TestCase):
         self.assertEqual(session_data['city'], 'New York')
         self.assertEqual(session_data['state'], 'NY')
         self.assertEqual(session_data['zip_code'], '10001')
-        self.assertEqual(session_data['amount'], 20.00)  # 2 items at $10 each
+        self.assertEqual(checkout.amount, 20.00)  # 2 items at $10 each
 
         self.assertRedirects(response, 'https://example.com/checkout-session')
 
@@ -563,8 +566,9 @@ from django.test import TestCase, Client
 from django.urls import reverse
 from django.contrib.auth.models import User
 from unittest.mock import patch, Mock
-from .models import CartItem, Order, Product
+from .models import CartItem, CheckoutSession, Order, Product
 from datetime import date, timedelta
+from . import payments
 
 class PaymentSuccessViewTest(TestCase):
     def setUp(self):
@@ -574,30 +578,39 @@ class PaymentSuccessViewTest(TestCase):
         self.product = Product.objects.create(name='Test Product', price=10.00)
         CartItem.objects.create(user=self.user, product=self.product, quantity=2)
 
-        session = self.client.session
-        session['checkout_data'] = {
-            'first_name': 'John',
-            'last_name': 'Doe',
-            'email': 'john@example.com',
-            'address': '123 Street',
-            'city': 'City',
-            'state': 'State',
-            'zip_code': '12345',
-            'amount': 20.00
-        }
-        session.save()
+        CheckoutSession.objects.create(
+            session_id='test_session',
+            user=self.user,
+            shipping={
+                'first_name': 'John',
+                'last_name': 'Doe',
+                'email': 'john@example.com',
+                'address': '123 Street',
+                'city': 'City',
+                'state': 'State',
+                'zip_code': '12345',
+            },
+            items=[{'product_id': self.product.id, 'name': 'Test Product', 'unit_price': '10.00', 'quantity': 2}],
+            amount=20.00,
+        )
 
     @patch('stripe.checkout.Session.retrieve')
+    def test_payment_success_view_waits_for_the_webhook(self, mock_retrieve):
+        response = self.client.get(reverse('payment_success') + '?session_id=test_session')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Confirming Your Payment')
+        self.assertFalse(Order.objects.exists())
+        mock_retrieve.assert_not_called()
+
     @patch('django.db.models.fields.files.ImageFieldFile.url', new_callable=Mock)
-    def test_payment_success_view(self, mock_image_url, mock_retrieve):
+    def test_payment_success_view(self, mock_image_url):
         mock_image_url.return_value = 'http://example.com/test_image.jpg'
-        mock_session = Mock()
-        mock_session.payment_status = 'paid'
-        mock_retrieve.return_value = mock_session
+        payments.finalize('test_session')
 
         response = self.client.get(reverse('payment_success') + '?session_id=test_session')
         self.assertEqual(response.status_code, 200)
         self.assertTemplateUsed(response, 'store/payment_success.html')
+        self.assertContains(response, 'Payment Successful')
 
         # Check that the order was created
         order = Order.objects.get(user=self.user)
@@ -609,4 +622,1376 @@ class PaymentSuccessViewTest(TestCase):
         self.assertEqual(len(order.items), 1)
         self.assertEqual(order.items[0]['product_id'], self.product.id)
         self.assertEqual(order.items[0]['quantity'], 2)
+        line = order.lines.get()
+        self.assertEqual((line.product, line.name, line.unit_price, line.quantity),
+                         (self.product, self.product.name, self.product.price, 2))
+        self.assertFalse(CartItem.objects.filter(user=self.user).exists())
+
+    def test_other_users_cannot_see_the_session(self):
+        User.objects.create_user(username='other', password='testpassword')
+        self.client.login(username='other', password='testpassword')
+        response = self.client.get(reverse('payment_success') + '?session_id=test_session')
+        self.assertEqual(response.status_code, 404)
+
+
+
+########## PASS ##########
+from .models import ProductSearchTerm
+from .search import search_products, tokenize
+
+
+class ProductSearchTestCase(TestCase):
+    def setUp(self):
+        self.tomato = Product.objects.create(
+            name='Cherry Tomato Seeds',
+            description='Sweet cherry tomatoes for containers',
+            price=Decimal('3.50'),
+            category='seed',
+            stock=10
+        )
+        self.trowel = Product.objects.create(
+            name='Hand Trowel',
+            description='Stainless trowel, ideal for planting tomato seedlings',
+            price=Decimal('12.00'),
+            category='supply',
+            stock=5
+        )
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize('The Cherry-Tomato of 2024!'), ['cherry', 'tomato', '2024'])
+
+    def test_name_matches_rank_above_description_matches(self):
+        results = list(search_products('tomato'))
+        self.assertEqual(results, [self.tomato, self.trowel])
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    def test_prefix_match(self):
+        self.assertEqual(list(search_products('trow')), [self.trowel])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(list(search_products('trowle')), [self.trowel])
+
+    def test_all_words_must_match(self):
+        self.assertEqual(list(search_products('cherry trowel')), [])
+        self.assertEqual(list(search_products('stainless tomato')), [self.trowel])
+
+    def test_index_follows_product_changes(self):
+        self.trowel.name = 'Garden Spade'
+        self.trowel.description = 'Steel spade'
+        self.trowel.save()
+        self.assertEqual(list(search_products('trowel')), [])
+        self.assertEqual(list(search_products('spade')), [self.trowel])
+
+        trowel_id = self.trowel.id
+        self.trowel.delete()
+        self.assertEqual(list(search_products('spade')), [])
+        self.assertFalse(ProductSearchTerm.objects.filter(product_id=trowel_id).exists())
+
+
+########## PASS ##########
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .pagination import paginate, encode_cursor, decode_cursor, InvalidCursor, PRODUCTS_PER_PAGE, SORT_OPTIONS
+
+
+class KeysetPaginationTestCase(TestCase):
+    CATALOG_SIZE = 100000
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create skips the save signals, so the search index stays empty here
+        Product.objects.bulk_create([
+            Product(
+                name=f'Product {i:06d}',
+                description='Bulk product',
+                price=Decimal(i % 500) + Decimal('0.99'),
+                image='static/images/products/test.jpg',
+                category='seed' if i % 2 else 'supply',
+                stock=i % 7
+            )
+            for i in range(cls.CATALOG_SIZE)
+        ], batch_size=5000)
+
+    def test_pages_walk_the_whole_sort_in_order(self):
+        page = paginate(Product.objects.filter(price__lt=3), 'price', per_page=50)
+        seen = list(page)
+        while page.has_next:
+            page = paginate(Product.objects.filter(price__lt=3), 'price', page.next_cursor, per_page=50)
+            seen.extend(page)
+        expected = list(Product.objects.filter(price__lt=3).order_by('price', 'pk'))
+        self.assertEqual(seen, expected)
+
+    def test_previous_cursor_returns_previous_page(self):
+        first = paginate(Product.objects.all(), '-price')
+        second = paginate(Product.objects.all(), '-price', first.next_cursor)
+        back = paginate(Product.objects.all(), '-price', second.previous_cursor)
+        self.assertEqual(list(back), list(first))
+        self.assertFalse(first.has_previous)
+        self.assertTrue(second.has_previous)
+
+    def test_deep_page_costs_one_bounded_query(self):
+        middle = Product.objects.order_by('name', 'pk')[self.CATALOG_SIZE // 2]
+        cursors = [None, encode_cursor(middle.name, middle.pk)]
+        for cursor in cursors:
+            with CaptureQueriesContext(connection) as queries:
+                page = paginate(Product.objects.all(), 'name', cursor)
+            self.assertEqual(len(queries), 1)
+            self.assertIn(f'LIMIT {PRODUCTS_PER_PAGE + 1}', queries[0]['sql'])
+            self.assertNotIn('OFFSET', queries[0]['sql'])
+            self.assertEqual(len(page), PRODUCTS_PER_PAGE)
+        self.assertEqual(page.object_list[0].name, 'Product 050001')
+
+    def test_product_list_view_query_count_is_fixed(self):
+        response = self.client.get(reverse('product_list'), {'sort': 'price'})
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                response = self.client.get(reverse('product_list'), {'sort': 'price', 'cursor': response.context['page'].next_cursor})
+            self.assertEqual(len(response.context['products']), PRODUCTS_PER_PAGE)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        response = self.client.get(reverse('product_list'), {'sort': 'newest', 'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['page'].has_previous)
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        # Valid JSON whose key value is the wrong type for the sort field
+        tampered = {'newest': encode_cursor('notadate', 1), 'price': encode_cursor('abc', 1),
+                    'name': encode_cursor(None, 1)}
+        for sort, cursor in tampered.items():
+            with self.assertRaises(InvalidCursor):
+                decode_cursor(cursor, Product._meta.get_field(SORT_OPTIONS[sort][0].lstrip('-')))
+            response = self.client.get(reverse('product_list'), {'sort': sort, 'cursor': cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.context['page'].has_previous)
+
+
+########## PASS ##########
+from .models import OrderLine, RelatedProduct
+from .related import refresh_all, related_products
+
+
+class RelatedProductsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.basil = Product.objects.create(name='Basil', description='Herb', image='static/images/products/test.jpg', price=Decimal('2.00'), category='seed', stock=5)
+        self.parsley = Product.objects.create(name='Parsley', description='Herb', image='static/images/products/test.jpg', price=Decimal('2.10'), category='seed', stock=5)
+        self.pumpkin = Product.objects.create(name='Pumpkin', description='Squash', image='static/images/products/test.jpg', price=Decimal('9.00'), category='seed', stock=5)
+        self.pot = Product.objects.create(name='Pot', description='Clay pot', image='static/images/products/test.jpg', price=Decimal('15.00'), category='supply', stock=5)
+
+    def test_same_category_neighbours_by_price(self):
+        self.assertEqual(related_products(self.basil), [self.parsley, self.pumpkin])
+        self.assertEqual(related_products(self.pot), [])
+
+    def test_co_purchased_products_rank_first(self):
+        for _ in range(3):
+            order = Order.objects.create(user=self.user)
+            OrderLine.objects.bulk_create([
+                OrderLine(order=order, product=self.basil, name='Basil', unit_price=Decimal('2.00'), quantity=1),
+                OrderLine(order=order, product=self.pot, name='Pot', unit_price=Decimal('15.00'), quantity=1),
+            ])
+        refresh_all()
+        self.assertEqual(related_products(self.basil), [self.pot, self.parsley, self.pumpkin])
+        self.assertEqual(related_products(self.pot), [self.basil])
+
+    def test_price_change_refreshes_neighbours(self):
+        self.pumpkin.price = Decimal('2.05')
+        self.pumpkin.save()
+        self.assertEqual(related_products(self.basil), [self.pumpkin, self.parsley])
+
+    def test_delete_refreshes_products_listing_it(self):
+        self.parsley.delete()
+        self.assertEqual(related_products(self.basil), [self.pumpkin])
+        self.assertEqual(RelatedProduct.objects.filter(product=self.basil).count(), 1)
+
+    def test_detail_page_reads_related_products_in_one_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('product_detail', kwargs={'pk': self.basil.pk}))
+        self.assertEqual(response.context['related_products'], [self.parsley, self.pumpkin])
+        self.assertEqual(len(queries), 2)  # The product, then its related products
+
+
+########## PASS ##########
+import threading
+from django.core.cache import cache
+from . import cache as catalog_cache
+
+
+class CatalogCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(
+            name='Kale Seeds',
+            description='Curly kale',
+            price=Decimal('2.50'),
+            image='static/images/products/test.jpg',
+            category='seed',
+            stock=10
+        )
+
+    def test_repeat_views_are_served_from_cache(self):
+        self.client.get(reverse('product_list'), {'category': 'seed'})
+        self.client.get(reverse('product_list'), {'q': 'kale'})
+        self.client.get(reverse('product_detail', kwargs={'pk': self.product.pk}))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('product_list'), {'category': 'seed'})
+            searched = self.client.get(reverse('product_list'), {'q': 'kale'})
+            response = self.client.get(reverse('product_detail', kwargs={'pk': self.product.pk}))
+        self.assertContains(searched, 'Kale Seeds')
+        self.assertContains(response, '$2.50')
+
+    def test_product_save_and_delete_invalidate(self):
+        self.client.get(reverse('product_detail', kwargs={'pk': self.product.pk}))
+        version = catalog_cache.get_version()
+        self.product.price = Decimal('3.75')
+        self.product.save()
+        self.assertGreater(catalog_cache.get_version(), version)
+        response = self.client.get(reverse('product_detail', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, '$3.75')
+
+        self.client.get(reverse('product_list'))
+        self.product.delete()
+        response = self.client.get(reverse('product_list'))
+        self.assertNotContains(response, 'Kale Seeds')
+
+    def test_stock_only_save_keeps_the_catalog_cached(self):
+        self.client.get(reverse('product_list'))
+        version = catalog_cache.get_version()
+        self.product.stock = 4
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save(update_fields=['stock'])
+        self.assertEqual(catalog_cache.get_version(), version)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('product_list'))
+        response = self.client.get(reverse('product_detail', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, 'In Stock (4)')
+
+    def test_waits_for_the_worker_rebuilding_an_entry(self):
+        key = catalog_cache.make_key(catalog_cache.CATALOG, catalog_cache.get_version(), 'stampede')
+        cache.add(f'{key}:lock', 1)
+        builds = []
+
+        def rebuild_elsewhere():
+            cache.set(key, 'built by another worker')
+
+        timer = threading.Timer(0.1, rebuild_elsewhere)
+        timer.start()
+        value = catalog_cache.get_or_build(lambda: builds.append(1) or 'built here', 'stampede')
+        timer.join()
+        self.assertEqual(value, 'built by another worker')
+        self.assertEqual(builds, [])
+
+    def test_builds_itself_when_the_lock_is_released_without_a_value(self):
+        key = catalog_cache.make_key(catalog_cache.CATALOG, catalog_cache.get_version(), 'failed')
+        cache.add(f'{key}:lock', 1)
+        threading.Timer(0.1, cache.delete, [f'{key}:lock']).start()
+        self.assertEqual(catalog_cache.get_or_build(lambda: 'built here', 'failed'), 'built here')
+
+
+########## PASS ##########
+from .facets import facet_counts, parse_filters
+
+
+class FacetedNavigationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name, price, category, stock in [
+            ('Radish Seeds', '1.50', 'seed', 10),
+            ('Carrot Seeds', '2.00', 'seed', 0),
+            ('Seed Tray', '8.00', 'supply', 4),
+            ('Watering Can', '24.00', 'supply', 2),
+            ('Raised Bed', '120.00', 'supply', 0),
+        ]:
+            Product.objects.create(name=name, description=name, price=Decimal(price), category=category,
+                                   image='static/images/products/test.jpg', stock=stock)
+
+    def counts(self, **params):
+        return facet_counts(Product.objects.all(), parse_filters(params))
+
+    def test_all_counts_come_from_one_query(self):
+        with self.assertNumQueries(1):
+            counts = self.counts()
+        self.assertEqual(counts['category__all'], 5)
+        self.assertEqual(counts['category__seed'], 2)
+        self.assertEqual(counts['category__supply'], 3)
+        self.assertEqual(counts['price__under-5'], 2)
+        self.assertEqual(counts['price__5-20'], 1)
+        self.assertEqual(counts['price__20-50'], 1)
+        self.assertEqual(counts['price__over-50'], 1)
+        self.assertEqual(counts['in_stock'], 3)
+
+    def test_each_facet_is_counted_with_the_other_filters_applied(self):
+        counts = self.counts(category='supply', in_stock='1')
+        # Category counts ignore the category filter but respect in_stock
+        self.assertEqual(counts['category__seed'], 1)
+        self.assertEqual(counts['category__supply'], 2)
+        # Price counts respect both
+        self.assertEqual(counts['price__over-50'], 0)
+        self.assertEqual(counts['price__5-20'], 1)
+        # The in-stock count respects the category
+        self.assertEqual(counts['in_stock'], 2)
+
+    def test_product_list_filters_and_caches_counts(self):
+        params = {'category': 'supply', 'price': '20-50'}
+        response = self.client.get(reverse('product_list'), params)
+        self.assertEqual([p.name for p in response.context['products']], ['Watering Can'])
+        self.assertIn(('supply', 'Supplies', 1), response.context['facets']['categories'])
+        with self.assertNumQueries(0):
+            self.client.get(reverse('product_list'), params)
+
+    def test_unknown_price_band_is_ignored(self):
+        response = self.client.get(reverse('product_list'), {'price': 'free'})
+        self.assertEqual(len(response.context['products']), 5)
+
+
+########## PASS ##########
+import random
+import time
+from articles.models import Article
+from .typeahead import PrefixIndex
+
+
+class TypeaheadTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Cherry Tomato Seeds', description='Tomato', price=Decimal('3.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=3)
+
+    def test_prefix_index_matches_the_start_of_any_word(self):
+        index = PrefixIndex([{'title': 'Cherry Tomato Seeds'}, {'title': 'Tomatillo'}, {'title': 'Crème fraîche'}])
+        self.assertEqual([e['title'] for e in index.lookup('tom')], ['Tomatillo', 'Cherry Tomato Seeds'])
+        self.assertEqual([e['title'] for e in index.lookup('SEE')], ['Cherry Tomato Seeds'])
+        self.assertEqual([e['title'] for e in index.lookup('creme')], ['Crème fraîche'])
+        self.assertEqual(index.lookup('omato'), [])
+        self.assertEqual(index.lookup(''), [])
+
+    def test_endpoint_answers_from_memory(self):
+        Article.objects.create(title='Growing Tomatoes Indoors', content='...', image='static/images/articles/test.jpg')
+        response = self.client.get(reverse('autocomplete'), {'q': 'tom'})
+        self.assertEqual(response.json()['results'], [
+            {'title': 'Cherry Tomato Seeds', 'type': 'product', 'url': reverse('product_detail', args=[self.product.pk])},
+            {'title': 'Growing Tomatoes Indoors', 'type': 'article', 'url': reverse('article_detail', args=[Article.objects.get().pk])},
+        ])
+        with self.assertNumQueries(0):
+            self.client.get(reverse('autocomplete'), {'q': 'cher'})
+
+    def test_index_rebuilds_after_a_rename(self):
+        self.client.get(reverse('autocomplete'), {'q': 'cher'})
+        self.product.name = 'Roma Tomato Seeds'
+        self.product.save()
+        results = self.client.get(reverse('autocomplete'), {'q': 'rom'}).json()['results']
+        self.assertEqual([r['title'] for r in results], ['Roma Tomato Seeds'])
+
+    def test_lookup_latency_with_50k_names(self):
+        rng = random.Random(7)
+        words = ['basil', 'bean', 'beet', 'carrot', 'chard', 'chive', 'kale', 'leek', 'mint', 'onion',
+                 'pea', 'pepper', 'radish', 'sage', 'squash', 'thyme', 'tomato', 'trowel', 'pot', 'seed']
+        index = PrefixIndex(
+            {'title': f'{rng.choice(words).title()} {rng.choice(words).title()} {i}'} for i in range(50000)
+        )
+        prefixes = [rng.choice(words)[:rng.randint(1, 4)] for _ in range(2000)]
+        started = time.perf_counter()
+        for prefix in prefixes:
+            index.lookup(prefix)
+        per_lookup = (time.perf_counter() - started) / len(prefixes)
+        self.assertLess(per_lookup, 0.001, f'{len(index.keys)} keys, {per_lookup * 1e6:.1f} us per lookup')
+
+
+########## PASS ##########
+from .cart import DatabaseCart
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name='Mint', description='Mint', price=Decimal('2.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=3)
+        self.url = reverse('product_detail', kwargs={'pk': self.product.pk})
+
+    def test_unchanged_page_returns_304_without_rendering(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(0), self.assertTemplateNotUsed('store/product_detail.html'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(reverse('product_list'))
+        response = self.client.get(reverse('product_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_product_edit_changes_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.product.price = Decimal('2.50')
+        self.product.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '$2.50')
+
+    def test_etag_depends_on_the_user_and_their_cart(self):
+        etag = self.client.get(self.url)['ETag']
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        DatabaseCart(user).add(self.product)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_pending_messages_are_always_rendered(self):
+        user = User.objects.create_user(username='testuser', password='testpassword')
+        self.client.login(username='testuser', password='testpassword')
+        etag = self.client.get(self.url)['ETag']
+        self.client.get(reverse('add_to_cart', kwargs={'product_id': self.product.id}))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'has been added to your cart')
+
+
+########## PASS ##########
+import json
+
+
+class CatalogApiTestCase(TestCase):
+    def setUp(self):
+        self.products = [
+            Product.objects.create(name=f'Bean {i}', description='Climbing bean', price=Decimal(i),
+                                   category='seed' if i % 2 else 'supply', image='static/images/products/test.jpg', stock=i)
+            for i in range(1, 8)
+        ]
+
+    def get_json(self, url, params):
+        response = self.client.get(url, params)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, json.loads(content)
+
+    def test_sparse_fieldsets(self):
+        response, data = self.get_json(reverse('product_list_api'), {'fields': 'id,price', 'sort': 'price', 'limit': 2})
+        self.assertTrue(response.streaming)
+        self.assertEqual(data['results'], [{'id': self.products[0].id, 'price': '1.00'}, {'id': self.products[1].id, 'price': '2.00'}])
+
+        response, data = self.get_json(reverse('product_list_api'), {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', data['error'])
+
+    def test_cursor_pages_cover_the_catalog(self):
+        seen = []
+        params = {'fields': 'id', 'sort': 'price_desc', 'limit': 3}
+        response, data = self.get_json(reverse('product_list_api'), params)
+        seen += [row['id'] for row in data['results']]
+        self.assertIsNone(data['previous'])
+        while data['next']:
+            response, data = self.get_json(reverse('product_list_api'), dict(params, cursor=data['next']))
+            seen += [row['id'] for row in data['results']]
+        self.assertEqual(seen, [p.id for p in reversed(self.products)])
+
+        response, back = self.get_json(reverse('product_list_api'), dict(params, cursor=data['previous']))
+        self.assertEqual([row['id'] for row in back['results']], [p.id for p in reversed(self.products)][3:6])
+
+    def test_batch_fetch_uses_one_query(self):
+        ids = [self.products[4].id, self.products[1].id, 999999]
+        with self.assertNumQueries(1):
+            response, data = self.get_json(reverse('product_list_api'), {'ids': ','.join(map(str, ids)), 'fields': 'id,name,url'})
+        self.assertEqual(data['results'], [
+            {'id': self.products[4].id, 'name': 'Bean 5', 'url': reverse('product_detail', args=[self.products[4].id])},
+            {'id': self.products[1].id, 'name': 'Bean 2', 'url': reverse('product_detail', args=[self.products[1].id])},
+        ])
+
+    def test_same_filters_as_the_html_views(self):
+        response, data = self.get_json(reverse('product_list_api'), {'q': 'bean', 'category': 'supply', 'price': '5-20', 'fields': 'name'})
+        self.assertEqual(data['results'], [{'name': 'Bean 6'}])
+
+    def test_detail(self):
+        response = self.client.get(reverse('product_detail_api', args=[self.products[0].id]), {'fields': 'name,image'})
+        self.assertEqual(response.json(), {'name': 'Bean 1', 'image': '/static/images/products/test.jpg'})
+        self.assertEqual(self.client.get(reverse('product_detail_api', args=[999999])).status_code, 404)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('product_list_api'), {'cursor': '!!'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('product_list_api'), {'sort': 'price', 'cursor': encode_cursor('abc', 1)})
+        self.assertEqual(response.status_code, 400)
 
+
+########## PASS ##########
+import io
+import os
+import tempfile
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import override_settings
+from .catalog_io import ProductImporter, export_products
+from .inventory import reconcile, take_stock
+from .models import StockMovement
+
+
+class ProductImportExportTestCase(TestCase):
+    def run_import(self, text, format='csv', **kwargs):
+        return ProductImporter(**kwargs).run(io.StringIO(text), format)
+
+    def test_import_creates_updates_and_reports_errors(self):
+        existing = Product.objects.create(name='Old name', description='', price=Decimal('1.00'),
+                                          category='seed', image='static/images/products/test.jpg', stock=1)
+        stats = self.run_import(
+            'id,name,description,price,category,stock,image\n'
+            f'{existing.id},Runner bean,Climbing bean,2.50,seed,7,\n'
+            ',Garden trowel,Steel trowel,12.00,Supply,3,\n'
+            ',,Missing name,1.00,seed,1,\n'
+            ',Bad price,,abc,seed,1,\n'
+            ',Bad category,,1.00,tool,1,\n'
+        )
+        self.assertEqual((stats.rows, stats.created, stats.updated), (5, 1, 1))
+        self.assertEqual([line for line, message in stats.errors], [4, 5, 6])
+        existing.refresh_from_db()
+        self.assertEqual((existing.name, existing.price, existing.stock), ('Runner bean', Decimal('2.50'), 7))
+        self.assertEqual(existing.image, 'static/images/products/test.jpg')
+        self.assertEqual(list(search_products('trowel').values_list('name', flat=True)), ['Garden trowel'])
+
+    def test_import_keeps_sales_made_while_it_runs(self):
+        product = Product.objects.create(name='Bean', description='', price=Decimal('1.00'),
+                                         category='seed', image='static/images/products/test.jpg', stock=5)
+        in_bulk = Product.objects.in_bulk
+
+        def read_then_sell(ids):
+            products = in_bulk(ids)
+            take_stock(product.id, 1, StockMovement.SALE)
+            return products
+
+        with patch.object(Product.objects, 'in_bulk', read_then_sell):
+            self.run_import(f'id,name,price,category,stock\n{product.id},Bean,1.00,seed,7\n')
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 6)
+        self.assertEqual(StockMovement.objects.get(reason=StockMovement.IMPORT).delta, 2)
+        self.assertEqual(reconcile(timezone.now() + timedelta(hours=1)), [])
+
+    def test_a_row_the_database_refuses_does_not_abort_its_batch(self):
+        bulk_create = Product.objects.bulk_create
+
+        def refuse_broken(objs, *args, **kwargs):
+            if any(product.name == 'Broken' for product in objs):
+                raise IntegrityError('refused')
+            return bulk_create(objs, *args, **kwargs)
+
+        with patch.object(Product.objects, 'bulk_create', refuse_broken):
+            stats = self.run_import('name,price,category,stock\nBean,1.00,seed,1\nBroken,1.00,seed,1\n'
+                                    'Pea,1.00,seed,1\n')
+        self.assertEqual(stats.created, 2)
+        self.assertEqual(stats.errors, [(3, 'could not be saved: refused')])
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Bean', 'Pea'])
+        self.assertEqual(StockMovement.objects.filter(reason=StockMovement.OPENING).count(), 2)
+
+    def test_jsonl_import_with_images(self):
+        with tempfile.TemporaryDirectory() as images_dir, tempfile.TemporaryDirectory() as media_root:
+            with open(os.path.join(images_dir, 'bean.jpg'), 'wb') as f:
+                f.write(b'jpeg')
+            with override_settings(MEDIA_ROOT=media_root):
+                stats = self.run_import(
+                    '{"name": "Bean", "price": "1.00", "category": "seed", "image": "bean.jpg"}\n'
+                    '{"name": "Pea", "price": "1.00", "category": "seed", "image": "missing.jpg"}\n'
+                    'not json\n',
+                    format='jsonl', images_dir=images_dir,
+                )
+                product = Product.objects.get(name='Bean')
+                self.assertTrue(product.image.storage.exists(product.image.name))
+        self.assertEqual(stats.created, 1)
+        self.assertEqual(sorted(line for line, message in stats.errors), [2, 3])
+
+    def test_export_round_trip(self):
+        for i in range(3):
+            Product.objects.create(name=f'Seed {i}', description='', price=Decimal(i),
+                                   category='seed', image='static/images/products/test.jpg', stock=i)
+        out = io.StringIO()
+        self.assertEqual(export_products(out, 'jsonl'), 3)
+        Product.objects.all().delete()
+        stats = self.run_import(out.getvalue(), format='jsonl')
+        self.assertEqual((stats.created, stats.errors), (3, []))
+        self.assertEqual(sorted(Product.objects.values_list('name', flat=True)), ['Seed 0', 'Seed 1', 'Seed 2'])
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('name,price,category,stock\nBean,1.00,seed,5\n')
+        self.addCleanup(os.remove, f.name)
+        out = io.StringIO()
+        call_command('import_products', f.name, stdout=out, stderr=io.StringIO())
+        self.assertIn('1 created, 0 updated, 0 errors', out.getvalue())
+        out = io.StringIO()
+        call_command('export_products', format='csv', stdout=out)
+        self.assertIn('Bean,,1.00,seed,5', out.getvalue())
+
+    def test_large_import_is_batched(self):
+        rows = ''.join(f',Product {i},Description {i},{i % 500}.99,{"seed" if i % 2 else "supply"},{i % 40},\n'
+                       for i in range(100000))
+        start = time.monotonic()
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.run_import('id,name,description,price,category,stock,image\n' + rows, batch_size=2000)
+        elapsed = time.monotonic() - start
+        self.assertEqual(stats.created, 100000)
+        self.assertEqual(Product.objects.count(), 100000)
+        # Rows are written in multi-row statements, not one query per row
+        self.assertLess(len(queries), 100000 / 20)
+        self.assertLess(elapsed, 120)
+
+
+########## PASS ##########
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections
+from django.test import TransactionTestCase
+from .models import StockHold
+from . import inventory
+from . import cache as catalog_cache
+
+
+class StockReservationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='gardener', password='testpassword')
+        self.client.login(username='gardener', password='testpassword')
+        self.product = Product.objects.create(name='Tomato', description='Seeds', price=Decimal('3.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=5)
+
+    def stock(self):
+        self.product.refresh_from_db()
+        return self.product.stock
+
+    def test_add_update_and_delete_move_stock(self):
+        for _ in range(2):
+            self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        item = CartItem.objects.get(user=self.user)
+        self.assertEqual((item.quantity, item.hold.quantity, self.stock()), (2, 2, 3))
+
+        self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 4})
+        self.assertEqual((StockHold.objects.get().quantity, self.stock()), (4, 1))
+        response = self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 6}, follow=True)
+        self.assertContains(response, 'Only 5 items available in stock.')
+        self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 1})
+        self.assertEqual(self.stock(), 4)
+
+        self.client.post(reverse('delete_cart_item', args=[item.id]))
+        self.assertEqual((self.stock(), StockHold.objects.count()), (5, 0))
+
+    def test_sweeper_returns_expired_holds(self):
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        out = io.StringIO()
+        call_command('release_expired_holds', stdout=out)
+        self.assertIn('Released 1 expired stock holds.', out.getvalue())
+        self.assertEqual(self.stock(), 5)
+        # The cart item survives and reserves its stock again at checkout
+        item = CartItem.objects.get(user=self.user)
+        self.assertEqual(inventory.reserve_cart([item]), [])
+        self.assertEqual(self.stock(), 4)
+
+    def test_take_stock_never_goes_negative(self):
+        self.assertTrue(inventory.take_stock(self.product.id, 5))
+        self.assertFalse(inventory.take_stock(self.product.id, 1))
+        self.assertEqual(self.stock(), 0)
+
+    def test_sales_only_invalidate_the_catalog_when_a_product_sells_out(self):
+        cache.clear()
+        self.client.logout()
+        detail = reverse('product_detail', args=[self.product.id])
+        self.client.get(reverse('product_list'))
+        etag = self.client.get(detail)['ETag']
+        version = catalog_cache.get_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.take_stock(self.product.id, 2)
+        self.assertEqual(catalog_cache.get_version(), version)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('product_list'))
+        response = self.client.get(detail, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'In Stock (3)')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.take_stock(self.product.id, 3)
+        self.assertGreater(catalog_cache.get_version(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            inventory.return_stock(self.product.id, 1)
+        self.assertContains(self.client.get(reverse('product_list'), {'in_stock': '1'}), 'Tomato')
+
+
+class StockReservationStressTestCase(TransactionTestCase):
+    """ Many threads racing for the same stock must never oversell it """
+
+    def test_concurrent_add_to_cart_never_oversells(self):
+        product = Product.objects.create(name='Rare seed', description='', price=Decimal('1.00'),
+                                         category='seed', image='static/images/products/test.jpg', stock=50)
+        items = [CartItem.objects.create(user=User.objects.create_user(username=f'buyer{i}'), product=product)
+                 for i in range(16)]
+        attempts = 20
+
+        def shop(item):
+            reserved = 0
+            try:
+                for _ in range(attempts):
+                    while True:
+                        try:
+                            if inventory.reserve(item, reserved + 1):
+                                reserved += 1
+                            break
+                        except OperationalError:  # SQLite allows one writer at a time
+                            time.sleep(random.random() / 1000)
+            finally:
+                close_old_connections()
+            return reserved
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(items)) as executor:
+            reserved = sum(executor.map(shop, items))
+        elapsed = time.monotonic() - start
+        product.refresh_from_db()
+
+        self.assertEqual(reserved, 50)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(sum(StockHold.objects.values_list('quantity', flat=True)), 50)
+        throughput = len(items) * attempts / elapsed
+        self.assertGreater(throughput, 2, f'{len(items) * attempts} attempts in {elapsed:.2f}s ({throughput:.0f}/s)')
+
+
+########## PASS ##########
+from .cart import CART_COOKIE
+
+
+class AnonymousCartTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Squash', description='Seeds', price=Decimal('4.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=3)
+        self.user = User.objects.create_user(username='shopper', password='testpassword')
+
+    def test_anonymous_cart_lives_in_a_cookie(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('add_to_cart', args=[self.product.id]))
+            self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.assertFalse([q for q in queries if not q['sql'].startswith('SELECT')])
+        self.assertIn(CART_COOKIE, self.client.cookies)
+        self.assertFalse(CartItem.objects.exists())
+
+        response = self.client.get(reverse('cart_view'))
+        self.assertContains(response, 'Squash')
+        self.assertContains(response, f'id="quantity_{self.product.id}"')
+        response = self.client.post(reverse('update_cart', args=[self.product.id]), {'quantity': 5}, follow=True)
+        self.assertContains(response, 'Only 3 items available in stock.')
+        self.client.post(reverse('delete_cart_item', args=[self.product.id]))
+        self.assertEqual(self.client.get(reverse('cart_view')).context['cart_summary']['count'], 0)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies[CART_COOKIE] = '{"1":99}'
+        response = self.client.get(reverse('cart_view'))
+        self.assertEqual(list(response.context['cart_items']), [])
+
+    def test_full_cart_says_so(self):
+        other = Product.objects.create(name='Hoe', description='Tool', price=Decimal('20.00'),
+                                       category='supply', image='static/images/products/test.jpg', stock=3)
+        with patch('store.cart.MAX_LINES', 1):
+            self.client.get(reverse('add_to_cart', args=[self.product.id]))
+            response = self.client.get(reverse('add_to_cart', args=[other.id]), follow=True)
+            self.assertContains(response, 'Your cart is full')
+            self.assertNotContains(response, 'out of stock')
+            response = self.client.post(reverse('add_to_cart', args=[other.id]), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Your cart is full', response.json()['message'])
+
+    def test_login_merges_cart(self):
+        other = Product.objects.create(name='Hoe', description='Tool', price=Decimal('20.00'),
+                                       category='supply', image='static/images/products/test.jpg', stock=3)
+        CartItem.objects.create(user=self.user, product=self.product, quantity=1)
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.client.get(reverse('add_to_cart', args=[other.id]))
+
+        response = self.client.post(reverse('account_login'), {'login': 'shopper', 'password': 'testpassword'})
+        self.assertEqual(response.status_code, 302)
+        quantities = dict(CartItem.objects.filter(user=self.user).values_list('product__name', 'quantity'))
+        self.assertEqual(quantities, {'Squash': 2, 'Hoe': 1})
+        self.assertEqual(self.client.cookies[CART_COOKIE].value, '')
+
+
+########## PASS ##########
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory
+from .context_processors import cart as cart_context
+
+
+class CartSummaryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='badge', password='testpassword')
+        self.client.login(username='badge', password='testpassword')
+        self.product = Product.objects.create(name='Leek', description='Seeds', price=Decimal('2.50'),
+                                              category='seed', image='static/images/products/test.jpg', stock=10)
+
+    def summary(self):
+        return self.client.get(reverse('home')).context['cart_summary']
+
+    def test_badge_is_written_through_and_costs_no_queries(self):
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.assertEqual(self.summary(), {'count': 1, 'total': Decimal('5.00')})
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_context(request)['cart_summary']['count'], 1)
+
+        item = CartItem.objects.get(user=self.user)
+        self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 4})
+        self.assertEqual(self.summary()['total'], Decimal('10.00'))
+        self.client.post(reverse('delete_cart_item', args=[item.id]))
+        self.assertEqual(self.summary(), {'count': 0, 'total': Decimal('0.00')})
+
+    def test_price_change_invalidates_summary(self):
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.assertEqual(self.summary()['total'], Decimal('2.50'))
+        self.product.price = Decimal('3.00')
+        self.product.save()
+        self.assertEqual(self.summary()['total'], Decimal('3.00'))
+
+    def test_anonymous_badge_is_cached_until_a_price_changes(self):
+        self.client.logout()
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.assertEqual(self.summary(), {'count': 1, 'total': Decimal('2.50')})
+        request = RequestFactory().get('/')
+        request.COOKIES[CART_COOKIE] = self.client.cookies[CART_COOKIE].value
+        request.user = AnonymousUser()
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_context(request)['cart_summary']['total'], Decimal('2.50'))
+
+        self.product.price = Decimal('3.00')
+        self.product.save()
+        self.assertEqual(self.summary()['total'], Decimal('3.00'))
+
+
+########## PASS ##########
+class BulkCartUpdateTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='bulk', password='testpassword')
+        self.client.login(username='bulk', password='testpassword')
+        self.products = [
+            Product.objects.create(name=f'Herb {i}', description='', price=Decimal('2.00'), category='seed',
+                                   image='static/images/products/test.jpg', stock=5)
+            for i in range(3)
+        ]
+        for product in self.products:
+            self.client.get(reverse('add_to_cart', args=[product.id]))
+        self.items = list(CartItem.objects.filter(user=self.user).order_by('product_id'))
+
+    def post(self, quantities, **extra):
+        data = {'item': [item.id for item in self.items], 'quantity': quantities}
+        return self.client.post(reverse('update_cart_bulk'), data, **extra)
+
+    def test_updates_and_removes_in_one_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([3, 0, 2], HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cart'], {'count': 2, 'total': '10.00'})
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')),
+                         {self.products[0].id: 3, self.products[2].id: 2})
+        self.assertEqual([p.stock for p in Product.objects.order_by('id')], [2, 5, 3])
+        # Only the changed lines touch stock; the cart is loaded once
+        self.assertEqual(len([q for q in queries if 'JOIN "store_stockhold"' in q['sql']]), 1)
+
+    def test_shortage_changes_nothing(self):
+        response = self.post([2, 9, 1], follow=True)
+        self.assertRedirects(response, reverse('cart_view'))
+        self.assertContains(response, 'Only 5 Herb 1 available in stock.')
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [1, 1, 1])
+        self.assertEqual([p.stock for p in Product.objects.order_by('id')], [4, 4, 4])
+
+    def test_anonymous_cart(self):
+        self.client.logout()
+        product = self.products[0]
+        self.client.get(reverse('add_to_cart', args=[product.id]))
+        response = self.client.post(reverse('update_cart_bulk'), {'item': [product.id], 'quantity': [4]},
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['cart'], {'count': 1, 'total': '8.00'})
+
+
+########## PASS ##########
+class AjaxAddToCartTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ajax', password='testpassword')
+        self.client.login(username='ajax', password='testpassword')
+        self.product = Product.objects.create(name='Chard', description='Seeds', price=Decimal('1.50'),
+                                              category='seed', image='static/images/products/test.jpg', stock=1)
+        self.url = reverse('add_to_cart', args=[self.product.id])
+
+    def test_json_response(self):
+        with self.assertTemplateNotUsed('store/product_list.html'):
+            response = self.client.post(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json(), {
+            'ok': True, 'message': 'Chard has been added to your cart successfully!',
+            'stock': 0, 'cart': {'count': 1, 'total': '1.50'},
+        })
+        # No flash message is left behind for the next page
+        self.assertEqual(len(get_messages(response.wsgi_request)), 0)
+
+        response = self.client.post(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['ok'])
+
+    def test_browsers_still_get_a_redirect(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html,application/xhtml+xml,*/*;q=0.8')
+        self.assertRedirects(response, reverse('product_list'))
+
+
+########## PASS ##########
+class CartTotalsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='totals', password='testpassword')
+        self.client.login(username='totals', password='testpassword')
+
+    def fill_cart(self, size):
+        for i in range(size):
+            product = Product.objects.create(name=f'Seed {i}', description='', price=Decimal('0.10') * (i + 1),
+                                             category='seed', image='static/images/products/test.jpg', stock=10)
+            CartItem.objects.create(user=self.user, product=product, quantity=3)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_the_cart(self):
+        self.fill_cart(2)
+        small = [self.count_queries(reverse(name))[1] for name in ('cart_view', 'checkout')]
+        self.fill_cart(20)
+        large = [self.count_queries(reverse(name))[1] for name in ('cart_view', 'checkout')]
+        self.assertEqual(small, large)
+
+    def test_totals_are_exact(self):
+        self.fill_cart(3)
+        response, queries = self.count_queries(reverse('cart_view'))
+        # 3 x (0.10 + 0.20 + 0.30)
+        self.assertEqual(response.context['cart_total'], Decimal('1.80'))
+        self.assertEqual([item.line_total for item in response.context['cart_items']],
+                         [Decimal('0.30'), Decimal('0.60'), Decimal('0.90')])
+        self.assertContains(response, 'Total: $1.80')
+
+    def test_whole_dollar_totals_keep_their_cents(self):
+        product = Product.objects.create(name='Bean', description='', price=Decimal('1.00'),
+                                         category='seed', image='static/images/products/test.jpg', stock=10)
+        CartItem.objects.create(user=self.user, product=product, quantity=2)
+        response = self.client.get(reverse('cart_view'))
+        self.assertContains(response, 'Total: $2.00')
+        self.assertContains(response, '$2.00</td>')
+        self.assertEqual(str(cache.get(f'cart:summary:{self.user.pk}')['total']), '2.00')
+
+
+########## PASS ##########
+from .admin import ProductAdminForm
+from .models import StockMovement, StockRollup
+
+
+class InventoryLedgerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ledger', password='testpassword')
+        self.client.login(username='ledger', password='testpassword')
+        self.product = Product.objects.create(name='Onion', description='Sets', price=Decimal('1.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=10)
+
+    def reconcile(self):
+        return inventory.reconcile(now=timezone.now() + inventory.ROLLUP_LAG)
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('pk').values_list('delta', 'reason'))
+
+    def test_every_stock_change_is_recorded(self):
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        item = CartItem.objects.get(user=self.user)
+        self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 3})
+        self.client.post(reverse('update_cart', args=[item.id]), {'quantity': 2})
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        inventory.release_expired()
+        self.assertEqual(self.movements(), [
+            (10, 'opening'), (-1, 'reserve'), (-2, 'reserve'), (1, 'release'), (2, 'expire'),
+        ])
+        self.assertEqual(self.reconcile(), [])
+        self.assertEqual(StockRollup.objects.get(product=self.product).quantity, 10)
+
+    def test_product_form_applies_a_difference(self):
+        form = ProductForm(instance=self.product)
+        seen = form['stock_seen'].value()
+        inventory.take_stock(self.product.id, 2)  # A sale while the admin edits
+        form = ProductForm({'name': 'Onion', 'description': 'Sets', 'price': '1.00', 'category': 'seed',
+                            'stock': 15, 'stock_seen': seen}, instance=Product.objects.get(pk=self.product.pk))
+        self.assertTrue(form.is_valid(), form.errors)
+        product = form.save()
+        self.assertEqual(product.stock, 13)
+        self.assertEqual(Product.objects.get(pk=product.pk).stock, 13)
+        self.assertEqual(self.movements()[-1], (5, 'adjustment'))
+        self.assertEqual(self.reconcile(), [])
+
+    def test_admin_edits_stock_through_the_ledger(self):
+        User.objects.create_superuser(username='keeper', password='testpassword')
+        self.client.login(username='keeper', password='testpassword')
+        url = reverse('admin:store_product_change', args=[self.product.pk])
+        self.assertNotContains(self.client.get(url), 'name="stock"')
+        self.assertContains(self.client.get(reverse('admin:store_product_add')), 'name="stock"')  # Opening stock
+        inventory.take_stock(self.product.id, 2)  # A sale while the admin edits
+        clean = ProductAdminForm.clean
+
+        def resize_meanwhile(form):
+            # The resize job records its widths after the admin loaded the product
+            Product.objects.filter(pk=self.product.pk).update(image_widths=[320, 640])
+            return clean(form)
+
+        with patch.object(ProductAdminForm, 'clean', resize_meanwhile):
+            response = self.client.post(url, {'name': 'Onion sets', 'description': 'Sets', 'price': '1.00',
+                                              'category': 'seed', 'adjust_stock': '-3'})
+        self.assertEqual(response.status_code, 302)
+        product = Product.objects.get(pk=self.product.pk)
+        self.assertEqual((product.name, product.stock, product.image_widths), ('Onion sets', 5, [320, 640]))
+        self.assertEqual(self.movements()[-1], (-3, 'adjustment'))
+        self.assertEqual(self.reconcile(), [])
+
+    def test_reconcile_is_incremental_and_flags_drift(self):
+        self.assertEqual(self.reconcile(), [])
+        first = StockRollup.objects.get(product=self.product).movement_id
+        inventory.take_stock(self.product.id, 4)
+        Product.objects.filter(pk=self.product.pk).update(stock=3)  # Shrinkage nobody recorded
+        self.assertEqual(self.reconcile(), [(self.product.pk, 3, 6)])
+        rollup = StockRollup.objects.get(product=self.product)
+        self.assertGreater(rollup.movement_id, first)
+        self.assertEqual(rollup.quantity, 6)
+        out = io.StringIO()
+        call_command('reconcile_inventory', stdout=out)
+        self.assertIn('stock is 3, movements add up to 6 (-3)', out.getvalue())
+
+    def test_movements_are_append_only(self):
+        movement = StockMovement.objects.first()
+        with self.assertRaises(ValueError):
+            movement.save()
+
+
+########## PASS ##########
+from .cart import sweep_abandoned
+
+
+class AbandonedCartSweepTestCase(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='Kale', description='Seeds', price=Decimal('2.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=20)
+
+    def make_cart(self, username, quantity, age):
+        user = User.objects.create_user(username=username)
+        item = CartItem.objects.create(user=user, product=self.product, quantity=quantity)
+        self.assertTrue(inventory.reserve(item, quantity))
+        CartItem.objects.filter(pk=item.pk).update(updated_at=timezone.now() - age)
+        return user
+
+    def test_sweeps_only_stale_carts_and_returns_stock(self):
+        stale = [self.make_cart(f'stale{i}', 2, timedelta(days=40)) for i in range(5)]
+        fresh = self.make_cart('fresh', 3, timedelta(days=1))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+
+        out = io.StringIO()
+        call_command('sweep_abandoned_carts', days=30, batch_size=2, stdout=out)
+        self.assertIn('Swept 5 abandoned carts (5 items, 10 units of stock returned)', out.getvalue())
+        self.assertEqual(list(CartItem.objects.values_list('user', flat=True)), [fresh.pk])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 17)
+        self.assertEqual(inventory.reconcile(now=timezone.now() + inventory.ROLLUP_LAG), [])
+
+    def test_recent_activity_on_any_item_keeps_the_cart(self):
+        user = self.make_cart('mixed', 1, timedelta(days=40))
+        other = Product.objects.create(name='Spade', description='Tool', price=Decimal('9.00'),
+                                       category='supply', image='static/images/products/test.jpg', stock=5)
+        CartItem.objects.create(user=user, product=other)
+        self.assertEqual(sweep_abandoned(timezone.now() - timedelta(days=30)), (0, 0, 0))
+        self.assertEqual(CartItem.objects.filter(user=user).count(), 2)
+
+
+########## PASS ##########
+import logging
+
+from django.core.management.base import CommandError
+from .loadtest import PREFIX, VIEWS
+
+
+class LoadTestHarnessTestCase(TransactionTestCase):
+    def test_load_test_reports_every_view_and_cleans_up(self):
+        # SQLite turns concurrent writers away with errors, which the report counts
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        out = io.StringIO()
+        call_command('load_test', users=4, iterations=2, products=5, stock=4, stdout=out)
+        output = out.getvalue()
+        for view in VIEWS:
+            self.assertIn(view, output)
+        self.assertIn('Stock invariants held.', output)
+        self.assertFalse(Product.objects.filter(name__startswith=PREFIX).exists())
+        self.assertFalse(User.objects.filter(username__startswith=PREFIX).exists())
+
+    def test_refuses_a_production_database(self):
+        with patch.dict(connection.settings_dict, NAME='shop'):
+            with self.assertRaisesMessage(CommandError, '--i-know-this-is-production'):
+                call_command('load_test', users=1, iterations=1, products=1, stdout=io.StringIO())
+        self.assertFalse(Product.objects.filter(name__startswith=PREFIX).exists())
+
+
+########## PASS ##########
+import importlib
+from django.apps import apps
+
+
+class OrderLineTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='gardener', password='testpassword')
+        self.client.login(username='gardener', password='testpassword')
+        self.products = [
+            Product.objects.create(name=f'Seed {i}', description='Seeds', price=Decimal('1.50') + i,
+                                   category='seed', image='static/images/products/test.jpg', stock=10)
+            for i in range(5)
+        ]
+        self.order = Order.objects.create(user=self.user, total_amount=Decimal('20.00'))
+        OrderLine.objects.bulk_create(
+            OrderLine(order=self.order, product=product, name=product.name, unit_price=product.price, quantity=2)
+            for product in self.products
+        )
+
+    def test_detail_loads_the_order_and_its_lines_in_two_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_detail', args=[self.order.id]))
+        self.assertEqual(len(response.context['order_items']), 5)
+        order_queries = [q for q in queries if '"store_order' in q['sql']]
+        self.assertEqual(len(order_queries), 2)
+
+    def test_detail_shows_the_price_paid_and_survives_deleted_products(self):
+        self.products[0].price = Decimal('99.00')
+        self.products[0].save()
+        self.products[1].delete()
+        response = self.client.get(reverse('order_detail', args=[self.order.id]))
+        self.assertContains(response, '$1.50')
+        self.assertNotContains(response, '$99.00')
+        self.assertContains(response, 'Seed 1')
+
+    def test_backfill_from_json_items(self):
+        legacy = Order.objects.create(user=self.user, items=[
+            {'product_id': self.products[2].id, 'quantity': 3},
+            {'product_id': 999999, 'quantity': 1},
+        ])
+        migration = importlib.import_module('store.migrations.0018_order_lines')
+        migration.backfill_order_lines(apps, None)
+        self.assertEqual(list(legacy.lines.values_list('product', 'name', 'unit_price', 'quantity')), [
+            (self.products[2].id, 'Seed 2', Decimal('3.50'), 3),
+            (None, 'Product #999999', Decimal('0.00'), 1),
+        ])
+
+
+########## PASS ##########
+from django.core import mail
+from core.models import OutboxEmail
+from core.outbox import drain
+from .fake_stripe import WEBHOOK_SECRET, FakeStripe
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=WEBHOOK_SECRET)
+class StripeWebhookTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='grower', password='testpassword')
+        self.client.login(username='grower', password='testpassword')
+        self.product = Product.objects.create(name='Leek', description='Seeds', price=Decimal('3.00'),
+                                              category='seed', image='static/images/products/test.jpg', stock=10)
+        self.client.get(reverse('add_to_cart', args=[self.product.id]))
+        self.client.post(reverse('update_cart', args=[CartItem.objects.get().pk]), {'quantity': 3})
+        self.fake = FakeStripe()
+        self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__, None, None, None)
+
+    def check_out(self):
+        response = self.client.post(reverse('checkout'), {
+            'first_name': 'Ada', 'last_name': 'Grower', 'email': 'ada@example.com', 'address': '2 Allotment Row',
+            'city': 'York', 'state': 'Yorkshire', 'zip_code': 'YO1 7HH',
+        })
+        checkout = CheckoutSession.objects.get()
+        self.assertRedirects(response, f'{self.fake.url}/pay/{checkout.session_id}', fetch_redirect_response=False)
+        return checkout
+
+    def deliver(self, event):
+        payload, signature = event
+        return self.client.post(reverse('stripe_webhook'), payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=signature)
+
+    def test_paid_session_becomes_one_order_however_often_it_is_delivered(self):
+        checkout = self.check_out()
+        self.assertEqual(self.fake.sessions[checkout.session_id]['amount_total'], 900)
+        event = self.fake.pay(checkout.session_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.deliver(event).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.deliver(event).status_code, 200)
+
+        order = Order.objects.get()
+        self.assertEqual(order.total_amount, Decimal('9.00'))
+        self.assertEqual(list(order.lines.values_list('name', 'quantity')), [('Leek', 3)])
+        checkout.refresh_from_db()
+        self.assertEqual((checkout.status, checkout.order), (CheckoutSession.COMPLETE, order))
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockHold.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)
+        self.assertEqual(OutboxEmail.objects.get().to, ['ada@example.com'])
+        drain()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Leek', mail.outbox[0].body)
+
+    def test_success_page_only_reads_order_state(self):
+        checkout = self.check_out()
+        requests_before = len(self.fake.requests)
+        url = reverse('payment_success') + f'?session_id={checkout.session_id}'
+        self.assertContains(self.client.get(url), 'Confirming Your Payment')
+        self.deliver(self.fake.pay(checkout.session_id))
+        self.assertContains(self.client.get(url), 'Payment Successful')
+        self.assertContains(self.client.get(url), 'Payment Successful')
+        self.assertEqual(len(self.fake.requests), requests_before)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_cart_changed_while_paying(self):
+        checkout = self.check_out()
+        self.client.post(reverse('update_cart', args=[CartItem.objects.get().pk]), {'quantity': 5})
+        self.deliver(self.fake.pay(checkout.session_id))
+        self.assertEqual(Order.objects.get().lines.get().quantity, 3)
+        self.assertEqual(CartItem.objects.get().quantity, 2)  # The units added while paying are still wanted
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 7)  # Their holds went back until the next checkout
+        self.assertEqual(inventory.reconcile(now=timezone.now() + inventory.ROLLUP_LAG), [])
+
+    def test_rejects_unsigned_events(self):
+        checkout = self.check_out()
+        payload, signature = self.fake.pay(checkout.session_id)
+        response = self.deliver((payload, signature.replace('v1=', 'v1=0')))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_unconfigured_secret_is_a_bad_request(self):
+        checkout = self.check_out()
+        with override_settings(STRIPE_WEBHOOK_SECRET=None):
+            self.assertEqual(self.deliver(self.fake.pay(checkout.session_id)).status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_expired_session(self):
+        checkout = self.check_out()
+        self.assertEqual(self.deliver(self.fake.expire(checkout.session_id)).status_code, 200)
+        checkout.refresh_from_db()
+        self.assertEqual(checkout.status, CheckoutSession.EXPIRED)
+        self.assertFalse(Order.objects.exists())
+
+
+########## PASS ##########
+from .models import StripePrice
+
+
+class StripeLineItemsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='planter', password='testpassword')
+        self.client.login(username='planter', password='testpassword')
+        self.products = [
+            Product.objects.create(name=name, description='Seeds', price=price, category='seed',
+                                   image='static/images/products/test.jpg', stock=10)
+            for name, price in (('Chard', Decimal('2.49')), ('Radish', Decimal('1.99')))
+        ]
+        cart = DatabaseCart(self.user)
+        for product, quantity in zip(self.products, (2, 3)):
+            cart.add(product)
+            cart.update(CartItem.objects.get(product=product).pk, quantity)
+        self.fake = FakeStripe()
+        self.fake.__enter__()
+        self.addCleanup(self.fake.__exit__, None, None, None)
+
+    def check_out(self):
+        self.client.post(reverse('checkout'), {
+            'first_name': 'Ada', 'last_name': 'Grower', 'email': 'ada@example.com', 'address': '2 Allotment Row',
+            'city': 'York', 'state': 'Yorkshire', 'zip_code': 'YO1 7HH',
+        })
+        return self.fake.sessions[CheckoutSession.objects.latest('pk').session_id]
+
+    def stripe_creates(self):
+        return [path for method, path in self.fake.requests if method == 'POST' and path != '/v1/checkout/sessions']
+
+    def test_checkout_sends_one_line_item_per_product(self):
+        session = self.check_out()
+        prices = {StripePrice.objects.get(product=product).price_id: product for product in self.products}
+        self.assertEqual([(prices[item['price']].name, item['quantity']) for item in session['line_items']],
+                         [('Chard', '2'), ('Radish', '3')])
+        self.assertEqual(session['amount_total'], 2 * 249 + 3 * 199)
+        self.assertEqual(len(self.stripe_creates()), 4)  # A Product and a Price each
+
+    def test_mapping_is_reused_until_the_price_changes(self):
+        self.check_out()
+        self.fake.requests.clear()
+        self.check_out()
+        self.assertEqual(self.stripe_creates(), [])
+
+        self.products[0].price = Decimal('2.99')
+        self.products[0].save()
+        Product.objects.filter(pk=self.products[1].pk).update(price=Decimal('0.99'))
+        session = self.check_out()
+        self.assertEqual(self.stripe_creates(), ['/v1/prices', '/v1/prices'])
+        self.assertEqual(session['amount_total'], 2 * 299 + 3 * 99)
+
+    def test_a_price_created_while_waiting_for_the_lock_is_reused(self):
+        self.check_out()
+        self.fake.requests.clear()
+        # As a checkout that read the mapping before another one created it would
+        price_id = payments.create_price(self.products[0], 249)
+        self.assertEqual(price_id, StripePrice.objects.get(product=self.products[0]).price_id)
+        self.assertEqual(self.stripe_creates(), [])
+
+    def test_cached_prices_cost_one_query(self):
+        payments.price_ids(self.products)
+        with self.assertNumQueries(1):
+            payments.price_ids(self.products)
+
+
+########## PASS ##########
+from .pagination import ORDERS_PER_PAGE, encode_cursor
+
+
+class OrderHistoryTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='regular', password='testpassword')
+        self.client.login(username='regular', password='testpassword')
+        product = Product.objects.create(name='Cress', description='Seeds', price=Decimal('1.00'), category='seed',
+                                         image='static/images/products/test.jpg', stock=10)
+        self.orders = [Order.objects.create(user=self.user, total_amount=Decimal(i))
+                       for i in range(ORDERS_PER_PAGE * 2 + 5)]
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, product=product, name='Cress', unit_price=Decimal('1.00'), quantity=i + 1)
+            for order in self.orders for i in range(order.pk % 3)
+        )
+        Order.objects.create(user=User.objects.create_user(username='someone'))
+
+    def test_first_page_is_one_query_with_annotated_counts(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('order_list'))
+        order_queries = [q['sql'] for q in queries if '"store_order"' in q['sql']]
+        self.assertEqual(len(order_queries), 1)
+        self.assertIn(f'LIMIT {ORDERS_PER_PAGE + 1}', order_queries[0])
+        self.assertNotIn('"store_order"."items"', order_queries[0])
+
+        page = response.context['orders']
+        self.assertEqual([order.pk for order in page], [order.pk for order in self.orders[::-1][:ORDERS_PER_PAGE]])
+        for order in page:
+            lines = order.pk % 3
+            self.assertEqual((order.item_count, order.total_quantity), (lines, lines * (lines + 1) // 2))
+        self.assertContains(response, 'Older &raquo;')
+
+    def test_walks_every_page(self):
+        seen = []
+        url = reverse('order_list')
+        while url:
+            page = self.client.get(url).context['orders']
+            seen.extend(order.pk for order in page)
+            url = f"{reverse('order_list')}?cursor={page.next_cursor}" if page.has_next else None
+        self.assertEqual(seen, [order.pk for order in reversed(self.orders)])
+
+    def test_bad_cursor_shows_the_first_page(self):
+        response = self.client.get(reverse('order_list') + '?cursor=nonsense')
+        self.assertEqual(len(response.context['orders']), ORDERS_PER_PAGE)
+        response = self.client.get(reverse('order_list'), {'cursor': encode_cursor('notadate', 1)})
+        self.assertEqual(len(response.context['orders']), ORDERS_PER_PAGE)
+
+    def test_opening_an_order_is_bounded(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('order_detail', args=[self.orders[-1].pk]))
+        self.assertEqual(len([q for q in queries if '"store_order' in q['sql']]), 2)
@@ -0,0 +1,87 @@
+import threading
+import unicodedata
+from bisect import bisect_left
+
+from django.urls import reverse
+
+from .cache import get_version
+
+# Bumped whenever a product name or an article title changes
+TYPEAHEAD = 'typeahead'
+MAX_RESULTS = 8
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower().strip()
+
+
+class PrefixIndex:
+    """
+    Sorted array of every word-starting suffix of every title, so a
+    prefix lookup is one binary search followed by a short forward scan.
+    """
+
+    def __init__(self, entries):
+        # entries are dicts with at least a 'title' key
+        self.entries = list(entries)
+        keys = []
+        for position, entry in enumerate(self.entries):
+            title = normalize(entry['title'])
+            for offset, char in enumerate(title):
+                if char.isalnum() and (offset == 0 or not title[offset - 1].isalnum()):
+                    keys.append((title[offset:], position))
+        keys.sort()
+        self.keys = [key for key, position in keys]
+        self.positions = [position for key, position in keys]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, prefix, limit=MAX_RESULTS):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        for i in range(bisect_left(self.keys, prefix), len(self.keys)):
+            if not self.keys[i].startswith(prefix):
+                break
+            position = self.positions[i]
+            if position not in seen:
+                seen.add(position)
+                results.append(self.entries[position])
+                if len(results) == limit:
+                    break
+        return results
+
+
+def build_entries():
+    from articles.models import Article
+    from .models import Product
+
+    for pk, name in Product.objects.values_list('pk', 'name').iterator():
+        yield {'title': name, 'type': 'product', 'url': reverse('product_detail', args=[pk])}
+    for pk, title in Article.objects.values_list('pk', 'title').iterator():
+        yield {'title': title, 'type': 'article', 'url': reverse('article_detail', args=[pk])}
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """ The in-process index, rebuilt lazily the first time it is used after a change """
+    global _index, _index_version
+    version = get_version(TYPEAHEAD)
+    if _index is None or _index_version != version:
+        with _lock:
+            if _index is None or _index_version != version:
+                _index = PrefixIndex(build_entries())
+                _index_version = version
+    return _index
+
+
+def suggest(prefix, limit=MAX_RESULTS):
+    return get_index().lookup(prefix, limit)
@@ -1,17 +1,23 @@
 from django.urls import path
-from .views import product_list, product_detail, add_to_cart, cart_view, update_cart, delete_cart_item 
-from .views import checkout, payment_success, payment_cancel, order_detail, order_list, add_product, edit_product, delete_product
+from .views import product_list, product_detail, autocomplete, add_to_cart, cart_view, update_cart, update_cart_bulk, delete_cart_item
+from .api import product_list_api, product_detail_api
+from .views import checkout, payment_success, payment_cancel, stripe_webhook, order_detail, order_list, add_product, edit_product, delete_product
 
 urlpatterns = [
     path('products/', product_list, name='product_list'),
     path('products/<int:pk>/', product_detail, name='product_detail'),
+    path('autocomplete/', autocomplete, name='autocomplete'),
+    path('api/products/', product_list_api, name='product_list_api'),
+    path('api/products/<int:pk>/', product_detail_api, name='product_detail_api'),
     path('add-to-cart/<int:product_id>/', add_to_cart, name='add_to_cart'), 
     path('cart/', cart_view, name='cart_view'),
     path('update-cart/<int:item_id>/', update_cart, name='update_cart'), 
+    path('update-cart/', update_cart_bulk, name='update_cart_bulk'),
     path('delete-cart-item/<int:item_id>/', delete_cart_item, name='delete_cart_item'),
     path('checkout/', checkout, name='checkout'),
     path('success/', payment_success, name='payment_success'),
     path('cancel/', payment_cancel, name='payment_cancel'),
+    path('stripe/webhook/', stripe_webhook, name='stripe_webhook'),
     path('orders/', order_list, name='order_list'), 
     path('orders/<int:order_id>/', order_detail, name='order_detail'),
     #### Superuser access
@@ -1,86 +1,183 @@
 from django.shortcuts import render, get_object_or_404 ,redirect,reverse
 from django.contrib.auth.decorators import login_required
-from .models import Product, CartItem, Order
+from .models import Product, Order, OrderLine, CheckoutSession
 from django.contrib import messages
-from django.core.mail import send_mail
 from .forms import ShippingForm , ProductForm
 import stripe
 from django.conf import settings
-from datetime import datetime, timedelta
 from django.contrib.auth.decorators import user_passes_test
-from django.http import HttpResponseForbidden
-from random import sample
-
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from .search import search_products
+from .pagination import ORDERS_PER_PAGE, InvalidCursor, paginate, sort_options
+from .related import related_products
+from . import cache as catalog_cache
+from . import inventory, payments
+from .cart import CartFull, NotEnoughStock, StockShortage, get_cart
+from .facets import apply_filters, build_facets, facet_counts, parse_filters
+from .typeahead import suggest
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.http import JsonResponse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from core.conditional import page_etag
+
+def catalog_etag(request, *args, **kwargs):
+    # The catalog version changes with every product edit, so no database access is needed
+    return page_etag(request, catalog_cache.get_version(), request.get_full_path())
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=catalog_etag)
 def product_list(request):
     query = request.GET.get('q', '')
-    if query:
-        products = Product.objects.filter(name__icontains=query)
-    else:
-        products = Product.objects.all()
-    category = request.GET.get('category', 'all')
-    if category != 'all':
-        products = products.filter(category__iexact=category)
+    filters = parse_filters(request.GET)
+    category = filters['category']
+    facet_key = (query, category.lower(), filters['price'], filters['in_stock'])
+    searched = []
+
+    def matching_products():
+        # Searching looks the words up in the term index, so it only runs on a cache miss, once
+        if not searched:
+            searched.append(search_products(query) if query else Product.objects.all())
+        return searched[0]
+
+    counts = catalog_cache.get_or_build(lambda: facet_counts(matching_products(), filters), 'facets', *facet_key)
+
+    sorts = sort_options(query)
+    sort = request.GET.get('sort', '')
+    if sort not in sorts:
+        sort = next(iter(sorts))
+    cursor = request.GET.get('cursor')
+
+    def build_page():
+        products = apply_filters(matching_products(), filters)
+        try:
+            return paginate(products, sorts[sort][0], cursor)
+        except InvalidCursor:
+            return paginate(products, sorts[sort][0])
+
+    page = catalog_cache.get_or_build(build_page, 'product_list', *facet_key, sort, cursor)
     context = {
-        'products': products,
+        'products': page,
+        'page': page,
         'category': category,
+        'price': filters['price'],
+        'in_stock': filters['in_stock'],
+        'facets': build_facets(counts),
         'query': query,
+        'sort': sort,
+        'sort_options': [(key, label) for key, (ordering, label) in sorts.items()],
     }
     return render(request, 'store/product_list.html', context)
 
 
+def autocomplete(request):
+    # Served from the in-process prefix index, without touching the database
+    return JsonResponse({'results': suggest(request.GET.get('q', ''))})
+
+
+def product_detail_etag(request, pk):
+    # Stock changes only bump the product's own version, see store.inventory
+    stock_version = catalog_cache.get_version(catalog_cache.product_namespace(pk))
+    return page_etag(request, catalog_cache.get_version(), stock_version, request.get_full_path())
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=product_detail_etag)
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    all_products = Product.objects.exclude(pk=product.pk)
-    related_products = sample(list(all_products), min(4, all_products.count()))
+    def build_detail():
+        product = get_object_or_404(Product, pk=pk)
+        return product, related_products(product)
+
+    stock_version = catalog_cache.get_version(catalog_cache.product_namespace(pk))
+    product, related = catalog_cache.get_or_build(build_detail, 'product_detail', pk, stock_version)
     return render(request, 'store/product_detail.html', {
         'product': product,
-        'related_products': related_products
+        'related_products': related
     })
 
-@login_required
+def _wants_json(request):
+    # fetch() callers ask for JSON explicitly; browsers and */* get HTML
+    return request.get_preferred_type(['text/html', 'application/json']) == 'application/json'
+
+
 def add_to_cart(request, product_id):
+    """ Add one unit; answers JSON for the fetch() call in scripts.js and redirects everyone else """
     product = get_object_or_404(Product, id=product_id)
-    if product.stock > 0:
-        cart_item, created = CartItem.objects.get_or_create(user=request.user, product=product)
-        if not created:
-            cart_item.quantity += 1
-        cart_item.save()
-        product.stock -= 1
-        product.save()
-        messages.success(request, f'{product.name} has been added to your cart successfully!')
+    cart = get_cart(request)
+    try:
+        cart.add(product)
+    except NotEnoughStock:
+        ok, message = False, 'Sorry, this product is out of stock.'
+    except CartFull as e:
+        ok, message = False, str(e)
     else:
-        messages.error(request, 'Sorry, this product is out of stock.')
+        ok, message = True, f'{product.name} has been added to your cart successfully!'
+
+    if _wants_json(request):
+        stock = Product.objects.filter(pk=product.pk).values_list('stock', flat=True).first()
+        return JsonResponse({'ok': ok, 'message': message, 'stock': stock, 'cart': cart.summary()},
+                            status=200 if ok else 409)
+    if ok:
+        messages.success(request, message)
+    else:
+        messages.error(request, message)
     return redirect('product_list')
 
 
 
-@login_required
 def cart_view(request):
-    cart_items = CartItem.objects.filter(user=request.user)
-    return render(request, 'store/cart.html', {'cart_items': cart_items})
+    contents = get_cart(request).contents()
+    return render(request, 'store/cart.html', {'cart_items': contents.items, 'cart_total': contents.total})
 
-@login_required
 def update_cart(request, item_id):
-    cart_item = CartItem.objects.get(id=item_id)
+    cart = get_cart(request)
     if request.method == 'POST':
         quantity = int(request.POST.get('quantity'))
-        if quantity > cart_item.product.stock:
-            messages.error(request, f"Only {cart_item.product.stock} items available in stock.")
-        elif quantity > 0:
-            cart_item.quantity = quantity
-            cart_item.save()
-            messages.success(request, 'Cart updated successfully.')
+        if quantity > 0:
+            try:
+                cart.update(item_id, quantity)
+            except NotEnoughStock as e:
+                messages.error(request, str(e))
+            else:
+                messages.success(request, 'Cart updated successfully.')
         else:
-            cart_item.delete()
+            cart.remove(item_id)
             messages.success(request, 'Item removed from cart.')
     return redirect('cart_view')
 
 
 
-@login_required
+@require_POST
+def update_cart_bulk(request):
+    """ Update every quantity of the cart form in one request; answers JSON to clients that ask for it """
+    cart = get_cart(request)
+    try:
+        quantities = {int(pk): int(quantity)
+                      for pk, quantity in zip(request.POST.getlist('item'), request.POST.getlist('quantity'))}
+    except ValueError:
+        quantities, errors = {}, ['Quantities must be whole numbers.']
+    else:
+        try:
+            cart.update_many(quantities)
+            errors = []
+        except StockShortage as e:
+            errors = e.messages
+
+    if _wants_json(request):
+        return JsonResponse({'ok': not errors, 'errors': errors, 'cart': cart.summary()}, status=409 if errors else 200)
+    for error in errors:
+        messages.error(request, error)
+    if not errors:
+        messages.success(request, 'Cart updated successfully.')
+    return redirect('cart_view')
+
+
+
 def delete_cart_item(request, item_id):
-    cart_item = CartItem.objects.get(id=item_id, user=request.user)
-    cart_item.delete()
+    get_cart(request).remove(item_id)
     messages.success(request, 'Item removed from cart.')
     return redirect('cart_view')
 
@@ -88,52 +185,33 @@ def delete_cart_item(request, item_id):
 stripe.api_key = settings.STRIPE_SECRET_KEY
 @login_required
 def checkout(request):
-    cart_items = CartItem.objects.filter(user=request.user)
+    contents = get_cart(request).contents()
+    cart_items = contents.items
     if request.method == 'POST':
         form = ShippingForm(request.POST)
         if form.is_valid():
-            first_name = form.cleaned_data['first_name']
-            last_name = form.cleaned_data['last_name']
-            email = form.cleaned_data['email']
-            address = form.cleaned_data['address']
-            city = form.cleaned_data['city']
-            state = form.cleaned_data['state']
-            zip_code = form.cleaned_data['zip_code']
-            
-            amount = int(sum(item.quantity * item.product.price for item in cart_items) * 100)
-            
+            # Holds may have lapsed while the cart sat idle, take the stock again
+            unavailable = inventory.reserve_cart(cart_items)
+            if unavailable:
+                names = ', '.join(item.product.name for item in unavailable)
+                messages.error(request, f'Sorry, there is no longer enough stock for: {names}.')
+                return redirect('cart_view')
+
             session = stripe.checkout.Session.create(
                 payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'unit_amount': amount,
-                        'product_data': {
-                            'name': 'Order from Kitchen Garden'
-                        },
-                    },
-                    'quantity': 1,
-                }],
+                line_items=payments.line_items(contents),
                 mode='payment',
                 success_url=request.build_absolute_uri(reverse('payment_success')) + '?session_id={CHECKOUT_SESSION_ID}',
                 cancel_url=request.build_absolute_uri(reverse('payment_cancel')),
             )
-            request.session['checkout_data'] = {
-                'first_name': first_name,
-                'last_name': last_name,
-                'email': email,
-                'address': address,
-                'city': city,
-                'state': state,
-                'zip_code': zip_code,
-                'amount': amount / 100
-            }
+            payments.start(session.id, request.user, form.cleaned_data, contents)
             return redirect(session.url)
     else:
         form = ShippingForm()
 
     context = {
         'cart_items': cart_items,
+        'cart_total': contents.total,
         'form': form,
         'stripe_public_key': settings.STRIPE_PUBLIC_KEY
     }
@@ -142,87 +220,33 @@ def checkout(request):
 
 
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
 @login_required
 def payment_success(request):
+    """ Only reads the order; the Stripe webhook creates it, possibly a moment after the customer lands here """
     session_id = request.GET.get('session_id')
-    checkout_data = request.session.pop('checkout_data', None)  # Pop to ensure it's only used once
-
-    if session_id and checkout_data:
-        session = stripe.checkout.Session.retrieve(session_id)
-
-        if session.payment_status == 'paid':
-            delivery_cost = 0.00  # Free shipping for now
-            shipping_date = datetime.now() + timedelta(days=5)  # Shipping date 5 days from now
-
-            order_items = [
-                {"product_id": item.product.id, "quantity": item.quantity}
-                for item in CartItem.objects.filter(user=request.user)
-            ]
-            total_amount_with_delivery = checkout_data['amount'] + delivery_cost  # Add delivery cost to total amount
-
-            order = Order.objects.create(
-                user=request.user,
-                first_name=checkout_data['first_name'],
-                last_name=checkout_data['last_name'],
-                email=checkout_data['email'],
-                address=checkout_data['address'],
-                city=checkout_data['city'],
-                state=checkout_data['state'],
-                zip_code=checkout_data['zip_code'],
-                items=order_items,
-                total_amount=total_amount_with_delivery,
-                delivery_cost=delivery_cost,
-                shipping_date=shipping_date
-            )
-
-            CartItem.objects.filter(user=request.user).delete()
-
-            detailed_order_items = []
-            for item in order.items:
-                product = get_object_or_404(Product, id=item['product_id'])
-                detailed_order_items.append({
-                    'product': product,
-                    'quantity': item['quantity']
-                })
-
-            # Prepare email content
-            email_subject = f"Order Confirmation - {order.id}"
-            email_body = f"""
-            Thank you for your order, {order.first_name}!
-
-            Order Number: {order.id}
-            Date: {order.created_at}
-            Total Amount: ${order.total_amount}
-            Delivery Cost: ${order.delivery_cost}
-            Shipping Date: {order.shipping_date}
-
-            Shipping Address:
-            {order.first_name} {order.last_name}
-            {order.address}
-            {order.city}, {order.state} {order.zip_code}
-
-            Items:
-            """
-            for item in detailed_order_items:
-                email_body += f"""
-                - {item['product'].name}
-                  Price: ${item['product'].price}
-                  Quantity: {item['quantity']}
-                """
-
-            # Send confirmation email
-            send_mail(
-                email_subject,
-                email_body,
-                settings.DEFAULT_FROM_EMAIL,
-                [order.email],
-                fail_silently=False,
-            )
-
-            return render(request, 'store/payment_success.html', {'order': order, 'order_items': detailed_order_items})
-
-    return redirect('checkout')
+    if not session_id:
+        return redirect('checkout')
+    checkout = get_object_or_404(CheckoutSession.objects.select_related('order'),
+                                 session_id=session_id, user=request.user)
+    order = checkout.order
+    order_items = order.lines.select_related('product') if order else []
+    return render(request, 'store/payment_success.html',
+                  {'checkout': checkout, 'order': order, 'order_items': order_items})
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        # Without the secret no event can be verified; Stripe keeps retrying until it is set
+        return HttpResponseBadRequest('STRIPE_WEBHOOK_SECRET is not configured')
+    try:
+        event = stripe.Webhook.construct_event(request.body, request.headers.get('Stripe-Signature', ''),
+                                              settings.STRIPE_WEBHOOK_SECRET)
+    except (ValueError, stripe.SignatureVerificationError):
+        return HttpResponseBadRequest()
+    payments.handle_event(event)
+    return HttpResponse()
 
 
 @login_required
@@ -232,21 +256,29 @@ def payment_cancel(request):
 
 @login_required
 def order_list(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    return render(request, 'store/order_list.html', {'orders': orders})
+    """
+    Keyset pages of the user's orders, newest first, off the (user,
+    created_at) index. Line counts are correlated subqueries, so they are
+    only computed for the rows of the page, and the items JSON is not read.
+    """
+    lines = OrderLine.objects.filter(order=OuterRef('pk')).values('order')
+    orders = Order.objects.filter(user=request.user).defer('items').annotate(
+        item_count=Coalesce(Subquery(lines.annotate(n=Count('pk')).values('n')), 0),
+        total_quantity=Coalesce(Subquery(lines.annotate(n=Sum('quantity')).values('n')), 0),
+    )
+    try:
+        page = paginate(orders, '-created_at', request.GET.get('cursor'), per_page=ORDERS_PER_PAGE)
+    except InvalidCursor:
+        page = paginate(orders, '-created_at', per_page=ORDERS_PER_PAGE)
+    return render(request, 'store/order_list.html', {'orders': page, 'page': page})
 
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    order_items = []
-    for item in order.items:
-        product = get_object_or_404(Product, id=item['product_id'])
-        order_items.append({
-            'product': product,
-            'quantity': item['quantity']
-        })
-    return render(request, 'store/order_detail.html', {'order': order, 'order_items': order_items})
+    """ The order, then its lines with their products: two queries however long the order is """
+    lines = Prefetch('lines', queryset=OrderLine.objects.select_related('product'))
+    order = get_object_or_404(Order.objects.prefetch_related(lines), id=order_id, user=request.user)
+    return render(request, 'store/order_detail.html', {'order': order, 'order_items': order.lines.all()})
 
 
 